@@ -0,0 +1,99 @@
+"""
+Бенчмарк поиска аномалий (src/anomaly.py) на синтетических рядах артикулов.
+
+    python -m bench.bench_anomaly --series 20000 --days 120
+
+Генерирует --series рядов (переходы с недельной сезонностью и пуассоновским шумом,
+заказы ~ биномиально от переходов) и в последний день роняет/поднимает --anomalies рядов.
+Замеряет: сборку матрицы из строк БД (nm_matrix), оценку последнего дня по всем артикулам
+(score_nm — то, что делает сводка), rolling_z по всей истории всех рядов и наивный вариант
+на statistics.median по рядам (на подвыборке, пересчитан на все ряды). Печатает мс и
+сколько подброшенных аномалий нашлось (recall) и сколько найденных — подброшены (precision).
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from src import anomaly
+
+
+def _series(n: int, days: int, rnd: np.random.Generator) -> np.ndarray:
+    level = rnd.lognormal(3.0, 1.2, size=(n, 1))
+    weekly = 1.0 + 0.25 * np.sin(2 * np.pi * (np.arange(days) % 7) / 7 + rnd.uniform(0, 2 * np.pi, size=(n, 1)))
+    clicks = rnd.poisson(level * weekly)
+    orders = rnd.binomial(clicks, rnd.uniform(0.02, 0.12, size=(n, 1)))
+    return np.stack([clicks, orders]).astype(np.float64)  # (2, n, days)
+
+
+def _naive(x: np.ndarray, weeks: int) -> np.ndarray:
+    # по ряду: медиана и MAD того же дня недели — как было бы без numpy
+    out = np.full(x.shape[:2], np.nan)
+    for m in range(x.shape[0]):
+        for s in range(x.shape[1]):
+            base = [float(v) for v in x[m, s, -1 - 7 * weeks:-1:7]]
+            med = statistics.median(base)
+            mad = statistics.median(abs(v - med) for v in base)
+            scale = max(anomaly.MAD_SCALE * mad, abs(med) ** 0.5, 1.0)
+            out[m, s] = (x[m, s, -1] - med) / scale
+    return out
+
+
+def _ms(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1000
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--series", type=int, default=20000, help="артикулов")
+    ap.add_argument("--days", type=int, default=120, help="дней истории")
+    ap.add_argument("--anomalies", type=int, default=200, help="сколько рядов испортить в последний день")
+    ap.add_argument("--naive-sample", type=int, default=2000, help="рядов для наивного варианта")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    weeks = anomaly.ANOMALY_WEEKS
+    rnd = np.random.default_rng(args.seed)
+    x = _series(args.series, args.days, rnd)
+    hit = rnd.choice(args.series, size=args.anomalies, replace=False)
+    # половину роняем в 5 раз, половину поднимаем в 4 — по переходам и заказам сразу
+    factor = np.where(np.arange(args.anomalies) % 2 == 0, 0.2, 4.0)
+    x[:, hit, -1] = np.round(x[:, hit, -1] * factor + factor * 10 * (factor > 1))
+
+    # строки как из storage.get_nm_days: (day, nm_id, clicks, orders) за день и те же дни недели
+    cols = list(range(args.days - 1 - 7 * weeks, args.days, 7))
+    keys = [20260000 + i for i in range(len(cols))]
+    s_idx, d_idx = np.nonzero(x[0][:, cols] > 0)
+    rows = np.column_stack([np.asarray(keys)[d_idx], 100000 + s_idx,
+                            x[0][:, cols][s_idx, d_idx], x[1][:, cols][s_idx, d_idx]]).astype(np.int64)
+    print(f"{args.series} series x {args.days} days, {len(rows)} rows for {len(cols)} days, weeks={weeks}")
+
+    ms_matrix = _ms(lambda: anomaly.nm_matrix(rows, keys), args.repeat)
+    nm_ids, xm = anomaly.nm_matrix(rows, keys)
+    ms_score = _ms(lambda: anomaly.score_nm(xm), args.repeat)
+    ms_rolling = _ms(lambda: anomaly.rolling_z(x), max(1, args.repeat // 2))
+    sample = min(args.naive_sample, args.series)
+    ms_naive = _ms(lambda: _naive(x[:, :sample], weeks), 1) * args.series / sample
+
+    _, _, flagged = anomaly.score_nm(xm)
+    found = set((nm_ids[np.nonzero(flagged.any(axis=0))[0]] - 100000).tolist())
+    injected = set(hit.tolist())
+    recall = len(found & injected) / len(injected) if injected else 1.0
+    precision = len(found & injected) / len(found) if found else 1.0
+
+    print(f"{'nm_matrix':24s} {ms_matrix:9.1f} ms")
+    print(f"{'score_nm (last day)':24s} {ms_score:9.1f} ms")
+    print(f"{'rolling_z (full history)':24s} {ms_rolling:9.1f} ms")
+    print(f"{'naive python (last day)':24s} {ms_naive:9.1f} ms  (x{ms_naive / ms_score:.0f} vs score_nm)")
+    print(f"flagged {len(found)}, injected {len(injected)}: recall {recall:.2f}, precision {precision:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Бенчмарк отрисовки графиков: matplotlib против Pillow (CHART_RENDERER=pil) на одних и тех же данных.
+
+    python -m bench.bench_charts --repeat 5
+
+Для раскладок funnel (WB, 14 и 90 дней) и dual (бренд, 14 дней) генерирует случайные ряды
+в разных масштабах (сотни / десятки тысяч переходов), рисует каждым рендерером --repeat раз
+и печатает медиану мс на график и ускорение. Размер картинок в пикселях должен совпасть.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+
+from PIL import Image
+
+from src import chart_pil
+from src.report import CHART_STYLE, ChartSpec, render_chart
+
+
+def _spec(name: str, layout: str, days: int, clicks_scale: int, rnd: random.Random) -> ChartSpec:
+    start = date(2026, 1, 1)
+    labels = tuple((start + timedelta(days=i)).isoformat()[5:] for i in range(days))
+    clicks = tuple(rnd.randint(clicks_scale // 3, clicks_scale) for _ in labels)
+    orders = tuple(max(1, c // rnd.randint(8, 14)) for c in clicks)
+    spend = tuple(round(o * rnd.uniform(5, 40), 2) for o in orders) if layout == "funnel" else ()
+    return ChartSpec(name=name, title=f"bench {name}", layout=layout,
+                     labels=labels, clicks=clicks, orders=orders, spend=spend)
+
+
+def _time(render, spec, path: str, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        render(spec, path)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1000
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    rnd = random.Random(args.seed)
+    specs = [
+        _spec("funnel_14d", "funnel", 14, 9000, rnd),
+        _spec("funnel_14d_small", "funnel", 14, 300, rnd),
+        _spec("funnel_90d", "funnel", 90, 60000, rnd),
+        _spec("dual_14d", "dual", 14, 1500, rnd),
+    ]
+    renderers = {
+        "matplotlib": render_chart,
+        "pil": lambda spec, path: chart_pil.render(spec, path, CHART_STYLE),
+    }
+
+    with tempfile.TemporaryDirectory(prefix="bench_charts_") as tmp:
+        # прогрев: импорт шрифтов, кэши matplotlib
+        for name, render in renderers.items():
+            render(specs[0], os.path.join(tmp, f"warmup_{name}.png"))
+
+        total = {name: 0.0 for name in renderers}
+        print(f"{'chart':18s} {'matplotlib':>12s} {'pil':>12s} {'speedup':>8s}  size")
+        for spec in specs:
+            ms, sizes = {}, set()
+            for name, render in renderers.items():
+                path = os.path.join(tmp, f"{spec.name}_{name}.png")
+                ms[name] = _time(render, spec, path, args.repeat)
+                total[name] += ms[name]
+                with Image.open(path) as im:
+                    sizes.add(im.size)
+            size = "x".join(map(str, next(iter(sizes)))) if len(sizes) == 1 else f"MISMATCH {sorted(sizes)}"
+            print(f"{spec.name:18s} {ms['matplotlib']:9.0f} ms {ms['pil']:9.0f} ms {ms['matplotlib'] / ms['pil']:7.1f}x  {size}")
+        print(f"{'total':18s} {total['matplotlib']:9.0f} ms {total['pil']:9.0f} ms "
+              f"{total['matplotlib'] / total['pil']:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
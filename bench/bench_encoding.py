@@ -0,0 +1,150 @@
+"""
+Бенчмарк определения кодировки и декодирования больших CSV-отчётов.
+
+    python -m bench.bench_encoding --mb 300
+
+Для каждой кодировки генерирует CSV примерно на --mb мегабайт в utf-8 (одни и те же строки,
+с кириллической колонкой),
+затем меряет:
+  detect  — чтение префикса + detect_encoding;
+  decode  — один проход инкрементальным декодером (io.TextIOWrapper) по всему файлу;
+  legacy  — как было раньше: весь файл в память и decode() по цепочке
+            utf-8-sig -> utf-16 -> cp1251 (печатает, что эта цепочка выбрала);
+  csv / pandas — полный разбор _parse_detail_history_file.
+Результаты разбора по всем кодировкам должны совпасть.
+"""
+import argparse
+import io
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+from src.report_encoding import Utf8OrCp1251Decoder, detect_encoding
+from src.wb_client import ENCODING_SNIFF_BYTES, _parse_detail_history_file
+
+HEADER = "nmID;dt;subjectName;openCardCount;ordersCount\n"
+SUBJECTS = ["Платья", "Юбки", "Брюки", "Футболки", "Куртки", "Обувь"]
+
+# cp1251-late: первые мегабайты — чистый ASCII, кириллица только дальше
+# (префикса не хватает, чтобы отличить utf-8 от cp1251)
+ENCODINGS = ["utf-8", "utf-8-sig", "cp1251", "cp1251-late", "utf-16", "utf-16-le"]
+# что должна была выбрать старая цепочка decode(), чтобы текст получился верным
+LEGACY_OK = {"utf-8": {"utf-8-sig"}, "utf-8-sig": {"utf-8-sig"}, "cp1251": {"cp1251"},
+             "cp1251-late": {"cp1251"}, "utf-16": {"utf-16"}, "utf-16-le": set()}
+
+
+# строк на мегабайт utf-8: число строк одинаковое для всех кодировок, чтобы сверять разбор
+ROWS_PER_MB = 26_000
+
+
+def make_csv(path: str, encoding: str, mb: int, seed: int = 1) -> int:
+    rnd = random.Random(seed)
+    start = date(2026, 1, 1)
+    dts = [(start + timedelta(days=i)).isoformat() for i in range(14)]
+    total = mb * ROWS_PER_MB
+    late = encoding == "cp1251-late"
+    enc = "cp1251" if late else encoding
+    ascii_until = 4 * ENCODING_SNIFF_BYTES if late else 0
+
+    written = 0
+    rows = 0
+    with open(path, "wb") as f:
+        f.write(HEADER.encode(enc))
+        while rows < total:
+            buf = []
+            for _ in range(min(20_000, total - rows)):
+                subject = "ASCII" if written < ascii_until else SUBJECTS[rows % len(SUBJECTS)]
+                buf.append(f"{100000 + rows // 14};{dts[rows % 14]};{subject};"
+                           f"{rnd.randint(0, 5000)};{rnd.randint(0, 60)}\n")
+                rows += 1
+            data = "".join(buf).encode(enc)
+            if enc == "utf-16":
+                data = data[2:]  # BOM только в начале файла
+            f.write(data)
+            written += len(data)
+    return rows
+
+
+def detect(path: str) -> str:
+    with open(path, "rb") as f:
+        return detect_encoding(f.read(ENCODING_SNIFF_BYTES))
+
+
+def decode_single_pass(path: str, enc: str) -> int:
+    n = 0
+    with open(path, "rb") as raw, io.TextIOWrapper(raw, encoding=enc, errors="replace", newline="") as text:
+        while True:
+            chunk = text.read(1 << 20)
+            if not chunk:
+                return n
+            n += len(chunk)
+
+
+def decode_legacy(path: str) -> str:
+    with open(path, "rb") as f:
+        raw = f.read()
+    for enc in ("utf-8-sig", "utf-16", "cp1251"):
+        try:
+            raw.decode(enc)
+            return enc
+        except UnicodeDecodeError:
+            continue
+    return "?"
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return time.perf_counter() - t0, out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mb", type=int, default=300, help="размер каждого файла, МБ")
+    ap.add_argument("--encodings", nargs="*", default=ENCODINGS)
+    ap.add_argument("--engines", nargs="*", default=["csv", "pandas"])
+    ap.add_argument("--no-legacy", action="store_true", help="не гонять старую цепочку decode()")
+    args = ap.parse_args()
+
+    # битый байт после кириллицы в том же куске: остаётся utf-8 (с заменой), а не cp1251
+    broken = Utf8OrCp1251Decoder("replace").decode(
+        b"nmID,dt\n1,2\n" + "Платье".encode() + b"\xff\n", final=True)
+    print(f"utf-8 + bad byte: {broken!r}")
+    failed = broken != "nmID,dt\n1,2\nПлатье\ufffd\n"
+
+    reference = None
+    with tempfile.TemporaryDirectory() as d:
+        for encoding in args.encodings:
+            path = os.path.join(d, f"report_{encoding}.csv")
+            t_gen, rows = timed(make_csv, path, encoding, args.mb)
+            size_mb = os.path.getsize(path) / 1e6
+            print(f"\n{encoding}: {size_mb:.0f} MB, {rows} rows (generated in {t_gen:.1f}s)")
+
+            t_det, enc = timed(detect, path)
+            print(f"  detect : {t_det * 1000:8.2f} ms  -> {enc}")
+            t_dec, _ = timed(decode_single_pass, path, enc)
+            print(f"  decode : {t_dec:8.2f} s   ({size_mb / t_dec:.0f} MB/s)")
+            if not args.no_legacy:
+                t_leg, picked = timed(decode_legacy, path)
+                wrong = "" if picked in LEGACY_OK[encoding] else "  <- WRONG"
+                print(f"  legacy : {t_leg:8.2f} s   ({size_mb / t_leg:.0f} MB/s) -> {picked}{wrong}")
+
+            for engine in args.engines:
+                t_parse, days = timed(_parse_detail_history_file, path, engine)
+                totals = {k: (v.open, v.orders) for k, v in days.items()}
+                if reference is None:
+                    reference = totals
+                same = totals == reference
+                failed = failed or not same
+                print(f"  {engine:7s}: {t_parse:8.2f} s   ({size_mb / t_parse:.0f} MB/s)"
+                      f"{'' if same else '  <- RESULT DIFFERS'}")
+            os.remove(path)
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
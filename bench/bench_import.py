@@ -0,0 +1,74 @@
+"""
+Холодный старт: сколько стоит импорт точки входа и отдельных модулей.
+
+    python -m bench.bench_import
+
+Каждый замер — отдельный процесс `python -X importtime`, берём медиану.
+Печатает суммарное время импорта и самые дорогие модули (cumulative).
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+TARGETS = [
+    "src.main",
+    "src.storage",
+    "src.wb_client",
+    "src.report",
+    "src.tg_sender",
+]
+
+LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_profile(module: str) -> dict:
+    """
+    {модуль: cumulative мкс} по выводу -X importtime для `import module`.
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="0")
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env,
+    )
+    if p.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{p.stderr[-2000:]}")
+    out = {}
+    for line in p.stderr.splitlines():
+        m = LINE.match(line)
+        if m:
+            out[m.group(4)] = int(m.group(2))
+    return out
+
+
+def _baseline() -> set:
+    # то, что грузится при старте самого интерпретатора (site, .pth), — не наше
+    return set(import_profile("sys"))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--top", type=int, default=8)
+    ap.add_argument("modules", nargs="*", default=TARGETS)
+    args = ap.parse_args()
+    baseline = _baseline()
+
+    for module in args.modules:
+        runs = [import_profile(module) for _ in range(args.repeat)]
+        total = statistics.median(r.get(module, 0) for r in runs) / 1000
+        print(f"{module:<16} {total:8.1f} ms")
+
+        last = runs[-1]
+        heavy = sorted(
+            ((name, us) for name, us in last.items() if "." not in name and name not in baseline and name != module.split(".")[0]),
+            key=lambda x: -x[1],
+        )[:args.top]
+        for name, us in heavy:
+            print(f"    {name:<20} {us / 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Бенчмарк парсера DETAIL_HISTORY_REPORT: построчный csv против колоночного pandas.
+
+    python -m bench.bench_parse --rows 1000000
+
+Генерирует синтетический отчёт (ZIP с CSV, ';', русские числа с NBSP и запятыми),
+прогоняет оба движка и проверяет, что результат совпадает; отдельно — что отчёт
+из одного заголовка (пустой кусок nmID, пустой день из архива) оба разбирают в {}.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import zipfile
+from datetime import date, timedelta
+
+from src.wb_client import _parse_detail_history_file
+
+
+HEADER = "nmID;dt;openCardCount;addToCartCount;ordersCount;ordersSumRub;buyoutsCount\n"
+
+
+def _fmt(n: int, rnd: random.Random, dirty: float) -> str:
+    # часть значений — в "русском" формате, как бывает в выгрузках
+    if dirty <= 0.0:
+        return str(n)
+    r = rnd.random() / dirty
+    if r < 0.5:
+        return f"{n:,}".replace(",", "\u00A0")
+    if r < 0.8:
+        return f"{n},0"
+    if r < 1.0:
+        return ""
+    return str(n)
+
+
+def make_report(path: str, rows: int, days: int = 14, dirty: float = 0.0, seed: int = 1) -> None:
+    rnd = random.Random(seed)
+    start = date(2026, 1, 1)
+    dts = [(start + timedelta(days=i)).isoformat() for i in range(days)]
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open("report.csv", "w") as raw:
+            buf = [HEADER]
+            for i in range(rows):
+                opens = rnd.randint(0, 5000)
+                orders = rnd.randint(0, 60)
+                buf.append(
+                    f"{100000 + i // days};{dts[i % days]};{_fmt(opens, rnd, dirty)};"
+                    f"{rnd.randint(0, 300)};{_fmt(orders, rnd, dirty)};{orders * 990};{orders // 2}\n"
+                )
+                if len(buf) >= 50_000:
+                    raw.write("".join(buf).encode("utf-8"))
+                    buf = []
+            raw.write("".join(buf).encode("utf-8"))
+
+
+def run(path: str, engine: str, repeat: int):
+    best = None
+    out = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = _parse_detail_history_file(path, engine=engine)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--dirty", type=float, nargs="*", default=[0.0, 0.05],
+                    help="доля значений в русском формате (NBSP, запятая, пусто)")
+    args = ap.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "report_empty.zip")
+        make_report(path, 0)
+        empty = {engine: run(path, engine, 1)[1] for engine in ("csv", "pandas")}
+        print(f"header only: {', '.join(f'{e}={r!r}' for e, r in empty.items())}")
+        failed = any(r != {} for r in empty.values())
+
+        for dirty in args.dirty:
+            path = os.path.join(d, f"report_{dirty}.zip")
+            t0 = time.perf_counter()
+            make_report(path, args.rows, dirty=dirty)
+            print(f"\n{args.rows} rows, dirty={dirty:.0%}: generated in {time.perf_counter() - t0:.1f}s "
+                  f"({os.path.getsize(path) / 1e6:.1f} MB zip)")
+
+            t_csv, out_csv = run(path, "csv", args.repeat)
+            t_pd, out_pd = run(path, "pandas", args.repeat)
+
+            same = ({k: (v.open, v.orders) for k, v in out_csv.items()}
+                    == {k: (v.open, v.orders) for k, v in out_pd.items()})
+            print(f"  csv    : {t_csv:.2f}s")
+            print(f"  pandas : {t_pd:.2f}s  (x{t_csv / t_pd:.1f})")
+            print(f"  results equal: {same}")
+            failed = failed or not same
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
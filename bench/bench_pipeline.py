@@ -0,0 +1,185 @@
+"""
+Бенчмарк всего конвейера против локального стенда WB (bench/fake_wb.py).
+
+    python -m bench.bench_pipeline --nm 2000 --latency 0.02 --rate-429 0.05 --out bench.json
+    python -m bench.bench_pipeline --baseline bench.json --tolerance 0.25   # проверка регрессий
+
+Замеряет по этапам (span'ы src/instrument.py): синхронизацию карточек,
+заказ/опрос/ожидание/скачивание отчёта, разбор CSV, рекламу, запись в SQLite, графики;
+плюс fetch_wb_14d целиком (холодный и из кэша) и make_charts_14d (рендер и кэш).
+Счётчики (запросы по семействам, 429/ретраи, байты, строки) — тоже в JSON.
+Каждый прогон — в чистой временной папке (своя БД, data/, out/). С --baseline этапы,
+ставшие медленнее больше чем на --tolerance, печатаются, и код выхода 1.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Dict, Tuple
+
+from bench.fake_wb import FakeWB, FakeWBConfig
+
+# этапы короче этого не сравниваем с baseline — там один шум
+MIN_COMPARE_SEC = 0.02
+
+
+def _measure(stages: Dict[str, dict], stage: str, fn, *args):
+    t0 = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        s = stages.setdefault(stage, {"sec": 0.0, "calls": 0})
+        s["sec"] += time.perf_counter() - t0
+        s["calls"] += 1
+
+
+def run_once(args) -> Tuple[Dict[str, dict], Dict[str, float]]:
+    """
+    Один прогон конвейера; модули src импортируются после того, как окружение
+    (адреса стенда, токен) уже выставлено. Внутренние этапы — из span'ов src/instrument.py,
+    плюс свои замеры верхнего уровня (холодный/кэшированный fetch, рендер/кэш графиков).
+    """
+    from src import instrument, storage, wb_client, wb_http
+
+    if not args.real_limits:
+        # лимиты и опрос под стенд: меряем свой код, а не паузы из документации WB
+        for family in wb_http.LIMITS:
+            wb_http.LIMITS[family] = (1000.0, 100)
+        wb_http._buckets.clear()
+        wb_client.POLL_MIN_SEC = 0.05
+        wb_client.REPORT_DEFAULT_GEN_SEC = args.report_gen_sec
+        wb_client.REPORT_UNKNOWN_GRACE_SEC = max(args.report_gen_sec * 4, 1.0)
+
+    stages: Dict[str, dict] = {}
+    try:
+        storage.init_db()
+        end = date(2026, 1, 31)
+        start = end - timedelta(days=args.days - 1)
+
+        with instrument.run("bench") as r:
+            days = _measure(stages, "fetch_wb_14d", wb_client.fetch_wb_14d, start.isoformat(), end.isoformat())
+            _measure(stages, "fetch_wb_14d_cached", wb_client.fetch_wb_14d, start.isoformat(), end.isoformat())
+
+            def write():
+                storage.upsert_metrics_many((dt, "wb", 0, d.open, d.orders, d.ad_spend) for dt, d in days.items())
+                storage.upsert_nm_metrics(
+                    (dt, nm_id, m.open, m.orders) for dt, d in days.items() for nm_id, m in d.by_nm.items()
+                )
+
+            _measure(stages, "storage_write", write)
+
+            from src import report
+
+            _measure(stages, "charts", report.make_charts_14d)
+            _measure(stages, "charts_cached", report.make_charts_14d)
+    finally:
+        storage.close()
+
+    for (name, labels), (calls, total, _mx) in r.spans.items():
+        key = name + "".join(f"[{v}]" for _k, v in labels)
+        s = stages.setdefault(key, {"sec": 0.0, "calls": 0})
+        s["sec"] += total
+        s["calls"] += calls
+    counters = {name + "".join(f"[{v}]" for _k, v in labels): v for (name, labels), v in r.counters.items()}
+    return stages, counters
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for stage, cur in result["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if not base or base["sec"] < MIN_COMPARE_SEC:
+            continue
+        if cur["sec"] > base["sec"] * (1.0 + tolerance):
+            regressions.append((stage, base["sec"], cur["sec"]))
+    return regressions
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--nm", type=int, default=1000, help="карточек в каталоге стенда")
+    ap.add_argument("--days", type=int, default=14)
+    ap.add_argument("--nm-chunk", type=int, default=None, help="WB_NM_CHUNK_SIZE (по умолчанию — из .env)")
+    ap.add_argument("--latency", type=float, default=0.0, help="задержка каждого ответа стенда, с")
+    ap.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429")
+    ap.add_argument("--report-gen-sec", type=float, default=0.5, help="сколько стенд «генерирует» отчёт")
+    ap.add_argument("--real-limits", action="store_true", help="не ослаблять лимиты WB и частоту опроса")
+    ap.add_argument("--engine", default=None, help="WB_PARSE_ENGINE: pandas | csv | auto")
+    ap.add_argument("--repeat", type=int, default=3, help="прогонов; по каждому этапу берём медиану")
+    ap.add_argument("--out", help="куда записать JSON (иначе — stdout)")
+    ap.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="допустимое замедление этапа (0.25 = +25%%)")
+    args = ap.parse_args()
+
+    fake = FakeWB(FakeWBConfig(nm_count=args.nm, latency=args.latency, rate_429=args.rate_429,
+                               report_gen_sec=args.report_gen_sec))
+    url = fake.start()
+    os.environ.update(WB_ANALYTICS_BASE=url, WB_ADS_BASE=url, WB_CONTENT_BASE=url, WB_TOKEN="bench")
+    if args.nm_chunk:
+        os.environ["WB_NM_CHUNK_SIZE"] = str(args.nm_chunk)
+    if args.engine:
+        os.environ["WB_PARSE_ENGINE"] = args.engine
+
+    cwd = os.getcwd()
+    sys.path.insert(0, cwd)
+    runs = []
+    counters = {}
+    try:
+        for _ in range(max(args.repeat, 1)):
+            with tempfile.TemporaryDirectory() as d:
+                os.chdir(d)
+                try:
+                    stages_run, counters = run_once(args)
+                    runs.append(stages_run)
+                finally:
+                    os.chdir(cwd)
+    finally:
+        fake.stop()
+
+    stages = {
+        stage: {
+            "sec": round(statistics.median(r[stage]["sec"] for r in runs), 4),
+            "calls": runs[0][stage]["calls"],
+        }
+        for stage in sorted(runs[0])
+        if all(stage in r for r in runs)
+    }
+    result = {
+        "version": 1,
+        "python": platform.python_version(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+        "stages": stages,
+        "counters": counters,
+        "server": {
+            "requests": fake.stats.requests,
+            "throttled_429": fake.stats.throttled,
+            "bytes_sent": fake.stats.bytes_sent,
+            "by_path": fake.stats.by_path,
+        },
+    }
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        for stage, v in stages.items():
+            print(f"  {stage:22s} {v['sec']:8.3f}s  x{v['calls']}")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for stage, was, now in regressions:
+            print(f"REGRESSION {stage}: {was:.3f}s -> {now:.3f}s (+{(now / was - 1) * 100:.0f}%)")
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Локальный стенд WB API для бенчмарков (без обращений к настоящему Wildberries).
+
+    python -m bench.fake_wb --port 8089 --nm 2000 --latency 0.05 --rate-429 0.05
+
+Умеет ровно то, что дёргает бот:
+  POST /api/v2/nm-report/downloads              — заказ DETAIL_HISTORY_REPORT
+  GET  /api/v2/nm-report/downloads              — статусы (filter[downloadIds])
+  GET  /api/v2/nm-report/downloads/file/<id>    — ZIP с CSV
+  GET  /adv/v1/upd                              — затраты на рекламу
+  POST /content/v2/get/cards/list | /trash      — карточки по курсору
+
+Задержка ответа, доля 429 (с X-Ratelimit-Retry), время генерации отчёта
+и размер каталога настраиваются. Адреса бот берёт из WB_*_BASE (src/config.py).
+"""
+import argparse
+import io
+import json
+import random
+import sys
+import threading
+import time
+import zipfile
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+HEADER = "nmID;dt;openCardCount;addToCartCount;ordersCount;ordersSumRub;buyoutsCount\n"
+
+
+@dataclass
+class FakeWBConfig:
+    nm_count: int = 1000             # карточек в каталоге
+    latency: float = 0.0             # секунд на каждый ответ
+    rate_429: float = 0.0            # доля ответов 429
+    retry_after: float = 0.1         # X-Ratelimit-Retry в ответе 429
+    report_gen_sec: float = 0.5      # через сколько отчёт становится SUCCESS
+    seed: int = 1
+
+
+@dataclass
+class FakeWBStats:
+    requests: int = 0
+    throttled: int = 0
+    bytes_sent: int = 0
+    by_path: Dict[str, int] = field(default_factory=dict)
+
+
+class FakeWB:
+    def __init__(self, config: FakeWBConfig):
+        self.config = config
+        self.stats = FakeWBStats()
+        self.reports: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._rnd = random.Random(config.seed)
+        self._server = None
+        self._thread = None
+        # каталог: nmID по возрастанию updatedAt
+        self.cards = [
+            {
+                "nmID": 100000 + i,
+                "imtID": 500000 + i // 3,
+                "vendorCode": f"SKU-{i}",
+                "subjectID": 10 + i % 7,
+                "subjectName": f"Предмет {i % 7}",
+                "brand": f"Бренд {i % 5}",
+                "title": f"Товар {i}",
+                "updatedAt": f"2026-01-01T00:{(i // 60) % 60:02d}:{i % 60:02d}Z",
+            }
+            for i in range(config.nm_count)
+        ]
+
+    # --- данные ---
+
+    def report_zip(self, nm_ids: List[int], start: str, end: str) -> bytes:
+        d0 = date.fromisoformat(start)
+        days = [(d0 + timedelta(days=i)).isoformat() for i in range((date.fromisoformat(end) - d0).days + 1)]
+        nm_ids = nm_ids or [c["nmID"] for c in self.cards]
+        rnd = random.Random(f"{self.config.seed}:{start}:{end}:{len(nm_ids)}")
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            with zf.open("report.csv", "w") as raw:
+                lines = [HEADER]
+                for nm in nm_ids:
+                    for dt in days:
+                        orders = rnd.randint(0, 20)
+                        lines.append(f"{nm};{dt};{rnd.randint(0, 2000)};{rnd.randint(0, 100)};{orders};"
+                                     f"{orders * 990};{orders // 2}\n")
+                    if len(lines) >= 50_000:
+                        raw.write("".join(lines).encode("utf-8"))
+                        lines = []
+                raw.write("".join(lines).encode("utf-8"))
+        return buf.getvalue()
+
+    def ads_spend(self, date_from: str, date_to: str) -> list:
+        d0 = date.fromisoformat(date_from)
+        out = []
+        for i in range((date.fromisoformat(date_to) - d0).days + 1):
+            dt = (d0 + timedelta(days=i)).isoformat()
+            out.append({"updTime": f"{dt}T12:00:00+03:00", "updSum": 1000 + i * 10, "advertId": 1,
+                        "campName": "Авто 1", "advertType": 8})
+            out.append({"updTime": f"{dt}T18:00:00+03:00", "updSum": 500, "advertId": 2,
+                        "campName": "Аукцион 2", "advertType": 9})
+        return out
+
+    def adverts(self, ids: List[int]) -> list:
+        # кампания 1 — автоматическая (autoParams), 2 — аукцион (unitedParams); артикулы — первые карточки
+        nms = [c["nmID"] for c in self.cards[:5]]
+        known = {
+            1: {"advertId": 1, "name": "Авто 1", "type": 8, "status": 9, "autoParams": {"nms": nms[:3]}},
+            2: {"advertId": 2, "name": "Аукцион 2", "type": 9, "status": 9, "unitedParams": [{"nms": nms[3:]}]},
+        }
+        return [known[i] for i in ids if i in known]
+
+    def cards_page(self, settings: dict) -> dict:
+        cursor = settings.get("cursor") or {}
+        limit = int(cursor.get("limit") or 100)
+        after = (cursor.get("updatedAt"), cursor.get("nmID"))
+        items = self.cards
+        if after[0] and after[1]:
+            items = [c for c in items if (c["updatedAt"], c["nmID"]) > after]
+        page = items[:limit]
+        resp_cursor = {"total": len(page)}
+        if page:
+            resp_cursor.update(updatedAt=page[-1]["updatedAt"], nmID=page[-1]["nmID"])
+        return {"cards": page, "cursor": resp_cursor}
+
+    # --- сервер ---
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # заголовки и тело уходят разными write — без TCP_NODELAY каждый ответ ждёт delayed ACK (~40 мс)
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code: int, body: bytes, ctype: str = "application/json", headers: dict = None):
+                self.send_response(code)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+                with fake._lock:
+                    fake.stats.bytes_sent += len(body)
+
+            def _json(self, obj, code: int = 200):
+                self._send(code, json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+
+            def _before(self) -> bool:
+                path = urlparse(self.path).path
+                key = "/api/v2/nm-report/downloads/file" if "/downloads/file/" in path else path
+                with fake._lock:
+                    fake.stats.requests += 1
+                    fake.stats.by_path[key] = fake.stats.by_path.get(key, 0) + 1
+                    throttle = fake._rnd.random() < fake.config.rate_429
+                    if throttle:
+                        fake.stats.throttled += 1
+                if fake.config.latency:
+                    time.sleep(fake.config.latency)
+                if throttle:
+                    self._send(429, b'{"title":"too many requests"}',
+                               headers={"X-Ratelimit-Retry": str(fake.config.retry_after)})
+                    return False
+                return True
+
+            def _body(self) -> dict:
+                n = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(n) or b"{}")
+
+            def do_POST(self):
+                body = self._body()
+                if not self._before():
+                    return
+                path = urlparse(self.path).path
+                if path == "/api/v2/nm-report/downloads":
+                    p = body.get("params") or {}
+                    with fake._lock:
+                        fake.reports[body["id"]] = {
+                            "created": time.time(),
+                            "nm_ids": p.get("nmIDs") or [],
+                            "start": p["startDate"],
+                            "end": p["endDate"],
+                        }
+                    self._json({"data": "Началось формирование файла/отчета"})
+                elif path == "/content/v2/get/cards/list":
+                    self._json(fake.cards_page(body.get("settings") or {}))
+                elif path == "/content/v2/get/cards/trash":
+                    self._json({"cards": [], "cursor": {"total": 0}})
+                elif path == "/adv/v1/promotion/adverts":
+                    self._json(fake.adverts(body if isinstance(body, list) else []))
+                else:
+                    self._json({"title": "not found"}, 404)
+
+            def do_GET(self):
+                if not self._before():
+                    return
+                u = urlparse(self.path)
+                q = parse_qs(u.query)
+                if u.path == "/api/v2/nm-report/downloads":
+                    now = time.time()
+                    data = []
+                    for rid in q.get("filter[downloadIds]", []):
+                        rep = fake.reports.get(rid)
+                        if rep:
+                            ready = now - rep["created"] >= fake.config.report_gen_sec
+                            data.append({"id": rid, "status": "SUCCESS" if ready else "PROCESSING"})
+                    self._json({"data": data})
+                elif u.path.startswith("/api/v2/nm-report/downloads/file/"):
+                    rep = fake.reports.get(u.path.rsplit("/", 1)[1])
+                    if not rep:
+                        self._json({"title": "not found"}, 404)
+                        return
+                    self._send(200, fake.report_zip(rep["nm_ids"], rep["start"], rep["end"]), "application/zip")
+                elif u.path == "/adv/v1/upd":
+                    self._json(fake.ads_spend(q["from"][0], q["to"][0]))
+                else:
+                    self._json({"title": "not found"}, 404)
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # клиент закрыл keep-alive соединение — для стенда это норма
+                if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+                    super().handle_error(request, client_address)
+
+        self._server = Server((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-wb", daemon=True)
+        self._thread.start()
+        return f"http://{host}:{self._server.server_address[1]}"
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--nm", type=int, default=1000, help="карточек в каталоге")
+    ap.add_argument("--latency", type=float, default=0.0)
+    ap.add_argument("--rate-429", type=float, default=0.0)
+    ap.add_argument("--report-gen-sec", type=float, default=0.5)
+    args = ap.parse_args()
+
+    fake = FakeWB(FakeWBConfig(nm_count=args.nm, latency=args.latency, rate_429=args.rate_429,
+                               report_gen_sec=args.report_gen_sec))
+    url = fake.start(args.host, args.port)
+    print(f"fake WB at {url}; WB_ANALYTICS_BASE=WB_ADS_BASE=WB_CONTENT_BASE={url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Кабинеты продавца (аккаунты WB).
+
+Текущий аккаунт живёт в contextvar: wb_client/wb_http берут из него токен и лимиты,
+storage — ключ партиции (колонка account). По умолчанию — "default" с WB_TOKEN из .env,
+так что однокабинетная установка работает как раньше.
+"""
+import contextvars
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import List, Optional
+
+from src.config import WB_TOKEN
+
+DEFAULT_ACCOUNT_ID = "default"
+
+
+@dataclass(frozen=True)
+class Account:
+    account_id: str
+    wb_token: str
+    name: str = ""
+
+    @property
+    def title(self) -> str:
+        return self.name or self.account_id
+
+
+DEFAULT_ACCOUNT = Account(DEFAULT_ACCOUNT_ID, WB_TOKEN)
+
+_current: contextvars.ContextVar[Account] = contextvars.ContextVar("wb_account", default=DEFAULT_ACCOUNT)
+
+
+def current() -> Account:
+    return _current.get()
+
+
+def current_id() -> str:
+    return _current.get().account_id
+
+
+@contextmanager
+def use(account: Account):
+    token = _current.set(account)
+    try:
+        yield account
+    finally:
+        _current.reset(token)
+
+
+def suffix() -> str:
+    """
+    " — <кабинет>" для заголовков отчёта; у default пусто, чтобы однокабинетный отчёт не менялся.
+    """
+    acc = current()
+    return "" if acc.account_id == DEFAULT_ACCOUNT_ID else f" — {acc.title}"
+
+
+def data_dir() -> str:
+    """
+    Куда класть файлы (кэш отчётов и т.п.) текущего аккаунта.
+    default — прямо в data/, как было до мультиаккаунта.
+    """
+    acc = current_id()
+    if acc == DEFAULT_ACCOUNT_ID:
+        return "data"
+    return os.path.join("data", "accounts", acc)
+
+
+def all_active() -> List[Account]:
+    """
+    Активные аккаунты из реестра (таблица accounts) + default из .env,
+    если WB_TOKEN задан и default не переопределён в реестре.
+    """
+    from src import storage
+
+    out = [Account(a, t, n or "") for a, n, t in storage.get_accounts()]
+    if WB_TOKEN and DEFAULT_ACCOUNT_ID not in {a.account_id for a in out} \
+            and DEFAULT_ACCOUNT_ID not in storage.get_disabled_account_ids():
+        out.insert(0, DEFAULT_ACCOUNT)
+    return out
+
+
+def get(account_id: str) -> Optional[Account]:
+    for a in all_active():
+        if a.account_id == account_id:
+            return a
+    return None
@@ -0,0 +1,190 @@
+"""
+Затраты на рекламу WB по кампаниям и дням (advert-api) с локальным кэшем в SQLite.
+
+/adv/v1/upd отдаёт списания (updSum, updTime, advertId); складываем их в ads_spend
+по (день, кампания). Прошлые дни WB уже не меняет: день старше ADS_CLOSED_AFTER_DAYS
+помечается закрытым и больше не запрашивается — у API спрашиваем только открытые
+(свежие) дни, и те не чаще раза в ADS_OPEN_TTL_MIN. Ошибка API не превращается в ноль:
+день, который не удалось загрузить, просто остаётся без данных (нет в ads_days),
+а загруженный день без списаний — это реальный 0.
+
+Артикулы кампаний (/adv/v1/promotion/adverts) — в ads_campaign_nms: по ним считается
+CPO по кампании и по артикулу (storage.ads_get_campaign_cpo / ads_get_nm_cpo).
+"""
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import pytz
+import requests
+
+from src import accounts, instrument, storage, wb_http
+from src.config import ADS_CLOSED_AFTER_DAYS, ADS_OPEN_TTL_MIN, TZ, WB_ADS_BASE
+
+ADS_BASE = WB_ADS_BASE
+
+ADS_MAX_DAYS = 31            # /adv/v1/upd отдаёт не больше месяца за запрос
+ADVERTS_BATCH = 50           # /adv/v1/promotion/adverts: кампаний в одном запросе
+CAMPAIGNS_TTL_SEC = 24 * 3600  # состав кампаний перечитываем раз в сутки
+
+
+@dataclass
+class AdsSyncResult:
+    days: int = 0        # дней в окне
+    cached: int = 0      # взяты из БД без запроса
+    fetched: int = 0     # загружены у WB
+    rows: int = 0        # строк день x кампания
+    errors: List[str] = field(default_factory=list)
+
+
+def _headers() -> dict:
+    return {"Authorization": accounts.current().wb_token}
+
+
+def _today() -> date:
+    return datetime.now(pytz.timezone(TZ)).date()
+
+
+def _days(date_from: str, date_to: str) -> List[str]:
+    d, last = date.fromisoformat(date_from), date.fromisoformat(date_to)
+    return [(d + timedelta(days=i)).isoformat() for i in range((last - d).days + 1)]
+
+
+def _runs(days: List[str], max_days: int = ADS_MAX_DAYS) -> List[List[str]]:
+    """
+    Отсортированные дни -> куски подряд идущих дней не длиннее max_days (один запрос на кусок).
+    """
+    out: List[List[str]] = []
+    prev = None
+    for d in days:
+        cur = date.fromisoformat(d)
+        if out and prev is not None and cur - prev == timedelta(days=1) and len(out[-1]) < max_days:
+            out[-1].append(d)
+        else:
+            out.append([d])
+        prev = cur
+    return out
+
+
+def _fetch_upd(date_from: str, date_to: str) -> list:
+    with instrument.span("wb.ads"):
+        r = wb_http.get("adv", f"{ADS_BASE}/adv/v1/upd", headers=_headers(),
+                        params={"from": date_from, "to": date_to}, timeout=30)
+        r.raise_for_status()
+        items = r.json() or []
+    if not isinstance(items, list):
+        raise ValueError(f"unexpected /adv/v1/upd response: {type(items).__name__}")
+    return items
+
+
+def _spend_rows(items: list) -> Tuple[List[storage.AdsSpendRow], Dict[int, Tuple[Optional[str], Optional[int]]]]:
+    """
+    Списания -> строки (date, advert_id, spend, updates) и {advert_id: (имя, тип)}.
+    """
+    agg: Dict[Tuple[str, int], List[float]] = {}
+    names: Dict[int, Tuple[Optional[str], Optional[int]]] = {}
+    for it in items:
+        t = it.get("updTime")
+        advert_id = it.get("advertId")
+        if not t or advert_id is None:
+            continue
+        key = (t[:10], int(advert_id))
+        a = agg.setdefault(key, [0.0, 0])
+        a[0] += float(it.get("updSum") or 0)
+        a[1] += 1
+        names[int(advert_id)] = (it.get("campName") or None, it.get("advertType"))
+    return [(d, a, s, n) for (d, a), (s, n) in sorted(agg.items())], names
+
+
+def sync_spend(date_from: str, date_to: str, today: Optional[date] = None) -> AdsSyncResult:
+    """
+    Дозагрузить затраты за [date_from, date_to]: у WB — только незакрытые дни, которые
+    не обновлялись последние ADS_OPEN_TTL_MIN. Ошибка по куску дней не роняет остальные.
+    """
+    res = AdsSyncResult()
+    if not accounts.current().wb_token:
+        return res
+    now = time.time()
+    today = today or _today()
+    closed_to = today - timedelta(days=ADS_CLOSED_AFTER_DAYS)
+
+    days = _days(date_from, date_to)
+    fresh = storage.ads_get_fresh_days(date_from, date_to, now - ADS_OPEN_TTL_MIN * 60)
+    todo = [d for d in days if d not in fresh]
+    res.days, res.cached = len(days), len(days) - len(todo)
+
+    for run in _runs(todo):
+        try:
+            items = _fetch_upd(run[0], run[-1])
+        except (requests.RequestException, ValueError) as e:
+            instrument.count("wb.ads_errors")
+            res.errors.append(f"{run[0]}..{run[-1]}: {e}")
+            print(f"[ads] {run[0]}..{run[-1]}: {e}")
+            continue
+        rows, names = _spend_rows(items)
+        # WB может прислать списания за соседние дни — берём только запрошенные
+        wanted = set(run)
+        rows = [r for r in rows if r[0] in wanted]
+        closed = [d for d in run if date.fromisoformat(d) <= closed_to]
+        res.rows += storage.ads_put_days(run, rows, closed, now)
+        storage.ads_note_campaigns((a, name, t) for a, (name, t) in names.items())
+        res.fetched += len(run)
+
+    instrument.count("wb.ads_days", res.cached, source="cache")
+    instrument.count("wb.ads_days", res.fetched, source="wb")
+    if res.fetched:
+        sync_campaigns(date_from, date_to)
+    return res
+
+
+def _campaign_nms(c: dict) -> List[int]:
+    # артикулы лежат по-разному в зависимости от типа кампании
+    out = set()
+    for nm in (c.get("autoParams") or {}).get("nms") or []:
+        out.add(int(nm))
+    for p in c.get("unitedParams") or []:
+        out.update(int(nm) for nm in p.get("nms") or [])
+    for p in c.get("params") or []:
+        for nm in p.get("nms") or []:
+            out.add(int(nm["nm"]) if isinstance(nm, dict) else int(nm))
+    return sorted(out)
+
+
+def sync_campaigns(date_from: str, date_to: str) -> int:
+    """
+    Состав кампаний со списаниями в окне, которые не перечитывали больше CAMPAIGNS_TTL_SEC.
+    Без него нет CPO по кампаниям, но затраты по дням от него не зависят — ошибки не фатальны.
+    """
+    now = time.time()
+    ids = storage.ads_get_stale_campaigns(date_from, date_to, now - CAMPAIGNS_TTL_SEC)
+    updated = 0
+    for i in range(0, len(ids), ADVERTS_BATCH):
+        batch = ids[i:i + ADVERTS_BATCH]
+        try:
+            with instrument.span("wb.ads_campaigns"):
+                r = wb_http.post("adv-info", f"{ADS_BASE}/adv/v1/promotion/adverts",
+                                 headers=_headers(), json=batch, timeout=30)
+                r.raise_for_status()
+                data = r.json() or []
+        except (requests.RequestException, ValueError) as e:
+            instrument.count("wb.ads_errors")
+            print(f"[ads] campaigns {batch[0]}..{batch[-1]}: {e}")
+            continue
+        rows, nms = [], {}
+        for c in data:
+            if c.get("advertId") is None:
+                continue
+            advert_id = int(c["advertId"])
+            rows.append((advert_id, c.get("name") or None, c.get("type"), c.get("status")))
+            nms[advert_id] = _campaign_nms(c)
+        updated += storage.ads_upsert_campaigns(rows, nms, now)
+    return updated
+
+
+def spend_by_day(date_from: str, date_to: str) -> Dict[str, float]:
+    """
+    {date: затраты} за окно (с дозагрузкой). Дня нет в ответе — данных нет; 0.0 — реально ноль.
+    """
+    sync_spend(date_from, date_to)
+    return dict(storage.ads_get_spend_by_day(date_from, date_to))
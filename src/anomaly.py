@@ -0,0 +1,164 @@
+"""
+Аномалии в дневных рядах WB — векторно, на numpy.
+
+День сравнивается не со вчера, а с тем же днём недели прошлых ANOMALY_WEEKS недель:
+база — медиана этих значений, разброс — MAD (медиана отклонений от медианы, x1.4826 ~ сигма).
+Робастный z = (значение - медиана) / разброс; |z| >= ANOMALY_Z — аномалия. Медиана и MAD
+не ломаются от одного прошлого выброса, а недельная сезонность (выходные) уходит в базу.
+Для счётчиков разброс не меньше sqrt(медианы) — пуассоновский шум, иначе ровная история
+(MAD = 0) делает аномалией любое отклонение на единицу.
+
+rolling_z — по всей истории сразу (sliding_window_view, без цикла по дням);
+find_daily — итоги WB за день, find_nm — все артикулы за день одной матрицей (S x недели).
+"""
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from src import storage
+from src.config import ANOMALY_MIN_BASE, ANOMALY_MIN_WEEKS, ANOMALY_TOP_NM, ANOMALY_WEEKS, ANOMALY_Z
+
+MAD_SCALE = 1.4826   # MAD -> сигма для нормального распределения
+DAILY_METRICS = ("clicks", "orders", "ad_spend")
+NM_METRICS = ("clicks", "orders")
+
+
+@dataclass
+class Anomaly:
+    metric: str
+    date: str
+    value: float
+    expected: float      # медиана того же дня недели
+    z: float
+    nm_id: Optional[int] = None
+    vendor_code: Optional[str] = None
+
+
+def _nan_median(a: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Медиана по последней оси без NaN и число значений. np.nanmedian на коротких осях
+    идёт через apply_along_axis — здесь сортировка (NaN уходят в конец) и два take.
+    """
+    n = np.count_nonzero(~np.isnan(a), axis=-1)
+    s = np.sort(a, axis=-1)
+    lo = np.maximum((n - 1) // 2, 0)[..., None]
+    hi = np.maximum(n // 2, 0)[..., None]
+    med = (np.take_along_axis(s, lo, -1) + np.take_along_axis(s, hi, -1))[..., 0] / 2
+    return np.where(n > 0, med, np.nan), n
+
+
+def score(base: np.ndarray, x: np.ndarray, min_weeks: int = ANOMALY_MIN_WEEKS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    base (..., недели) — значения того же дня недели в прошлом (NaN — нет данных), x (...) — сам день.
+    -> (z, медиана); z = NaN, если истории меньше min_weeks недель или нет самого значения.
+    """
+    med, n = _nan_median(base)
+    mad, _ = _nan_median(np.abs(base - med[..., None]))
+    scale = np.maximum(np.maximum(MAD_SCALE * mad, np.sqrt(np.abs(med))), 1.0)
+    with np.errstate(invalid="ignore"):
+        z = (x - med) / scale
+    return np.where(n >= min_weeks, z, np.nan), med
+
+
+def rolling_z(
+    x: np.ndarray,
+    weeks: int = ANOMALY_WEEKS,
+    min_weeks: int = ANOMALY_MIN_WEEKS,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    x (..., T) — ряды без пропусков дат (нет данных — NaN). Для каждого дня t база —
+    x[t-7], x[t-14], …, x[t-7*weeks]. -> (z, медиана) той же формы, что x.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    t = x.shape[-1]
+    pad = np.full(x.shape[:-1] + (7 * weeks,), np.nan)
+    # окно в позиции t — x[t-7*weeks .. t-1], через 7 — ровно те же дни недели
+    base = sliding_window_view(np.concatenate([pad, x], axis=-1), 7 * weeks, axis=-1)[..., :t, ::7]
+    return score(base, x, min_weeks)
+
+
+def _flagged(z: np.ndarray, threshold: float) -> np.ndarray:
+    with np.errstate(invalid="ignore"):
+        return np.abs(z) >= threshold
+
+
+def find_daily(day: str, threshold: float = ANOMALY_Z) -> List[Anomaly]:
+    """
+    Аномалии итогов WB (переходы, заказы, затраты) за day. Считается вся история
+    (rolling_z), отдаётся только day. Дни без строки в БД и затраты NULL — NaN, не 0.
+    """
+    rows = storage.get_daily_series("wb", day)
+    if not rows or rows[-1][0] != day or threshold <= 0:
+        return []
+    d0 = date.fromisoformat(rows[0][0])
+    t = (date.fromisoformat(day) - d0).days + 1
+    x = np.full((len(DAILY_METRICS), t), np.nan)
+    idx = np.array([(date.fromisoformat(r[0]) - d0).days for r in rows])
+    x[:, idx] = np.array([r[1:] for r in rows], dtype=np.float64).T  # None -> nan
+    z, med = rolling_z(x)
+    out = []
+    for i, metric in enumerate(DAILY_METRICS):
+        if _flagged(z[i, -1], threshold):
+            out.append(Anomaly(metric, day, float(x[i, -1]), float(med[i, -1]), float(z[i, -1])))
+    return out
+
+
+def nm_matrix(rows: np.ndarray, day_keys: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    rows (R, 4): day, nm_id, clicks, orders -> (nm_ids (S,), x (метрики, S, дни)).
+    Артикула нет в загруженный день — 0 (отчёт пришёл, заказов не было); день без единой строки — NaN.
+    """
+    keys = np.asarray(day_keys, dtype=np.int64)
+    nm_ids, si = np.unique(rows[:, 1], return_inverse=True)
+    di = np.searchsorted(keys, rows[:, 0])
+    x = np.zeros((len(NM_METRICS), len(nm_ids), len(keys)))
+    x[:, si, di] = rows[:, 2:].T
+    x[:, :, ~np.isin(keys, rows[:, 0])] = np.nan
+    return nm_ids, x
+
+
+def score_nm(
+    x: np.ndarray,
+    threshold: float = ANOMALY_Z,
+    min_base: float = ANOMALY_MIN_BASE,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    x (метрики, S, недели+1) — тот же день недели по неделям, последний столбец — сам день.
+    -> (z, медиана, маска аномалий). Мелочь (значение и база < min_base) не отмечается.
+    """
+    z, med = score(x[..., :-1], x[..., -1])
+    level = np.fmax(x[..., -1], med)
+    return z, med, _flagged(z, threshold) & (level >= min_base)
+
+
+def find_nm(day: str, top_n: int = ANOMALY_TOP_NM, threshold: float = ANOMALY_Z) -> List[Anomaly]:
+    """
+    Топ-N аномалий по артикулам за day (по |z|): читаются только day и те же дни недели
+    прошлых ANOMALY_WEEKS недель, все артикулы — одной матрицей.
+    """
+    if top_n <= 0 or threshold <= 0:
+        return []
+    d = date.fromisoformat(day)
+    days = [(d - timedelta(days=7 * k)).isoformat() for k in range(ANOMALY_WEEKS, -1, -1)]
+    rows = np.array(storage.get_nm_days(days), dtype=np.int64).reshape(-1, 4)
+    keys = [int(x.replace("-", "")) for x in days]
+    if not len(rows) or keys[-1] not in rows[:, 0]:
+        return []
+    nm_ids, x = nm_matrix(rows, keys)
+    z, med, flagged = score_nm(x, threshold)
+
+    m_idx, s_idx = np.nonzero(flagged)
+    if not len(s_idx):
+        return []
+    top = np.argsort(-np.abs(z[m_idx, s_idx]), kind="stable")[:top_n]
+    codes = storage.get_vendor_codes(int(nm_ids[s_idx[i]]) for i in top)
+    out = []
+    for i in top:
+        m, s = m_idx[i], s_idx[i]
+        nm = int(nm_ids[s])
+        out.append(Anomaly(NM_METRICS[m], day, float(x[m, s, -1]), float(med[m, s]), float(z[m, s]),
+                           nm_id=nm, vendor_code=codes.get(nm)))
+    return out
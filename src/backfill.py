@@ -0,0 +1,144 @@
+"""
+Бэкфилл истории WB в daily_metrics / daily_nm_metrics за произвольный диапазон дат:
+
+    python -m src.main backfill 2025-01-01 2025-12-31
+
+Диапазон режется на окна по BACKFILL_WINDOW_DAYS (на окно — DETAIL_HISTORY_REPORT по каждому
+куску nmID). Куски всех окон идут через один fan-out wb_client.iter_window_reports: заказ —
+в пределах лимита nm-report, одновременно у WB генерируется не больше BACKFILL_MAX_PENDING
+отчётов, статусы всех ждущих — одним запросом. Окно, у которого пришли все куски, сразу
+уходит в архив отчётов и одной пачкой (executemany, одна транзакция) пишется в БД.
+
+Прогресс по окнам — в backfill_windows (SQLite). Запуск после падения продолжает, а не
+начинает заново: готовые окна пропускаются, скачанные куски лежат в spool/, заказанные
+отчёты докачиваются по wb_report_jobs. Упавший кусок (FAILED/таймаут) помечает FAILED
+только своё окно — остальные идут дальше, а это окно доделает следующий запуск.
+Окна, которые целиком есть в архиве (src/report_archive.py), грузятся без обращения к WB.
+"""
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, Dict, List
+
+from src import instrument, storage, wb_client
+from src.config import BACKFILL_MAX_PENDING, BACKFILL_MAX_WAIT, BACKFILL_WINDOW_DAYS
+from src.wb_client import WBDay
+
+Window = wb_client.Window
+
+
+@dataclass
+class BackfillResult:
+    windows: int = 0
+    done: int = 0
+    skipped: int = 0     # уже загружены прошлым запуском
+    failed: int = 0
+    days: int = 0
+    rows: int = 0        # строк день x nmID
+    elapsed_sec: float = 0.0
+
+    @property
+    def days_per_min(self) -> float:
+        return self.days * 60.0 / self.elapsed_sec if self.elapsed_sec > 0 else 0.0
+
+
+def plan_windows(start: str, end: str, window_days: int) -> List[Window]:
+    """
+    [start, end] -> подряд идущие окна по window_days дней (последнее может быть короче).
+    """
+    d, last = date.fromisoformat(start), date.fromisoformat(end)
+    out = []
+    while d <= last:
+        e = min(d + timedelta(days=max(window_days, 1) - 1), last)
+        out.append((d.isoformat(), e.isoformat()))
+        d = e + timedelta(days=1)
+    return out
+
+
+def _days(start: str, end: str) -> List[str]:
+    return [s for s, _ in plan_windows(start, end, 1)]
+
+
+def _done_days(start: str, end: str) -> set:
+    # дни, загруженные прошлыми запусками (окна могли быть нарезаны иначе)
+    out = set()
+    for s, e, status, *_ in storage.backfill_get_windows(start, end):
+        if status == "DONE":
+            out.update(_days(s, e))
+    return out
+
+
+def _load(start: str, end: str, days: Dict[str, WBDay]) -> int:
+    """
+    Окно -> БД. Дни без строк в отчёте пишем нулями (как fetch_wb_incremental),
+    затраты на рекламу — отдельным API (src/ads.py, закрытые дни — из БД). Дню, которого нет
+    в ответе (ошибка API), ad_spend не ставим: None не затирает записанное и не становится нулём.
+    Возвращает строк по nmID.
+    """
+    for day in _days(start, end):
+        days.setdefault(day, WBDay())
+    for dt, spend in wb_client.fetch_ads_spend_by_day(start, end).items():
+        if dt in days:
+            days[dt].ad_spend = spend
+
+    with instrument.span("backfill.load"):
+        storage.upsert_metrics_many((dt, "wb", 0, d.open, d.orders, d.ad_spend) for dt, d in days.items())
+        return storage.upsert_nm_metrics(
+            (dt, nm_id, m.open, m.orders) for dt, d in days.items() for nm_id, m in d.by_nm.items()
+        )
+
+
+def run_backfill(
+    start: str,
+    end: str,
+    window_days: int = BACKFILL_WINDOW_DAYS,
+    max_pending: int = BACKFILL_MAX_PENDING,
+    max_wait_sec: int = BACKFILL_MAX_WAIT,
+    progress: Callable[[str], None] = print,
+) -> BackfillResult:
+    """
+    Загрузить [start, end] для текущего кабинета. Окна, которые не удалось скачать,
+    остаются FAILED (в результате — failed); повторный запуск с теми же датами их доделает.
+    """
+    t0 = time.perf_counter()
+    windows = plan_windows(start, end, window_days)
+    storage.backfill_add_windows(windows)
+    done_days = _done_days(start, end)
+    res = BackfillResult(windows=len(windows))
+    wb_client.import_legacy_reports()
+
+    def finish(window: Window, days: Dict[str, WBDay], source: str) -> None:
+        s, e = window
+        rows = _load(s, e, days)
+        n = len(_days(s, e))
+        storage.backfill_set_status(s, e, "DONE", time.time(), days=n, rows=rows, source=source)
+        res.done += 1
+        res.days += n
+        res.rows += rows
+        instrument.count("backfill.days", n, source=source)
+        elapsed = time.perf_counter() - t0
+        progress(f"[backfill] {s}..{e} ok ({source}): {n} days, {rows} rows; "
+                 f"{res.days} days in {elapsed:.0f}s = {res.days * 60.0 / max(elapsed, 1e-9):.1f} days/min")
+
+    todo: List[Window] = []
+    for window in windows:
+        if all(d in done_days for d in _days(*window)):
+            res.skipped += 1
+        elif wb_client.archived(*window):
+            finish(window, wb_client.replay_detail_history(*window), "archive")
+        else:
+            todo.append(window)
+
+    errors: Dict[Window, str] = {}
+    for window, days in wb_client.iter_window_reports(todo, max_wait_sec, max(max_pending, 1), errors):
+        finish(window, days, "wb")
+
+    for (s, e), error in sorted(errors.items()):
+        storage.backfill_set_status(s, e, "FAILED", time.time(), error=error)
+        progress(f"[backfill] {s}..{e} FAILED: {error}")
+    res.failed = len(errors)
+
+    if res.done:
+        wb_client.archive_gc()
+    res.elapsed_sec = time.perf_counter() - t0
+    return res
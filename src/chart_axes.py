@@ -0,0 +1,255 @@
+"""
+Шкалы и подписи графиков — без matplotlib, общее для обоих рендереров (src/report.py, src/chart_pil.py).
+
+nice_scale — границы и шаг делений по данным («круглые» 1 / 2 / 2.5 / 5 x 10^k),
+place_labels — раскладка подписей разом по всему графику: подпись ставится
+на предпочтительную сторону, при наложении — на другую, иначе не ставится;
+point_labels / bar_labels — раскладка подписей точек линий и столбцов поверх неё.
+Всё в пикселях (y вниз): рендерер только переводит координаты и рисует готовые прямоугольники.
+"""
+import math
+from typing import Callable, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+NICE_STEPS = (1.0, 2.0, 2.5, 5.0, 10.0)
+MAX_TICKS = 6
+# подписи у каждой точки — только на коротких окнах, на 90 днях это каша
+ANNOTATE_MAX_POINTS = 31
+# сколько подписей дат по X максимум
+MAX_X_LABELS = 16
+
+
+class Scale(NamedTuple):
+    lo: float
+    hi: float
+    step: float
+
+    def ticks(self) -> List[float]:
+        n = int(round((self.hi - self.lo) / self.step))
+        return [self.lo + i * self.step for i in range(n + 1)]
+
+
+def _nice_step(raw: float) -> float:
+    exp = math.floor(math.log10(raw))
+    base = 10.0 ** exp
+    for s in NICE_STEPS:
+        if raw <= s * base * (1 + 1e-9):
+            return s * base
+    return 10.0 * base
+
+
+def nice_scale(
+    values: Iterable[float],
+    zero: bool = True,
+    headroom: float = 0.0,
+    max_ticks: int = MAX_TICKS,
+) -> Scale:
+    """
+    Шкала под values. zero — от нуля (столбцы; для линий False — от «круглого» значения
+    под минимумом, как было 300 у заказов). headroom — доля диапазона сверху под подписи.
+    """
+    vals = [float(v) for v in values if v is not None and math.isfinite(v)]
+    lo = min(vals) if vals else 0.0
+    hi = max(vals) if vals else 0.0
+    positive = lo >= 0
+    if zero:
+        lo = min(lo, 0.0)
+    if hi <= lo:
+        # ровная линия или пусто: хоть какой-то диапазон вокруг значения
+        pad = abs(hi) * 0.1 or 1.0
+        lo, hi = lo - pad, hi + pad
+    span = hi - lo
+    hi += span * headroom
+    if not zero:
+        # линии: запас и снизу — под подписи «под точкой»
+        lo -= span * headroom
+    if positive:
+        lo = max(lo, 0.0)
+
+    step = _nice_step((hi - lo) / max(max_ticks - 1, 1))
+    # round — убрать хвосты float (12.200000000000001)
+    lo_n = round(math.floor(lo / step + 1e-9) * step, 10)
+    hi_n = round(math.ceil(hi / step - 1e-9) * step, 10)
+    return Scale(lo_n, hi_n, step)
+
+
+def x_label_step(n: int) -> int:
+    # каждую какую дату подписывать по X
+    return max(1, math.ceil(n / MAX_X_LABELS))
+
+
+def cpo_values(spend: Sequence[Optional[float]], orders: Sequence[int]) -> List[Optional[float]]:
+    # CPO = spend / orders; нет затрат за день (None) — нет и CPO
+    return [None if s is None else (float(s) / o if o else 0.0) for s, o in zip(spend, orders)]
+
+
+def chart_scales(clicks: Sequence[int], orders: Sequence[int], spend: Sequence[Optional[float]] = ()) -> dict:
+    """
+    Шкалы осей графика «переходы + заказы / затраты + CPO»: столбцы — от нуля,
+    линия заказов — от «круглого» значения под минимумом; сверху запас под подписи.
+    """
+    return {
+        "clicks": nice_scale(clicks, zero=True, headroom=0.12),
+        "orders": nice_scale(orders, zero=False, headroom=0.12),
+        "spend": nice_scale(spend, zero=True, headroom=0.08),
+        "cpo": nice_scale(cpo_values(spend, orders), zero=True, headroom=0.08),
+    }
+
+
+def fmt_tick(v: float, step: float) -> str:
+    # знаков после запятой — сколько нужно шагу (2.5 -> 1, 0.25 -> 2, 1000 -> 0)
+    digits = 0
+    while digits < 6 and abs(step * 10 ** digits - round(step * 10 ** digits)) > 1e-6:
+        digits += 1
+    if digits == 0:
+        return f"{int(round(v)):,}".replace(",", " ")
+    return f"{v:.{digits}f}"
+
+
+Box = Tuple[float, float, float, float]  # x0, y0, x1, y1 (пиксели, y вниз)
+
+
+class Label(NamedTuple):
+    x: float          # точка, к которой подпись (пиксели)
+    y: float
+    w: float          # размер текста (пиксели)
+    h: float
+    above: bool       # предпочтительная сторона
+    gap: float        # отступ от точки до края текста
+
+
+def _box(lb: Label, above: bool) -> Box:
+    x0 = lb.x - lb.w / 2
+    if above:
+        return (x0, lb.y - lb.gap - lb.h, x0 + lb.w, lb.y - lb.gap)
+    return (x0, lb.y + lb.gap, x0 + lb.w, lb.y + lb.gap + lb.h)
+
+
+def _hits(b: Box, boxes: List[Box]) -> bool:
+    x0, y0, x1, y1 = b
+    for bx0, by0, bx1, by1 in boxes:
+        if x0 < bx1 and bx0 < x1 and y0 < by1 and by0 < y1:
+            return True
+    return False
+
+
+Point = Tuple[float, float]
+
+
+def _crosses(b: Box, segments: Sequence[Tuple[Point, Point]]) -> bool:
+    # пересекает ли прямоугольник хоть один отрезок линии графика
+    bx0, by0, bx1, by1 = b
+    corners = ((bx0, by0), (bx1, by0), (bx0, by1), (bx1, by1))
+    for (x0, y0), (x1, y1) in segments:
+        if max(x0, x1) < bx0 or min(x0, x1) > bx1 or max(y0, y1) < by0 or min(y0, y1) > by1:
+            continue
+        sides = [(x1 - x0) * (cy - y0) - (y1 - y0) * (cx - x0) for cx, cy in corners]
+        if not (all(v > 0 for v in sides) or all(v < 0 for v in sides)):
+            return True
+    return False
+
+
+def place_labels(
+    labels: Sequence[Label],
+    area: Optional[Box] = None,
+    taken: Optional[List[Box]] = None,
+    segments: Sequence[Tuple[Point, Point]] = (),
+    force: bool = False,
+) -> List[Optional[Box]]:
+    """
+    Для каждой подписи — её прямоугольник или None (негде поставить). area — куда подпись
+    должна поместиться целиком; taken — уже занятые места (легенда, маркеры), дополняется
+    поставленными. Подпись не кладём на другую подпись; линию (segments) — по возможности
+    обходим другой стороной. force — если места нет, всё равно ставим на предпочтительную
+    сторону (значения столбцов терять нельзя). Раньше в списке — выше приоритет.
+    """
+    taken = [] if taken is None else taken
+    out: List[Optional[Box]] = []
+    for lb in labels:
+        fits = []
+        for above in (lb.above, not lb.above):
+            b = _box(lb, above)
+            if area is not None and (b[0] < area[0] or b[1] < area[1] or b[2] > area[2] or b[3] > area[3]):
+                continue
+            if not _hits(b, taken):
+                fits.append((_crosses(b, segments), b))
+        placed = min(fits, key=lambda f: f[0])[1] if fits else None
+        if placed is None and force:
+            placed = _box(lb, lb.above)
+        if placed is not None:
+            taken.append(placed)
+        out.append(placed)
+    return out
+
+
+Measure = Callable[[str], Tuple[float, float]]
+
+
+def point_labels(
+    clicks: Sequence[Point],
+    orders: Sequence[Point],
+    clicks_values: Sequence[int],
+    orders_values: Sequence[int],
+    measure: Measure,
+    gap: float,
+    marker: float,
+    area: Box,
+    taken: List[Box],
+) -> List[Tuple[Box, str, int]]:
+    """
+    Подписи точек двух линий (в пикселях): переходы над точкой, заказы под.
+    -> (прямоугольник, текст, 0 — переходы / 1 — заказы) для тех, что поместились.
+    """
+    taken = list(taken) + [(x - marker, y - marker, x + marker, y + marker) for x, y in list(clicks) + list(orders)]
+    segments = list(zip(clicks, clicks[1:])) + list(zip(orders, orders[1:]))
+    labels, meta = [], []
+    # по очереди переходы / заказы одного дня — чтобы при тесноте подписи теряла не одна линия
+    for i in range(len(clicks)):
+        for series, (x, y), value, above in ((0, clicks[i], clicks_values[i], True),
+                                             (1, orders[i], orders_values[i], False)):
+            text = f"{value}"
+            w, h = measure(text)
+            labels.append(Label(x, y, w, h, above, gap))
+            meta.append((text, series))
+    placed = place_labels(labels, area, taken, segments)
+    return [(b, text, series) for b, (text, series) in zip(placed, meta) if b is not None]
+
+
+def bar_labels(
+    xs: Sequence[float],
+    base: float,
+    spend_tops: Sequence[float],
+    cpo_tops: Sequence[float],
+    spend: Sequence[Optional[float]],
+    cpo: Sequence[Optional[float]],
+    measure_spend: Measure,
+    measure_cpo: Measure,
+    gap: float,
+    area: Box,
+) -> List[Tuple[Box, str, str]]:
+    """
+    Подписи столбцов (в пикселях, base — y нуля): CPO внутри жёлтого столбца у верхушки,
+    затраты внутри синего у верхушки, а если не влезают или легли на подпись CPO — над столбцом.
+    День без данных (значение None) без подписи, его верхушка не используется.
+    -> (прямоугольник, текст, "spend" | "cpo_in" | "cpo_out").
+    """
+    taken: List[Box] = []
+    out = []
+    for group, tops, values, measure, fmt in (
+        ("cpo", cpo_tops, cpo, measure_cpo, lambda v: f"{v:.1f}"),
+        ("spend", spend_tops, spend, measure_spend, lambda v: f"{int(v):,}".replace(",", " ")),
+    ):
+        labels, texts = [], []
+        for x, top, v in zip(xs, tops, values):
+            if v is None:
+                continue
+            text = fmt(v)
+            w, h = measure(text)
+            inside = base - top >= h + 2 * gap
+            labels.append(Label(x, top, w, h, not inside, gap))
+            texts.append(text)
+        for b, lb, text in zip(place_labels(labels, area, taken, force=True), labels, texts):
+            kind = group
+            if group == "cpo":
+                kind = "cpo_in" if b[1] >= lb.y and b[3] <= base else "cpo_out"
+            out.append((b, text, kind))
+    return out
@@ -0,0 +1,260 @@
+"""
+Быстрый рендерер графиков по дням на Pillow (CHART_RENDERER=pil) — для раскладок
+funnel и dual из src/report.py: линии, заливка, столбцы, сетка, подписи.
+
+Тот же размер картинки, те же цвета, шкалы и подписи (src/chart_axes.py), что у matplotlib,
+но рисуем прямо в пиксели: нет дерева артистов, раскладки и сглаживания линий.
+"""
+import os
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import matplotlib
+from PIL import Image, ImageDraw, ImageFont
+
+from src.chart_axes import (
+    ANNOTATE_MAX_POINTS, Box, Scale, bar_labels, chart_scales, cpo_values, fmt_tick, point_labels, x_label_step,
+)
+
+LAYOUTS = ("funnel", "dual")
+
+# поля вокруг области графика, в пунктах (как у matplotlib: 1pt = dpi/72 пикселей)
+MARGIN_LEFT, MARGIN_RIGHT, MARGIN_TOP, MARGIN_BOTTOM = 68, 68, 32, 30
+PANEL_GAP = 12
+
+TEXT = (0, 0, 0)
+SPINE = (0, 0, 0)
+GRID = (176, 176, 176)  # цвет сетки matplotlib, прозрачность — через _blend
+
+
+@lru_cache(maxsize=None)
+def _font(size: int, bold: bool = False):
+    # DejaVu из поставки matplotlib: та же гарнитура и кириллица
+    name = "DejaVuSans-Bold.ttf" if bold else "DejaVuSans.ttf"
+    try:
+        return ImageFont.truetype(os.path.join(matplotlib.get_data_path(), "fonts", "ttf", name), size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+def _rgb(color: str) -> Tuple[int, int, int]:
+    c = color.lstrip("#")
+    return int(c[0:2], 16), int(c[2:4], 16), int(c[4:6], 16)
+
+
+def _blend(color, alpha: float, bg=(255, 255, 255)) -> Tuple[int, int, int]:
+    # полупрозрачный цвет поверх белого фона = непрозрачный цвет (alpha-каналы не нужны)
+    c = _rgb(color) if isinstance(color, str) else color
+    return tuple(int(round(a * alpha + b * (1 - alpha))) for a, b in zip(c, bg))
+
+
+class _Canvas:
+    def __init__(self, style: dict):
+        w, h = style["figsize"]
+        self.pt = style["dpi"] / 72.0
+        self.size = (int(round(w * style["dpi"])), int(round(h * style["dpi"])))
+        self.img = Image.new("RGB", self.size, "white")
+        self.draw = ImageDraw.Draw(self.img)
+        self.style = style
+
+    def px(self, points: float) -> int:
+        return max(1, int(round(points * self.pt)))
+
+    def font(self, points: float, bold: bool = False):
+        return _font(self.px(points), bold)
+
+    def text_size(self, text: str, font) -> Tuple[int, int]:
+        x0, y0, x1, y1 = font.getbbox(text)
+        return x1 - x0, y1 - y0
+
+    def measure(self, font):
+        # размер подписи для раскладки: ширина + полная высота строки (её центрует anchor="mm")
+        ascent, descent = font.getmetrics()
+        return lambda text: (font.getlength(text), ascent + descent)
+
+    def vtext(self, text: str, font, center: Tuple[float, float]) -> None:
+        # подпись оси, повёрнутая на 90° (снизу вверх, как у matplotlib)
+        w, h = self.text_size(text, font)
+        tile = Image.new("L", (w + 4, h + font.size // 2))
+        ImageDraw.Draw(tile).text((2, 0), text, font=font, fill=255)
+        tile = tile.rotate(90, expand=True)
+        pos = (int(center[0] - tile.width / 2), int(center[1] - tile.height / 2))
+        self.img.paste(Image.new("RGB", tile.size, TEXT), pos, tile)
+
+
+def _y(scale: Scale, box: Box, v: float) -> float:
+    return box[3] - (float(v) - scale.lo) / (scale.hi - scale.lo) * (box[3] - box[1])
+
+
+def _xs(box: Box, n: int) -> List[float]:
+    step = (box[2] - box[0]) / max(n, 1)
+    return [box[0] + (i + 0.5) * step for i in range(n)]
+
+
+def _y_axis(cv: _Canvas, box: Box, scale: Scale, right: bool, grid_alpha: Optional[float], label: str = "") -> None:
+    d, font = cv.draw, cv.font(10)
+    tick = cv.px(3.5)
+    for t in scale.ticks():
+        y = _y(scale, box, t)
+        if grid_alpha:
+            d.line([(box[0], y), (box[2], y)], fill=_blend(GRID, grid_alpha), width=cv.px(0.8))
+        x = box[2] if right else box[0]
+        d.line([(x, y), (x + tick if right else x - tick, y)], fill=SPINE, width=cv.px(0.8))
+        d.text((x + tick + cv.px(3.5), y) if right else (x - tick - cv.px(3.5), y),
+               fmt_tick(t, scale.step), font=font, fill=TEXT, anchor="lm" if right else "rm")
+    if label:
+        widest = max(cv.text_size(fmt_tick(t, scale.step), font)[0] for t in scale.ticks())
+        off = tick + cv.px(3.5) + widest + cv.px(4) + font.size / 2
+        cv.vtext(label, font, (box[2] + off if right else box[0] - off, (box[1] + box[3]) / 2))
+
+
+def _x_grid(cv: _Canvas, box: Box, xs: List[float]) -> None:
+    for x in xs:
+        cv.draw.line([(x, box[1]), (x, box[3])], fill=_blend(GRID, 0.08), width=cv.px(0.8))
+
+
+def _spines(cv: _Canvas, box: Box) -> None:
+    cv.draw.rectangle(box, outline=SPINE, width=cv.px(0.8))
+
+
+def _legend(cv: _Canvas, box: Box, items: List[Tuple[str, Tuple[int, int, int], bool]]) -> Box:
+    """
+    Легенда в левом верхнем углу: (текст, цвет, линия/квадрат). Возвращает занятый прямоугольник.
+    """
+    d, font = cv.draw, cv.font(10)
+    pad, sample, row = cv.px(5), cv.px(20), cv.px(14)
+    width = pad * 3 + sample + max(cv.text_size(t, font)[0] for t, _, _ in items)
+    x0, y0 = box[0] + cv.px(5), box[1] + cv.px(5)
+    rect = (x0, y0, x0 + width, y0 + pad * 2 + row * len(items))
+    d.rounded_rectangle(rect, radius=cv.px(2), fill="white", outline=(204, 204, 204), width=cv.px(0.8))
+    for i, (text, color, line) in enumerate(items):
+        cy = y0 + pad + row * i + row / 2
+        if line:
+            d.line([(x0 + pad, cy), (x0 + pad + sample, cy)], fill=color, width=cv.px(2))
+        else:
+            d.rectangle((x0 + pad, cy - row / 3, x0 + pad + sample, cy + row / 3), fill=color)
+        d.text((x0 + pad * 2 + sample, cy), text, font=font, fill=TEXT, anchor="lm")
+    return rect
+
+
+def _draw_lines(cv: _Canvas, box: Box, spec, scales: dict) -> None:
+    d, style = cv.draw, cv.style
+    n = len(spec.labels)
+    xs = _xs(box, n)
+    annotate = n <= ANNOTATE_MAX_POINTS
+    c_clicks, c_orders = _rgb(style["color_clicks"]), _rgb(style["color_orders"])
+    s_clicks, s_orders = scales["clicks"], scales["orders"]
+    clicks = [(x, _y(s_clicks, box, v)) for x, v in zip(xs, spec.clicks)]
+    orders = [(x, _y(s_orders, box, v)) for x, v in zip(xs, spec.orders)]
+
+    # заливка под переходами, сверху — сетка (как set_axisbelow у matplotlib)
+    if clicks:
+        base = _y(s_clicks, box, max(s_clicks.lo, 0.0))
+        d.polygon([(clicks[0][0], base)] + clicks + [(clicks[-1][0], base)], fill=_blend(c_clicks, 0.12))
+    _x_grid(cv, box, xs)
+    _y_axis(cv, box, s_clicks, right=False, grid_alpha=0.25)
+    _y_axis(cv, box, s_orders, right=True, grid_alpha=None, label="Заказы")
+
+    r = cv.px(3)
+    for pts, color, width in ((clicks, c_clicks, 2.6), (orders, c_orders, 2.2)):
+        if len(pts) > 1:
+            d.line(pts, fill=color, width=cv.px(width), joint="curve")
+        if annotate:
+            for x, y in pts:
+                d.ellipse((x - r, y - r, x + r, y + r), fill=color)
+
+    taken = [_legend(cv, box, [("Переходы", c_clicks, True), ("Заказы", c_orders, True)])]
+    _spines(cv, box)
+    if not annotate:
+        return
+
+    # подписи точек разом: переходы над точкой, заказы под; при наложении — на другую сторону
+    font = cv.font(style["label_fontsize"], bold=True)
+    for b, text, series in point_labels(clicks, orders, spec.clicks, spec.orders, cv.measure(font),
+                                        cv.px(5), r, box, taken):
+        d.text(((b[0] + b[2]) / 2, (b[1] + b[3]) / 2), text, font=font,
+               fill=c_clicks if series == 0 else c_orders, anchor="mm")
+
+
+def _draw_bars(cv: _Canvas, box: Box, spec, scales: dict) -> None:
+    d, style = cv.draw, cv.style
+    n = len(spec.labels)
+    spend = list(spec.spend)
+    if all(s is None for s in spend):
+        d.text((box[0] + (box[2] - box[0]) * 0.02, box[1] + (box[3] - box[1]) * 0.35),
+               "Затраты: нет данных", font=cv.font(11), fill=TEXT, anchor="lm")
+        _y_axis(cv, box, Scale(0.0, 1.0, 0.2), right=False, grid_alpha=0.15, label="Затраты (₽)")
+        _spines(cv, box)
+        return
+
+    xs = _xs(box, n)
+    slot = (box[2] - box[0]) / max(n, 1)
+    annotate = n <= ANNOTATE_MAX_POINTS
+    s_spend, s_cpo = scales["spend"], scales["cpo"]
+    c_spend = _blend(style["color_spend"], 0.30)
+    c_cpo = _blend(style["color_cpo"], 0.95)
+    cpo = cpo_values(spend, spec.orders)
+
+    _x_grid(cv, box, xs)
+    _y_axis(cv, box, s_spend, right=False, grid_alpha=0.15, label="Затраты (₽)")
+    _y_axis(cv, box, s_cpo, right=True, grid_alpha=None, label="CPO (₽/заказ)")
+    y0_spend, y0_cpo = _y(s_spend, box, 0.0), _y(s_cpo, box, 0.0)
+    # день без данных (None) — без столбцов и подписей
+    for x, v in zip(xs, spend):
+        if v is not None:
+            d.rectangle((x - slot * 0.4, _y(s_spend, box, v), x + slot * 0.4, y0_spend), fill=c_spend)
+    for x, v in zip(xs, cpo):
+        if v is None:
+            continue
+        # узкий CPO "внутри" широкого столбца затрат
+        d.rectangle((x - slot * 0.175, _y(s_cpo, box, v), x + slot * 0.175, y0_cpo), fill=c_cpo)
+
+    if annotate:
+        font = cv.font(style["label_fontsize"], bold=True)
+        font_cpo = cv.font(7, bold=True)
+        for b, text, kind in bar_labels(
+            xs, y0_spend,
+            [_y(s_spend, box, v or 0.0) for v in spend], [_y(s_cpo, box, v or 0.0) for v in cpo],
+            spend, cpo, cv.measure(font), cv.measure(font_cpo), cv.px(2), box,
+        ):
+            d.text(((b[0] + b[2]) / 2, (b[1] + b[3]) / 2), text, font=font if kind == "spend" else font_cpo,
+                   fill="white" if kind == "cpo_in" else TEXT, anchor="mm")
+
+    _legend(cv, box, [("Затраты (₽)", c_spend, False), ("CPO (₽/заказ)", c_cpo, False)])
+    _spines(cv, box)
+
+
+def render(spec, out_path: str, style: dict) -> str:
+    """
+    Нарисовать ChartSpec (layout funnel / dual) в PNG того же размера, что у matplotlib.
+    """
+    if spec.layout not in LAYOUTS:
+        raise ValueError(f"Unsupported chart layout for Pillow renderer: {spec.layout}")
+    cv = _Canvas(style)
+    w, h = cv.size
+    d = cv.draw
+    d.text((w / 2, cv.px(10)), spec.title, font=cv.font(12), fill=TEXT, anchor="mt")
+
+    area = (cv.px(MARGIN_LEFT), cv.px(MARGIN_TOP), w - cv.px(MARGIN_RIGHT), h - cv.px(MARGIN_BOTTOM))
+    scales = chart_scales(spec.clicks, spec.orders, spec.spend)
+    if spec.layout == "funnel":
+        split = area[1] + (area[3] - area[1] - cv.px(PANEL_GAP)) * 3 / 5
+        top = (area[0], area[1], area[2], split)
+        bottom = (area[0], split + cv.px(PANEL_GAP), area[2], area[3])
+        _draw_lines(cv, top, spec, scales)
+        _draw_bars(cv, bottom, spec, scales)
+        last = bottom
+    else:
+        _draw_lines(cv, area, spec, scales)
+        last = area
+
+    # даты по X (под нижней панелью)
+    font, tick = cv.font(10), cv.px(3.5)
+    xs = _xs(last, len(spec.labels))
+    step = x_label_step(len(spec.labels))
+    for i in range(0, len(xs), step):
+        d.line([(xs[i], last[3]), (xs[i], last[3] + tick)], fill=SPINE, width=cv.px(0.8))
+        d.text((xs[i], last[3] + tick + cv.px(3.5)), spec.labels[i], font=font, fill=TEXT, anchor="mt")
+
+    cv.img.save(out_path, "PNG")
+    return out_path
@@ -7,12 +7,81 @@ TG_BOT_TOKEN = os.getenv("TG_BOT_TOKEN", "").strip()
 TG_CHAT_ID = os.getenv("TG_CHAT_ID", "").strip()
 
 WB_TOKEN = os.getenv("WB_TOKEN", "").strip()
+# адреса API WB (переопределяются для локального стенда, см. bench/fake_wb.py)
+WB_ANALYTICS_BASE = os.getenv("WB_ANALYTICS_BASE", "https://seller-analytics-api.wildberries.ru").rstrip("/")
+WB_ADS_BASE = os.getenv("WB_ADS_BASE", "https://advert-api.wildberries.ru").rstrip("/")
+WB_CONTENT_BASE = os.getenv("WB_CONTENT_BASE", "https://content-api.wildberries.ru").rstrip("/")
 
 TZ = os.getenv("TZ", "Europe/Moscow").strip()
 REPORT_TIME = os.getenv("REPORT_TIME", "10:05").strip()
 DAYS = int(os.getenv("DAYS", "14"))
+# сколько последних дней WB ещё "доезжают" (заказы/переходы досчитываются) —
+# их перезапрашиваем при каждом запуске, более старые берём из БД
+WB_SETTLE_DAYS = int(os.getenv("WB_SETTLE_DAYS", "3"))
+# парсер отчёта WB: pandas | csv | auto
+WB_PARSE_ENGINE = os.getenv("WB_PARSE_ENGINE", "auto").strip().lower()
+# сколько максимум ждём генерации отчёта WB за один запуск (потом докачаем в следующий)
+WB_REPORT_MAX_WAIT = int(os.getenv("WB_REPORT_MAX_WAIT", "240"))
+# по сколько nmID в одном DETAIL_HISTORY_REPORT (большой каталог = несколько отчётов параллельно)
+WB_NM_CHUNK_SIZE = int(os.getenv("WB_NM_CHUNK_SIZE", "1000"))
+# бэкфилл истории (python -m src.main backfill FROM [TO]): окно одного отчёта, дней
+BACKFILL_WINDOW_DAYS = int(os.getenv("BACKFILL_WINDOW_DAYS", "31"))
+# сколько отчётов бэкфилла одновременно генерируется у WB
+BACKFILL_MAX_PENDING = int(os.getenv("BACKFILL_MAX_PENDING", "3"))
+# сколько ждём генерации одного отчёта бэкфилла (потом окно FAILED, доделает следующий запуск)
+BACKFILL_MAX_WAIT = int(os.getenv("BACKFILL_MAX_WAIT", "1800"))
+# архив сырых отчётов WB (src/report_archive.py): сколько дней истории хранить (0 — всё)
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "400"))
+# сколько дней держать прошлые версии дня, которые WB потом пересчитал
+ARCHIVE_SUPERSEDED_KEEP_DAYS = int(os.getenv("ARCHIVE_SUPERSEDED_KEEP_DAYS", "7"))
+# затраты на рекламу (src/ads.py): через сколько дней WB больше не дописывает списания за день —
+# такие дни закрыты и у API больше не запрашиваются
+ADS_CLOSED_AFTER_DAYS = int(os.getenv("ADS_CLOSED_AFTER_DAYS", "2"))
+# незакрытые дни перезапрашиваем не чаще, чем раз в столько минут
+ADS_OPEN_TTL_MIN = int(os.getenv("ADS_OPEN_TTL_MIN", "30"))
+# аномалии в сводке (src/anomaly.py): день сравнивается с тем же днём недели прошлых ANOMALY_WEEKS недель
+ANOMALY_WEEKS = int(os.getenv("ANOMALY_WEEKS", "6"))
+# меньше недель истории — не оцениваем
+ANOMALY_MIN_WEEKS = int(os.getenv("ANOMALY_MIN_WEEKS", "3"))
+# порог робастного z (|z| >= порога — аномалия), 0 — не искать
+ANOMALY_Z = float(os.getenv("ANOMALY_Z", "3.5"))
+# артикулы, у которых и значение, и обычный уровень меньше этого, не отмечаем (шум малых чисел)
+ANOMALY_MIN_BASE = float(os.getenv("ANOMALY_MIN_BASE", "10"))
+# сколько артикулов с аномалиями показывать в сводке
+ANOMALY_TOP_NM = int(os.getenv("ANOMALY_TOP_NM", "5"))
+# сколько кабинетов (аккаунтов WB) обрабатываем одновременно; лимиты WB у каждого свои
+ACCOUNTS_WORKERS = int(os.getenv("ACCOUNTS_WORKERS", "4"))
+# режим демона (python -m src.main daemon):
+# за сколько минут до REPORT_TIME начинаем тянуть данные WB, чтобы отчёт ушёл вовремя
+SCHEDULER_PREFETCH_MIN = int(os.getenv("SCHEDULER_PREFETCH_MIN", "30"))
+# как часто обновлять данные в течение дня (минуты, 0 — не обновлять)
+SCHEDULER_REFRESH_MIN = int(os.getenv("SCHEDULER_REFRESH_MIN", "0"))
+# через сколько минут повторять упавший sync/send
+SCHEDULER_RETRY_MIN = int(os.getenv("SCHEDULER_RETRY_MIN", "5"))
 
-if not TG_BOT_TOKEN:
-    raise RuntimeError("TG_BOT_TOKEN is empty in .env")
-if not TG_CHAT_ID:
-    raise RuntimeError("TG_CHAT_ID is empty in .env")
+# сколько процессов рисуют графики (0 — по числу доступных ядер)
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "0"))
+# чем рисовать графики по дням: matplotlib | pil (Pillow — быстрее, попроще; топ артикулов — всегда matplotlib)
+CHART_RENDERER = os.getenv("CHART_RENDERER", "matplotlib").strip().lower()
+
+# замеры по этапам (src/instrument.py): файл для Prometheus textfile collector
+# (на каждую команду свой: metrics_sync.prom, metrics_send.prom ...), пусто — не писать
+METRICS_PROM_PATH = os.getenv("METRICS_PROM_PATH", "data/metrics.prom").strip()
+# какие этапы снимать cProfile (через запятую, например "wb.parse,report.charts")
+PROFILE_STAGES = {s.strip() for s in os.getenv("PROFILE_STAGES", "").split(",") if s.strip()}
+
+def require_bot_token() -> None:
+    """
+    Токен бота — для любой отправки; чат может прийти из подписок (tg_subscriptions).
+    """
+    if not TG_BOT_TOKEN:
+        raise RuntimeError("TG_BOT_TOKEN is empty in .env")
+
+def require_telegram() -> None:
+    """
+    Токен и чат нужны только для отправки — проверяем при отправке, а не при импорте,
+    чтобы sync/report работали и без них.
+    """
+    require_bot_token()
+    if not TG_CHAT_ID:
+        raise RuntimeError("TG_CHAT_ID is empty in .env")
@@ -0,0 +1,81 @@
+"""
+Рассылка отчёта по подпискам (tg_subscriptions).
+
+Каждый вариант отчёта рендерится один раз; его картинки заливаются в Telegram
+один раз (первому получателю), остальным уходят по file_id. Отправка получателям
+идёт параллельно, лимиты Telegram (на чат и общий) соблюдает tg_sender.
+Не доставленное — в outbox, как и при одиночной отправке.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+from src import accounts, storage, tg_sender
+from src.config import TG_CHAT_ID, require_bot_token, require_telegram
+
+DELIVERY_WORKERS = 8
+
+Rendered = Tuple[str, List[str]]
+
+
+def subscriptions() -> List[Tuple[str, str]]:
+    """
+    Подписки текущего аккаунта из БД; если их нет — старое поведение:
+    TG_CHAT_ID получает полный отчёт (только для default-кабинета).
+    """
+    subs = storage.get_subscriptions()
+    if not subs and TG_CHAT_ID and accounts.current_id() == accounts.DEFAULT_ACCOUNT_ID:
+        subs = [(TG_CHAT_ID, "full")]
+    return subs
+
+
+def _send(chat_id: str, rendered: Rendered, file_ids: List[str] = None) -> Tuple[bool, List[str]]:
+    text, photos = rendered
+    try:
+        return True, tg_sender.deliver(chat_id, text, photos, file_ids=file_ids or None)
+    except Exception as e:
+        tg_sender.enqueue(chat_id, text, photos, e)
+        return False, []
+
+
+def fan_out(render: Callable[[str], Rendered]) -> Dict[Tuple[str, str], bool]:
+    """
+    render(variant) -> (text, photos). Возвращает {(chat_id, variant): доставлено ли сразу}.
+    """
+    # получатели — из подписок, TG_CHAT_ID нужен, только если их нет
+    require_bot_token()
+    subs = subscriptions()
+    if not subs and not TG_CHAT_ID:
+        require_telegram()
+    tg_sender.flush_outbox()
+
+    by_variant: Dict[str, List[str]] = {}
+    for chat_id, variant in subs:
+        by_variant.setdefault(variant, []).append(chat_id)
+    if not by_variant:
+        return {}
+
+    rendered = {variant: render(variant) for variant in by_variant}
+    results: Dict[Tuple[str, str], bool] = {}
+
+    with ThreadPoolExecutor(max_workers=DELIVERY_WORKERS, thread_name_prefix="tg") as pool:
+        # 1) первому получателю каждого варианта — с загрузкой файлов, заодно получаем file_id
+        first = {
+            variant: pool.submit(_send, chats[0], rendered[variant])
+            for variant, chats in by_variant.items()
+        }
+        file_ids = {}
+        for variant, fut in first.items():
+            ok, ids = fut.result()
+            results[(by_variant[variant][0], variant)] = ok
+            file_ids[variant] = ids
+
+        # 2) остальным — по file_id, параллельно
+        rest = {
+            (chat_id, variant): pool.submit(_send, chat_id, rendered[variant], file_ids[variant])
+            for variant, chats in by_variant.items()
+            for chat_id in chats[1:]
+        }
+        for key, fut in rest.items():
+            results[key] = fut.result()[0]
+
+    return results
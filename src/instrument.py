@@ -0,0 +1,207 @@
+"""
+Замеры по этапам запуска: где ушло время, сколько байт/строк/запросов/ретраев.
+
+    with instrument.run("sync"):          # один запуск команды (main / демон)
+        with instrument.span("wb.parse"):  # этап: суммарное время, число вызовов, максимум
+            ...
+        instrument.count("wb.rows", n)      # счётчик (можно с метками: family="nm-report")
+
+Замеры копятся в памяти (агрегатами, а не событиями — накладные копеечные)
+и в конце запуска пишутся в SQLite (runs / run_spans / run_counters) и в текстовый
+файл Prometheus (METRICS_PROM_PATH, для node_exporter textfile collector).
+Span'ы помечаются аккаунтом, если он не default.
+
+PROFILE_STAGES="wb.parse,report.charts" — эти этапы дополнительно снимаются cProfile
+в data/profiles/<run_id>_<этап>.prof (смотреть: python -m pstats / snakeviz).
+"""
+import cProfile
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+from src import accounts
+from src.config import METRICS_PROM_PATH, PROFILE_STAGES
+
+Labels = Tuple[Tuple[str, str], ...]
+Key = Tuple[str, Labels]
+
+PROFILE_DIR = os.path.join("data", "profiles")
+
+
+def _labels(extra: Dict[str, object]) -> Labels:
+    acc = accounts.current_id()
+    items = {k: str(v) for k, v in extra.items()}
+    if acc != accounts.DEFAULT_ACCOUNT_ID:
+        items.setdefault("account", acc)
+    return tuple(sorted(items.items()))
+
+
+class Run:
+    def __init__(self, command: str):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.command = command
+        self.started_at = time.time()
+        # span: (name, labels) -> [calls, total_sec, max_sec]
+        self.spans: Dict[Key, list] = {}
+        self.counters: Dict[Key, float] = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, key: Key, sec: float) -> None:
+        with self._lock:
+            s = self.spans.get(key)
+            if s is None:
+                self.spans[key] = [1, sec, sec]
+            else:
+                s[0] += 1
+                s[1] += sec
+                s[2] = max(s[2], sec)
+
+    def add(self, key: Key, value: float) -> None:
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+# вне instrument.run() замеры тоже копятся (бенчмарки, ручной вызов) — просто никуда не пишутся
+_current = Run("adhoc")
+_profile_lock = threading.Lock()
+
+
+def current() -> Run:
+    return _current
+
+
+@contextmanager
+def span(name: str, **labels) -> Iterator[None]:
+    key = (name, _labels(labels))
+    prof = _start_profile(name)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current.add_span(key, time.perf_counter() - t0)
+        if prof is not None:
+            _stop_profile(prof, name)
+
+
+def count(name: str, value: float = 1, **labels) -> None:
+    _current.add((name, _labels(labels)), value)
+
+
+def _start_profile(name: str) -> Optional[cProfile.Profile]:
+    if name not in PROFILE_STAGES:
+        return None
+    # cProfile не любит вложенные/параллельные профили — профилируем по одному
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except ValueError:
+        _profile_lock.release()
+        return None
+    return prof
+
+
+def _stop_profile(prof: cProfile.Profile, name: str) -> None:
+    try:
+        prof.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        prof.dump_stats(os.path.join(PROFILE_DIR, f"{_current.run_id}_{name}.prof"))
+    finally:
+        _profile_lock.release()
+
+
+@contextmanager
+def run(command: str) -> Iterator[Run]:
+    """
+    Один запуск: замеры с нуля, в конце — в SQLite и файл Prometheus (даже если упал).
+    """
+    global _current
+    prev = _current
+    r = _current = Run(command)
+    ok, error = True, None
+    try:
+        yield r
+    except BaseException as e:
+        ok, error = False, f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current = prev
+        finished = time.time()
+        try:
+            _persist(r, finished, ok, error)
+        except Exception as e:
+            # замеры не должны ронять отправку отчёта
+            print(f"[instrument] failed to save run {r.run_id}: {type(e).__name__}: {e}")
+
+
+def _persist(r: Run, finished_at: float, ok: bool, error: Optional[str]) -> None:
+    from src import storage
+
+    storage.save_run(
+        r.run_id, r.command, r.started_at, finished_at, ok, error,
+        spans=[(name, dict(labels), c, total, mx) for (name, labels), (c, total, mx) in r.spans.items()],
+        counters=[(name, dict(labels), v) for (name, labels), v in r.counters.items()],
+    )
+    if METRICS_PROM_PATH:
+        write_prometheus(r, finished_at, ok, METRICS_PROM_PATH)
+
+
+def _prom_name(name: str) -> str:
+    return "wb_bot_" + "".join(ch if ch.isalnum() else "_" for ch in name)
+
+
+def _prom_labels(labels: Labels, **extra) -> str:
+    items = list(labels) + sorted(extra.items())
+    if not items:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def write_prometheus(r: Run, finished_at: float, ok: bool, path: str) -> None:
+    """
+    Значения последнего запуска команды (gauge). Файл пишется атомарно (tmp + replace),
+    чтобы коллектор не прочитал его наполовину.
+    """
+    cmd = (("command", r.command),)
+    lines = [
+        "# HELP wb_bot_run_duration_seconds Duration of the last run.",
+        "# TYPE wb_bot_run_duration_seconds gauge",
+        f"wb_bot_run_duration_seconds{_prom_labels(cmd)} {finished_at - r.started_at:.6f}",
+        "# HELP wb_bot_run_success 1 if the last run finished without error.",
+        "# TYPE wb_bot_run_success gauge",
+        f"wb_bot_run_success{_prom_labels(cmd)} {1 if ok else 0}",
+        "# HELP wb_bot_run_finished_timestamp_seconds When the last run finished.",
+        "# TYPE wb_bot_run_finished_timestamp_seconds gauge",
+        f"wb_bot_run_finished_timestamp_seconds{_prom_labels(cmd)} {finished_at:.3f}",
+        "# HELP wb_bot_stage_seconds Total time spent in a stage during the last run.",
+        "# TYPE wb_bot_stage_seconds gauge",
+    ]
+    for (name, labels), (calls, total, _mx) in sorted(r.spans.items()):
+        lines.append(f"wb_bot_stage_seconds{_prom_labels(labels + (('stage', name),), command=r.command)} {total:.6f}")
+    lines += [
+        "# HELP wb_bot_stage_calls Number of times a stage ran during the last run.",
+        "# TYPE wb_bot_stage_calls gauge",
+    ]
+    for (name, labels), (calls, _total, _mx) in sorted(r.spans.items()):
+        lines.append(f"wb_bot_stage_calls{_prom_labels(labels + (('stage', name),), command=r.command)} {calls}")
+    seen = set()
+    for (name, labels), value in sorted(r.counters.items()):
+        metric = _prom_name(name)
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric}{_prom_labels(labels, command=r.command)} {value:g}")
+
+    # у каждой команды свой файл: sync не затирает метрики send
+    root, ext = os.path.splitext(path)
+    out = f"{root}_{r.command}{ext or '.prom'}"
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    tmp = out + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp, out)
@@ -1,13 +1,23 @@
 from __future__ import annotations
-from src.wb_client import fetch_wb_14d
 
-from datetime import datetime, timedelta
+import argparse
+import time
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
 import pytz
 
-from src.config import TZ
-from src.storage import init_db, upsert_metrics
-from src.report import make_charts_14d
-from src.tg_sender import send_message, send_photo
+from src import accounts, instrument
+from src.config import TZ, DAYS, WB_SETTLE_DAYS, ANOMALY_WEEKS
+from src.runner import run_accounts
+from src.storage import (
+    init_db, upsert_metrics_many, upsert_nm_metrics, get_dates_for_marketplace, get_metrics_for_date,
+    get_brand_totals, add_subscription, remove_subscription, add_account, disable_account,
+    get_window_totals, get_runs, get_run_details, archive_get_stats, update_ad_spend,
+    ads_get_campaign_cpo, ads_get_nm_cpo,
+)
+
+# тяжёлые модули (requests/pandas в wb_client, matplotlib в report, telegram в tg_sender)
+# импортируем внутри команд — `sync` не тянет matplotlib, `report` не требует токена Telegram
 
 def fmt_int(n: int) -> str:
     return f"{n:,}".replace(",", " ")
@@ -15,6 +25,15 @@ def fmt_int(n: int) -> str:
 def fmt_money(rub: float) -> str:
     return f"{int(round(rub)):,}".replace(",", " ") + " ₽"
 
+def md_escape(text: str) -> str:
+    """
+    Данные (артикулы, бренды) в тексте с parse_mode="Markdown": один "_" или "*" — и Telegram
+    отвергает всё сообщение ("can't parse entities"). Экранировать можно только вне *…* / _…_.
+    """
+    for ch in ("_", "*", "`", "["):
+        text = text.replace(ch, "\\" + ch)
+    return text
+
 def trend_icon(cur: float, prev: float) -> str:
     if prev is None:
         return "•"
@@ -38,20 +57,22 @@ def moscow_now():
     tz = pytz.timezone(TZ)
     return datetime.now(tz)
 
-def main():
-    init_db()
-
-    now = moscow_now()
-    yesterday = (now - timedelta(days=1)).date()
+def sync(yesterday: date, refresh: bool = False) -> None:
+    """
+    WB -> БД (daily_metrics / daily_nm_metrics).
+    refresh — досчитывающиеся дни заново у WB, а не из архива (обновление в течение дня).
+    """
+    from src.wb_client import fetch_ads_spend_by_day, fetch_wb_incremental
 
-    # --- WB: реальные данные за 14 дней ---
-    start_14 = (yesterday - timedelta(days=13)).isoformat()
+    # --- WB: за 14 дней, но у API спрашиваем только то, чего нет в БД ---
+    start_14 = (yesterday - timedelta(days=DAYS - 1)).isoformat()
     end_14 = yesterday.isoformat()
 
-    wb_days = fetch_wb_14d(start_14, end_14)
+    known = get_dates_for_marketplace("wb", start_14, end_14)
+    wb_days = fetch_wb_incremental(start_14, end_14, known, settle_days=WB_SETTLE_DAYS, refresh=refresh)
 
-    for dt, d in wb_days.items():
-        upsert_metrics(
+    upsert_metrics_many(
+        (
             dt,
             "wb",
             0,  # impressions (показы) не используем
@@ -59,23 +80,44 @@ def main():
             d.orders,  # orders
             d.ad_spend  # spend
         )
+        for dt, d in wb_days.items()
+    )
+
+    # те же дни в разрезе артикулов — для разбора "кто просел"
+    upsert_nm_metrics(
+        (dt, nm_id, m.open, m.orders)
+        for dt, d in wb_days.items()
+        for nm_id, m in d.by_nm.items()
+    )
+
+    # затраты на рекламу — за все 14 дней, а не только за перезапрошенные: день, где в прошлый раз
+    # advert-api ответил ошибкой, дозагрузится сейчас (закрытые дни берутся из БД, без запроса)
+    update_ad_spend(fetch_ads_spend_by_day(start_14, end_14))
 
+def build_summary(yesterday: date) -> str:
+    """
+    Текст сводки — только из БД, без обращений к WB.
+    """
     # --- отчет за вчера (WB) + дельты к позавчера ---
+    # берём из БД: позавчера могло не попасть в свежий (инкрементальный) запрос
     dt_y = yesterday.isoformat()
     dt_prev = (yesterday - timedelta(days=1)).isoformat()
 
-    wb_y = wb_days.get(dt_y)
-    wb_p = wb_days.get(dt_prev)
+    wb_y = get_metrics_for_date("wb", dt_y)
+    wb_p = get_metrics_for_date("wb", dt_prev)
 
     # вчера
-    open_y = wb_y.open if wb_y else 0
-    orders_y = wb_y.orders if wb_y else 0
-    spend_y = wb_y.ad_spend if (wb_y and wb_y.ad_spend is not None) else 0.0
+    # строки БД: (date, impressions, clicks, orders, ad_spend)
+    open_y = wb_y[2] if wb_y else 0
+    orders_y = wb_y[3] if wb_y else 0
+    # None — затраты не загрузились (ошибка advert-api): это «нет данных», а не 0 ₽
+    spend_known = bool(wb_y) and wb_y[4] is not None
+    spend_y = wb_y[4] if spend_known else 0.0
 
     # позавчера
-    open_p = wb_p.open if wb_p else 0
-    orders_p = wb_p.orders if wb_p else 0
-    spend_p = wb_p.ad_spend if (wb_p and wb_p.ad_spend is not None) else 0.0
+    open_p = wb_p[2] if wb_p else 0
+    orders_p = wb_p[3] if wb_p else 0
+    spend_p = wb_p[4] if (wb_p and wb_p[4] is not None) else 0.0
 
     cr_y = (orders_y / open_y * 100) if open_y else 0.0
     cr_p = (orders_p / open_p * 100) if open_p else 0.0
@@ -86,20 +128,354 @@ def main():
 
     text = (
         f"*Отчет за {dt_y} (вчера)*\n\n"
-        f"*WB*\n"
+        f"*WB{accounts.suffix()}*\n"
         f"*Переходы:* *{fmt_int(open_y)}* {trend_icon(open_y, open_p)} {fmt_delta(open_y, open_p)}\n"
         f"*Заказы:* *{fmt_int(orders_y)}* {trend_icon(orders_y, orders_p)} {fmt_delta(orders_y, orders_p)}\n"
         f"% заказа (CR): {cr_y:.2f}%\n"
-        f"*Реклама:* *{fmt_money(spend_y)}* {trend_icon(spend_y, spend_p)} {fmt_delta(spend_y, spend_p)}\n"
-        f"CPO: {cpo_y:.1f} ₽ {trend_icon(cpo_y, cpo_p)} ({cpo_y - cpo_p:+.1f} ₽)"
     )
+    if spend_known:
+        text += (
+            f"*Реклама:* *{fmt_money(spend_y)}* {trend_icon(spend_y, spend_p)} {fmt_delta(spend_y, spend_p)}\n"
+            f"CPO: {cpo_y:.1f} ₽ {trend_icon(cpo_y, cpo_p)} ({cpo_y - cpo_p:+.1f} ₽)"
+        )
+    else:
+        text += "*Реклама:* нет данных\nCPO: —"
+
+    lines = anomaly_lines(dt_y)
+    if lines:
+        text += f"\n\n*Аномалии* _(к тому же дню недели, {ANOMALY_WEEKS} нед.)_\n" + "\n".join(lines)
+    return text
+
+ANOMALY_TITLES = {"clicks": "переходы", "orders": "заказы", "ad_spend": "реклама"}
+
+def anomaly_lines(day: str) -> List[str]:
+    """
+    Строки сводки: итоги WB и топ артикулов, которые выбиваются из своего дня недели.
+    """
+    from src.anomaly import find_daily, find_nm
+
+    def fmt(a) -> str:
+        money = a.metric == "ad_spend"
+        value = fmt_money(a.value) if money else fmt_int(int(a.value))
+        expected = fmt_money(a.expected) if money else fmt_int(int(round(a.expected)))
+        pct = f", {(a.value - a.expected) / a.expected * 100:+.0f}%" if a.expected else ""
+        icon = "▲" if a.z > 0 else "▼"
+        return f"{ANOMALY_TITLES[a.metric]}: {value} {icon} (обычно ~{expected}{pct})"
+
+    lines = [f"⚠ WB — {fmt(a)}" for a in find_daily(day)]
+    for a in find_nm(day):
+        name = f"{md_escape(a.vendor_code)} ({a.nm_id})" if a.vendor_code else str(a.nm_id)
+        lines.append(f"⚠ {name} — {fmt(a)}")
+    return lines
+
+def build_brand_summary(yesterday: date, brand: str) -> str:
+    """
+    Сводка по одному бренду (из данных по артикулам).
+    """
+    dt_y = yesterday.isoformat()
+    dt_prev = (yesterday - timedelta(days=1)).isoformat()
+    open_y, orders_y = get_brand_totals(dt_y, brand)
+    open_p, orders_p = get_brand_totals(dt_prev, brand)
+    cr_y = (orders_y / open_y * 100) if open_y else 0.0
+
+    return (
+        f"*Отчет за {dt_y} (вчера)*\n\n"
+        # бренд — вне *…*: внутри сущности Markdown экранирование не работает
+        f"*WB{accounts.suffix()}* — {md_escape(brand)}\n"
+        f"*Переходы:* *{fmt_int(open_y)}* {trend_icon(open_y, open_p)} {fmt_delta(open_y, open_p)}\n"
+        f"*Заказы:* *{fmt_int(orders_y)}* {trend_icon(orders_y, orders_p)} {fmt_delta(orders_y, orders_p)}\n"
+        f"% заказа (CR): {cr_y:.2f}%"
+    )
+
+def build_period_summary(yesterday: date, n_days: int) -> str:
+    """
+    Итоги за последние n_days дней против предыдущих n_days (7 — неделя к неделе, 30/90/365).
+    Суммы берутся из нарастающих итогов (metrics_cumulative), длина истории не важна.
+    """
+    cur_from = yesterday - timedelta(days=n_days - 1)
+    prev_to = cur_from - timedelta(days=1)
+    prev_from = prev_to - timedelta(days=n_days - 1)
+
+    _, open_c, orders_c, spend_c, days_c = get_window_totals("wb", cur_from.isoformat(), yesterday.isoformat())
+    _, open_p, orders_p, spend_p, _ = get_window_totals("wb", prev_from.isoformat(), prev_to.isoformat())
+    spend_c = spend_c or 0.0
+    spend_p = spend_p or 0.0
+
+    cr_c = (orders_c / open_c * 100) if open_c else 0.0
+    cpo_c = (spend_c / orders_c) if orders_c else 0.0
+    cpo_p = (spend_p / orders_p) if orders_p else 0.0
+
+    text = (
+        f"*Итоги за {n_days} дн.: {cur_from.isoformat()} — {yesterday.isoformat()}*\n"
+        f"_(к предыдущим {n_days} дн.)_\n\n"
+        f"*WB{accounts.suffix()}*\n"
+        f"*Переходы:* *{fmt_int(open_c)}* {trend_icon(open_c, open_p)} {fmt_delta(open_c, open_p)}\n"
+        f"*Заказы:* *{fmt_int(orders_c)}* {trend_icon(orders_c, orders_p)} {fmt_delta(orders_c, orders_p)}\n"
+        f"% заказа (CR): {cr_c:.2f}%\n"
+        f"*Реклама:* *{fmt_money(spend_c)}* {trend_icon(spend_c, spend_p)} {fmt_delta(spend_c, spend_p)}\n"
+        f"CPO: {cpo_c:.1f} ₽ {trend_icon(cpo_c, cpo_p)} ({cpo_c - cpo_p:+.1f} ₽)"
+    )
+    if days_c < n_days:
+        text += f"\n\n_данные есть за {days_c} из {n_days} дн._"
+    return text
 
-    send_message(text)
+def build_report(yesterday: date) -> Tuple[str, List[str]]:
+    from src.report import make_charts_14d
 
     # 2 графика по площадкам за 14 дней
-    charts = make_charts_14d()
-    for p in charts:
-        send_photo(p)
+    return build_summary(yesterday), make_charts_14d()
+
+VARIANTS = ("full", "summary", "charts", "brand:<бренд>", "period:<дней>")
+
+def is_valid_variant(variant: str) -> bool:
+    if variant.startswith("period:"):
+        return variant[7:].isdigit() and int(variant[7:]) > 0
+    return variant in ("full", "summary", "charts") or (variant.startswith("brand:") and bool(variant[6:]))
+
+def render_variant(variant: str, yesterday: date) -> Tuple[str, List[str]]:
+    """
+    full — сводка + графики; summary — только сводка; charts — сводка + все графики
+    (WB за 14/30/90 дней, топ брендов, предметов и артикулов); brand:<бренд> — сводка по бренду;
+    period:<дней> — итоги за N дней к предыдущим N (period:7 — неделя к неделе).
+    """
+    if variant == "full":
+        return build_report(yesterday)
+    if variant == "summary":
+        return build_summary(yesterday), []
+    if variant == "charts":
+        from src.report import make_charts_all
+        return build_summary(yesterday), make_charts_all()
+    if variant.startswith("period:") and is_valid_variant(variant):
+        return build_period_summary(yesterday, int(variant[7:])), []
+    if is_valid_variant(variant):
+        return build_brand_summary(yesterday, variant[6:]), []
+    raise ValueError(f"Unknown report variant: {variant!r} (expected one of {', '.join(VARIANTS)})")
+
+def send(yesterday: date) -> None:
+    from src.delivery import fan_out
+
+    # каждый вариант рендерится один раз, картинки заливаются один раз;
+    # если Telegram недоступен — отчёт ляжет в outbox и уйдёт в следующий запуск
+    fan_out(lambda variant: render_variant(variant, yesterday))
+
+def _run_for_accounts(
+    fn,
+    account_list: List[accounts.Account],
+    max_workers: Optional[int] = None
+) -> List[accounts.Account]:
+    """
+    fn() по всем кабинетам пулом; упавшие кабинеты печатаем. Возвращает кабинеты, где всё прошло.
+    """
+    results = run_accounts(fn, account_list) if max_workers is None \
+        else run_accounts(fn, account_list, max_workers=max_workers)
+    failed = [r for r in results.values() if not r.ok]
+    if len(results) > 1 or failed:
+        for r in results.values():
+            status = "ok" if r.ok else f"FAILED: {r.error}"
+            print(f"[{r.account_id}] {status} ({r.elapsed_sec:.1f}s)")
+    return [a for a in account_list if results[a.account_id].ok]
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m src.main")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="run",
+        choices=[
+            "run", "sync", "report", "send", "subscribe", "unsubscribe",
+            "accounts", "account-add", "account-disable", "daemon", "runs", "archive", "backfill", "ads",
+        ],
+        help="run (по умолчанию) = sync + send; sync — только WB -> БД; "
+             "report [VARIANT] — собрать отчёт из БД и вывести (без отправки); "
+             "send — собрать из БД и разослать по подпискам; "
+             "subscribe CHAT_ID [VARIANT] / unsubscribe CHAT_ID [VARIANT] — управление подписками; "
+             "accounts — список кабинетов; account-add ID WB_TOKEN [NAME] / account-disable ID; "
+             "daemon — жить постоянно и слать отчёт в REPORT_TIME (см. src/scheduler.py); "
+             "runs [N] — последние запуски и где в них ушло время; "
+             "archive [stats | replay FROM TO | gc] — архив сырых отчётов WB (src/report_archive.py); "
+             "backfill FROM [TO] — загрузить историю WB за период (src/backfill.py); "
+             "ads [FROM [TO]] — затраты на рекламу и CPO по кампаниям и артикулам (src/ads.py)",
+    )
+    parser.add_argument("args", nargs="*")
+    parser.add_argument(
+        "--account",
+        help="кабинет (account_id); для run/sync/send по умолчанию — все активные, для остальных — default",
+    )
+    args = parser.parse_args(argv)
+
+    init_db()
+    yesterday = (moscow_now() - timedelta(days=1)).date()
+
+    if args.command == "accounts":
+        for a in accounts.all_active():
+            print(f"{a.account_id}\t{a.name}")
+        return
+    if args.command == "account-add":
+        if len(args.args) < 2:
+            parser.error("account-add ID WB_TOKEN [NAME]")
+        add_account(args.args[0], args.args[1], args.args[2] if len(args.args) > 2 else "")
+        return
+    if args.command == "account-disable":
+        if not args.args:
+            parser.error("account-disable ID")
+        disable_account(args.args[0])
+        return
+    if args.command == "runs":
+        print_runs(int(args.args[0]) if args.args else 10)
+        return
+    if args.command == "daemon":
+        from src.scheduler import Scheduler
+
+        Scheduler(moscow_now, sync, send).run_forever()
+        return
+
+    if args.account:
+        account = accounts.get(args.account)
+        if account is None:
+            parser.error(f"unknown or disabled account {args.account!r}")
+        account_list = [account]
+    else:
+        account_list = accounts.all_active()
+
+    if args.command in ("run", "sync", "send"):
+        with instrument.run(args.command):
+            _run_command(args.command, account_list, yesterday)
+        return
+
+    # остальные команды — для одного кабинета
+    with accounts.use(account_list[0] if args.account else accounts.DEFAULT_ACCOUNT):
+        _single_account_command(parser, args, yesterday)
+
+def _run_command(command: str, account_list: List[accounts.Account], yesterday: date) -> None:
+    todo = account_list or [accounts.DEFAULT_ACCOUNT]
+    done = todo
+    if command in ("run", "sync"):
+        # WB — параллельно по кабинетам (лимиты у каждого токена свои)
+        done = _run_for_accounts(lambda: sync(yesterday), todo)
+    if command in ("run", "send") and done:
+        # Telegram и outbox общие — рассылаем по кабинетам по очереди;
+        # кабинет, у которого не прошёл sync, не рассылаем (как раньше при исключении)
+        done = _run_for_accounts(lambda: send(yesterday), done, max_workers=1)
+    if len(done) < len(todo):
+        raise SystemExit(1)
+
+def print_runs(n: int) -> None:
+    """
+    Последние запуски; для самого свежего — этапы по убыванию времени и счётчики.
+    """
+    runs = get_runs(n)
+    for run_id, command, started, finished, ok, error in runs:
+        ts = datetime.fromtimestamp(started).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"{run_id}  {ts}  {command:6s} {finished - started:8.1f}s  {'ok' if ok else 'FAILED: ' + (error or '')}")
+    if not runs:
+        return
+    spans, counters = get_run_details(runs[0][0])
+    print(f"\n{runs[0][0]}:")
+    for name, labels, calls, total, mx in spans:
+        lbl = "" if labels == "{}" else f" {labels}"
+        print(f"  {name}{lbl}: {total:.3f}s x{calls} (max {mx:.3f}s)")
+    for name, labels, value in counters:
+        lbl = "" if labels == "{}" else f" {labels}"
+        print(f"  {name}{lbl} = {value:g}")
+
+def archive_command(parser: argparse.ArgumentParser, argv: List[str]) -> None:
+    """
+    archive [stats] — что лежит в архиве; archive replay FROM TO — прогнать даты через парсер
+    без обращения к WB; archive gc — retention прямо сейчас.
+    """
+    from src import wb_client
+
+    sub = argv[0] if argv else "stats"
+    if sub == "stats":
+        wb_client.import_legacy_reports()
+        days, versions, objects, raw_bytes, stored_bytes, first, last = archive_get_stats()
+        print(f"days: {days} ({first or '-'} .. {last or '-'}), versions: {versions}, files: {objects}")
+        ratio = f" (x{raw_bytes / stored_bytes:.1f})" if stored_bytes else ""
+        print(f"raw: {raw_bytes / 1e6:.1f} MB, stored: {stored_bytes / 1e6:.1f} MB{ratio}")
+    elif sub == "replay":
+        if len(argv) < 3:
+            parser.error("archive replay FROM TO")
+        t0 = time.perf_counter()
+        days = wb_client.replay_detail_history(argv[1], argv[2])
+        for dt in sorted(days):
+            d = days[dt]
+            print(f"{dt}  clicks={fmt_int(d.open)}  orders={fmt_int(d.orders)}  nm={len(d.by_nm)}")
+        print(f"{len(days)} days in {time.perf_counter() - t0:.2f}s")
+    elif sub == "gc":
+        expired, removed = wb_client.archive_gc()
+        print(f"expired versions: {expired}, removed files: {removed}")
+    else:
+        parser.error("archive [stats | replay FROM TO | gc]")
+
+def ads_command(argv: List[str], yesterday: date) -> None:
+    """
+    ads [FROM [TO]] — дозагрузить затраты (по умолчанию за DAYS дней) и вывести CPO по кампаниям
+    и топ артикулов по затратам. Заказы кампании — все заказы её артикулов, не только рекламные.
+    """
+    from src import ads
+
+    date_from = argv[0] if argv else (yesterday - timedelta(days=DAYS - 1)).isoformat()
+    date_to = argv[1] if len(argv) > 1 else yesterday.isoformat()
+    res = ads.sync_spend(date_from, date_to)
+    print(f"ads {date_from} .. {date_to}: {res.days} days ({res.cached} cached, {res.fetched} fetched), "
+          f"{len(res.errors)} errors")
+
+    def cpo(spend: float, orders: Optional[int]) -> str:
+        return f"{spend / orders:.1f}" if orders else "-"
+
+    print(f"\n{'advert_id':>10s}  {'spend':>12s}  {'orders':>7s}  {'CPO':>8s}  name")
+    for advert_id, name, spend, _, _, orders in ads_get_campaign_cpo(date_from, date_to):
+        print(f"{advert_id:>10d}  {fmt_money(spend):>12s}  {'-' if orders is None else fmt_int(orders):>7s}  "
+              f"{cpo(spend, orders):>8s}  {name or ''}")
+    print(f"\n{'nm_id':>10s}  {'spend':>12s}  {'orders':>7s}  {'CPO':>8s}  vendor_code")
+    for nm_id, vendor_code, spend, _, orders in ads_get_nm_cpo(date_from, date_to):
+        print(f"{nm_id:>10d}  {fmt_money(spend):>12s}  {fmt_int(orders):>7s}  {cpo(spend, orders):>8s}  "
+              f"{vendor_code or ''}")
+
+def _single_account_command(parser: argparse.ArgumentParser, args, yesterday: date) -> None:
+    if args.command == "subscribe":
+        if not args.args:
+            parser.error("subscribe CHAT_ID [VARIANT]")
+        variant = args.args[1] if len(args.args) > 1 else "full"
+        # вариант проверяем сразу, а не в момент рассылки
+        if not is_valid_variant(variant):
+            parser.error(f"unknown variant {variant!r}, expected one of {', '.join(VARIANTS)}")
+        add_subscription(args.args[0], variant)
+        return
+    if args.command == "unsubscribe":
+        if not args.args:
+            parser.error("unsubscribe CHAT_ID [VARIANT]")
+        remove_subscription(args.args[0], args.args[1] if len(args.args) > 1 else None)
+        return
+
+    if args.command == "archive":
+        archive_command(parser, args.args)
+        return
+
+    if args.command == "ads":
+        with instrument.run("ads"):
+            ads_command(args.args, yesterday)
+        return
+
+    if args.command == "backfill":
+        if not args.args:
+            parser.error("backfill FROM [TO]")
+        from src.backfill import run_backfill
+
+        with instrument.run("backfill"):
+            res = run_backfill(args.args[0], args.args[1] if len(args.args) > 1 else yesterday.isoformat())
+        print(f"backfill: {res.days} days, {res.rows} rows in {res.elapsed_sec / 60:.1f} min "
+              f"({res.days_per_min:.1f} days/min); windows: {res.done} done, {res.skipped} skipped, "
+              f"{res.failed} failed of {res.windows}")
+        if res.failed:
+            raise SystemExit(1)
+        return
+
+    if args.command == "report":
+        text, charts = render_variant(args.args[0] if args.args else "full", yesterday)
+        print(text)
+        for p in charts:
+            print(p)
 
 if __name__ == "__main__":
     main()
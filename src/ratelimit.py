@@ -0,0 +1,57 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Классический token bucket: rate токенов в секунду, не больше capacity про запас.
+    acquire() блокирует поток, пока токен не появится. Потокобезопасен.
+    pause() — принудительная пауза (например, сервер ответил 429 с Retry-After).
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """
+        Забрать tokens (ждём, если нужно). Возвращает, сколько секунд прождали.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._blocked_until and self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = max(self._blocked_until - now, (tokens - self._tokens) / self.rate)
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds: float) -> None:
+        """
+        Никому не выдавать токены ближайшие seconds секунд, а после паузы начинать с пустого ведра.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._blocked_until = max(self._blocked_until, now + seconds)
+            self._tokens = 0.0
+            self._updated = self._blocked_until
+
+    def expected_wait(self, tokens: float = 1.0) -> float:
+        """
+        Сколько пришлось бы ждать acquire() прямо сейчас (ничего не забирает).
+        """
+        with self._lock:
+            now = time.monotonic()
+            tokens_now = min(self.capacity, self._tokens + max(0.0, now - self._updated) * self.rate)
+            return max(self._blocked_until - now, (tokens - tokens_now) / self.rate, 0.0)
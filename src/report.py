@@ -1,224 +1,528 @@
 from __future__ import annotations
 
-print("REPORT.PY LOADED")
-from matplotlib.ticker import MultipleLocator
+import matplotlib
 
-from src import storage
-from dataclasses import dataclass
-from typing import Optional, Dict, List
+# без дисплея: не даём pyplot выбирать интерактивный backend
+matplotlib.use("Agg")
+
+from src import accounts, chart_pil, instrument, storage
+from src.chart_axes import (
+    ANNOTATE_MAX_POINTS, Scale, bar_labels, chart_scales, cpo_values, fmt_tick, point_labels, x_label_step,
+)
+from src.config import CHART_RENDERER, CHART_WORKERS
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass
+from datetime import date, timedelta
+from typing import Optional, Dict, List, Tuple
 from pathlib import Path
+from matplotlib.font_manager import FontProperties
 import matplotlib.pyplot as plt
+import multiprocessing
+import threading
+import hashlib
+import json
 import math
+import os
+import time
 
 
 OUT_DIR = Path("out/charts")
 DAYS = 14
 
-def make_charts_14d() -> List[str]:
-    OUT_DIR.mkdir(parents=True, exist_ok=True)
+# всё, от чего зависит картинка, кроме данных: попадает в ключ кэша рендеров.
+# CHART_VERSION поднимать при любой правке кода отрисовки.
+CHART_VERSION = 3
+CHART_STYLE = {
+    "figsize": (10.8, 6.0),
+    "dpi": 180,
+    "color_clicks": "#6A5ACD",  # фиолетовый
+    "color_orders": "#1F77B4",  # синий
+    "color_cpo": "#F2C94C",
+    "color_spend": "#1F77B4",
+    "label_fontsize": 8,
+}
 
-    def get_last_days(marketplace: str, n: int):
-        rows = storage.get_last_n_days_for_marketplace(marketplace, n)
-        if not rows:
-            return []
-        # посмотрим формат первой строки
-        first = rows[0]
-        # 6 полей
-        if len(first) == 6:
-            return rows
-        # 5 полей — добавим marketplace сами
-        if len(first) == 5:
-            return [(date, marketplace, imp, clk, ords, spend) for (date, imp, clk, ords, spend) in rows]
-        raise ValueError(f"Unexpected row format: {first}")
-
-    def plot_marketplace(marketplace: str, title: str, filename: str) -> Path:
-        days = get_last_days(marketplace, DAYS)
-        if not days:
-            return OUT_DIR / filename
-
-        dates = [date[5:] for (date, mp, imp, clk, ords, spend) in days]
-        clicks = [clk for (date, mp, imp, clk, ords, spend) in days]
-        orders = [ords for (date, mp, imp, clk, ords, spend) in days]
-        spend = [float(spend or 0.0) for (date, mp, imp, clk, ords, spend) in days]
-
-        fig, (ax_top, ax_bottom) = plt.subplots(
-            nrows=2,
-            figsize=(10.8, 6.0),
-            gridspec_kw={"height_ratios": [3, 2]},
-            sharex=True
-        )
-        fig.patch.set_facecolor("white")
-        fig.suptitle(title)
-
-        # --- TOP: Переходы + Заказы (две оси) ---
-        COLOR_CLICKS = "#6A5ACD"  # фиолетовый
-        COLOR_ORDERS = "#1F77B4"  # синий
-
-        l_clicks, = ax_top.plot(
-            dates, clicks,
-            color=COLOR_CLICKS,
-            marker="o",
-            linewidth=2.6,
-            label="Переходы"
-        )
-        ax_top.fill_between(dates, clicks, color=COLOR_CLICKS, alpha=0.12)
+# дополнительные графики (вариант "charts")
+CHART_TOP_GROUPS = 5   # брендов / предметов
+CHART_TOP_NM = 15      # артикулов
+
+# кэш отрисованных графиков в OUT_DIR: не старше N дней и не больше M файлов
+CHART_CACHE_MAX_AGE_DAYS = 14
+CHART_CACHE_MAX_FILES = 200
+
+
+@dataclass(frozen=True)
+class ChartSpec:
+    """
+    Один график — только данные и раскладка, без matplotlib: такие задания дёшево
+    передавать в процессы пула и по ним же считается ключ кэша.
+
+    layout:
+      funnel — сверху переходы + заказы (две оси), снизу затраты + CPO (две оси);
+      dual   — только верх: переходы + заказы;
+      hbar   — горизонтальные столбцы по labels (топ артикулов): переходы | заказы.
+    Шкалы осей считаются по данным (src/chart_axes.py).
+    """
+    name: str
+    title: str
+    layout: str
+    labels: Tuple[str, ...]
+    clicks: Tuple[int, ...]
+    orders: Tuple[int, ...]
+    spend: Tuple[Optional[float], ...] = ()  # None — за день затрат нет данных (не то же, что 0)
+
+
+def _render_key(spec: ChartSpec) -> str:
+    payload = json.dumps(
+        {"v": CHART_VERSION, "style": CHART_STYLE, "renderer": _renderer_for(spec), "spec": asdict(spec)},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _evict_old_renders() -> None:
+    """
+    Чистим OUT_DIR: рендеры старше CHART_CACHE_MAX_AGE_DAYS и всё сверх CHART_CACHE_MAX_FILES
+    (по времени последнего использования — mtime обновляем при попадании в кэш).
+    """
+    files = sorted(OUT_DIR.glob("*.png"), key=lambda p: p.stat().st_mtime, reverse=True)
+    cutoff = time.time() - CHART_CACHE_MAX_AGE_DAYS * 86400
+    for i, p in enumerate(files):
+        if i >= CHART_CACHE_MAX_FILES or p.stat().st_mtime < cutoff:
+            p.unlink(missing_ok=True)
+
+
+# --- отрисовка (выполняется в процессах пула) ---
+
+def _set_ylim(ax, scale: Scale) -> None:
+    ax.set_ylim(scale.lo, scale.hi)
+    ticks = scale.ticks()
+    ax.set_yticks(ticks)
+    ax.set_yticklabels([fmt_tick(t, scale.step) for t in ticks])
+
+
+def _thin_x_labels(ax, labels: Tuple[str, ...]) -> None:
+    step = x_label_step(len(labels))
+    if step == 1:
+        return
+    ax.set_xticks(range(0, len(labels), step))
+    ax.set_xticklabels(labels[::step])
+
+
+def _draw_clicks_orders(ax_top, spec: ChartSpec, scales: dict):
+    """
+    Линии переходов и заказов. Подписи точек — потом, _place_point_labels (после раскладки
+    фигуры, когда известны пиксели). Возвращает правую ось (заказы).
+    """
+    dates, clicks, orders = list(spec.labels), list(spec.clicks), list(spec.orders)
+    annotate = len(dates) <= ANNOTATE_MAX_POINTS
+
+    # --- Переходы + Заказы (две оси) ---
+    COLOR_CLICKS = CHART_STYLE["color_clicks"]
+    COLOR_ORDERS = CHART_STYLE["color_orders"]
 
-        # сетка поверх заливки (важно)
-        ax_top.set_axisbelow(True)
+    l_clicks, = ax_top.plot(
+        dates, clicks,
+        color=COLOR_CLICKS,
+        marker="o" if annotate else None,
+        linewidth=2.6,
+        label="Переходы"
+    )
+    ax_top.fill_between(dates, clicks, color=COLOR_CLICKS, alpha=0.12)
 
-        # сетка (горизонтальная + лёгкая вертикальная)
-        ax_top.grid(True, axis="y", alpha=0.25)  # п.1
-        ax_top.grid(True, axis="x", alpha=0.08)  # п.3 (можно убрать, если не нужно)
+    # сетка поверх заливки (важно)
+    ax_top.set_axisbelow(True)
 
-        from matplotlib.ticker import MultipleLocator
+    # сетка (горизонтальная + лёгкая вертикальная)
+    ax_top.grid(True, axis="y", alpha=0.25)  # п.1
+    ax_top.grid(True, axis="x", alpha=0.08)  # п.3 (можно убрать, если не нужно)
 
-        ax_top.set_ylim(0, 10000)
-        ax_top.yaxis.set_major_locator(MultipleLocator(1000))
+    _set_ylim(ax_top, scales["clicks"])
 
-        # ВАЖНО: сначала создаём правую ось
-        ax_orders = ax_top.twinx()
-        l_orders, = ax_orders.plot(
-            dates, orders,
-            color=COLOR_ORDERS,
-            marker="o",
-            linewidth=2.2,
-            label="Заказы"
+    # ВАЖНО: сначала создаём правую ось
+    ax_orders = ax_top.twinx()
+    l_orders, = ax_orders.plot(
+        dates, orders,
+        color=COLOR_ORDERS,
+        marker="o" if annotate else None,
+        linewidth=2.2,
+        label="Заказы"
+    )
+    ax_orders.set_ylabel("Заказы")
+    _set_ylim(ax_orders, scales["orders"])
+
+    ax_top.legend([l_clicks, l_orders], ["Переходы", "Заказы"], loc="upper left", fontsize=10)
+    return ax_orders
+
+
+class _PixelSpace:
+    """
+    Перевод данных осей в пиксели фигуры (y вниз) и размеры подписей — для раскладки
+    подписей src/chart_axes.py после tight_layout, когда положение осей уже известно.
+    """
+
+    def __init__(self, fig):
+        self.fig = fig
+        self.renderer = fig.canvas.get_renderer()
+        self.h = fig.bbox.height
+        self.pt = fig.dpi / 72.0
+
+    def points(self, ax, values) -> List[Tuple[float, float]]:
+        pts = ax.transData.transform([(i, float(v)) for i, v in enumerate(values)])
+        return [(x, self.h - y) for x, y in pts]
+
+    def box(self, bbox) -> Tuple[float, float, float, float]:
+        return (bbox.x0, self.h - bbox.y1, bbox.x1, self.h - bbox.y0)
+
+    def measure(self, size: float):
+        prop = FontProperties(size=size, weight="bold")
+
+        def measure(text: str) -> Tuple[float, float]:
+            w, h, _ = self.renderer.get_text_width_height_descent(text, prop, ismath=False)
+            return w, h
+        return measure
+
+    def text(self, box, text: str, size: float, color: str) -> None:
+        self.fig.text(
+            (box[0] + box[2]) / 2 / self.fig.bbox.width, 1 - (box[1] + box[3]) / 2 / self.h, text,
+            ha="center",
+            va="center_baseline",
+            fontsize=size,
+            fontweight="bold",
+            color=color
         )
-        ax_orders.set_ylabel("Заказы")
-
-        # шкала заказов 300-700 с шагом 100
-        ax_orders.set_ylim(300, 1000)
-        ax_orders.yaxis.set_major_locator(MultipleLocator(100))
-
-        ax_top.legend([l_clicks, l_orders], ["Переходы", "Заказы"], loc="upper left", fontsize=10)
-
-        # --- подписи для КАЖДОЙ точки ---
-
-        # Переходы — НАД точкой
-        for x, y in zip(dates, clicks):
-            ax_top.annotate(
-                f"{y}",
-                xy=(x, y),
-                xytext=(0, 8),
-                textcoords="offset points",
-                ha="center",
-                va="bottom",
-                fontsize=8,
-                fontweight="bold",
-                color=COLOR_CLICKS
-            )
-
-        # Заказы — ПОД точкой
-        for x, y in zip(dates, orders):
-            ax_orders.annotate(
-                f"{y}",
-                xy=(x, y),
-                xytext=(0, -12),
-                textcoords="offset points",
-                ha="center",
-                va="top",
-                fontsize=8,
-                fontweight="bold",
-                color=COLOR_ORDERS
-            )
-
-        # --- BOTTOM: Затраты (₽) ---
-        if max(spend) == 0.0:
-            ax_bottom.text(
-                0.02, 0.65,
-                "Затраты: нет данных",
-                transform=ax_bottom.transAxes,
-                fontsize=11
-            )
-            ax_bottom.set_ylabel("Затраты (₽)")
-            ax_bottom.grid(True, axis="y", alpha=0.15)
 
 
+def _place_point_labels(fig, ax_clicks, ax_orders, spec: ChartSpec) -> None:
+    """
+    Подписи значений у точек — разом для обеих линий: переходы над точкой, заказы под,
+    при наложении (на подпись другой линии, маркер, легенду) — на другую сторону, иначе без подписи.
+    Ставятся текстом фигуры в пикселях: один проход вместо annotate на каждую точку.
+    """
+    if len(spec.labels) > ANNOTATE_MAX_POINTS:
+        return
+    ps = _PixelSpace(fig)
+    size = CHART_STYLE["label_fontsize"]
+    taken = []
+    legend = ax_clicks.get_legend()
+    if legend is not None:
+        taken.append(ps.box(legend.get_window_extent(ps.renderer)))
+    colors = (CHART_STYLE["color_clicks"], CHART_STYLE["color_orders"])
+    for box, text, series in point_labels(
+        ps.points(ax_clicks, spec.clicks), ps.points(ax_orders, spec.orders),
+        spec.clicks, spec.orders, ps.measure(size), 5 * ps.pt, 3.5 * ps.pt, ps.box(ax_clicks.bbox), taken,
+    ):
+        ps.text(box, text, size, colors[series])
+
+
+def _place_bar_labels(fig, ax_spend, ax_cpo, spec: ChartSpec) -> None:
+    """
+    Подписи затрат и CPO у верхушек столбцов (src/chart_axes.bar_labels), тоже после раскладки фигуры.
+    """
+    if len(spec.labels) > ANNOTATE_MAX_POINTS:
+        return
+    ps = _PixelSpace(fig)
+    size = CHART_STYLE["label_fontsize"]
+    spend = list(spec.spend)
+    cpo = cpo_values(spend, spec.orders)
+    # дни без данных (None) bar_labels пропускает — их верхушки любые
+    spend_tops = ps.points(ax_spend, [v or 0.0 for v in spend])
+    cpo_tops = ps.points(ax_cpo, [v or 0.0 for v in cpo])
+    base = ps.points(ax_spend, [0.0])[0][1]
+    for box, text, kind in bar_labels(
+        [x for x, _ in spend_tops], base, [y for _, y in spend_tops], [y for _, y in cpo_tops],
+        spend, cpo, ps.measure(size), ps.measure(7), 2 * ps.pt, ps.box(ax_spend.bbox),
+    ):
+        if kind == "spend":
+            ps.text(box, text, size, "black")
         else:
+            ps.text(box, text, 7, "white" if kind == "cpo_in" else "black")
+
+
+def _nan_missing(values) -> List[float]:
+    return [math.nan if v is None else float(v) for v in values]
+
+
+def _draw_spend_cpo(ax_bottom, spec: ChartSpec, scales: dict):
+    """
+    Столбцы затрат и CPO. Подписи — потом, _place_bar_labels. Возвращает ось CPO
+    (None — затрат нет, рисовать нечего).
+    """
+    dates, orders = list(spec.labels), list(spec.orders)
+    spend = list(spec.spend)
+
+    if all(s is None for s in spend):
+        ax_bottom.text(
+            0.02, 0.65,
+            "Затраты: нет данных",
+            transform=ax_bottom.transAxes,
+            fontsize=11
+        )
+        ax_bottom.set_ylabel("Затраты (₽)")
+        ax_bottom.grid(True, axis="y", alpha=0.15)
+        return None
+
+    # --- Затраты (₽) — синие столбцы (левая ось) ---
+    # день без данных (None) — NaN: столбца нет, но дата остаётся на своём месте
+    bars_spend = ax_bottom.bar(dates, _nan_missing(spend), alpha=0.30, color=CHART_STYLE["color_spend"], label="Затраты (₽)", width=0.80)
+    ax_bottom.set_ylabel("Затраты (₽)")
+    _set_ylim(ax_bottom, scales["spend"])
+    ax_bottom.set_axisbelow(True)
+    ax_bottom.grid(True, axis="y", alpha=0.15)
+    ax_bottom.grid(True, axis="x", alpha=0.08)
+
+    # --- CPO (₽/заказ) — жёлтые столбцы "внутри" (правая ось) ---
+    cpo = cpo_values(spend, orders)
+    ax_cpo = ax_bottom.twinx()
+    bars_cpo = ax_cpo.bar(
+        dates, _nan_missing(cpo),
+        width=0.35,  # уже — выглядит "внутри" синего
+        alpha=0.95,
+        color=CHART_STYLE["color_cpo"],
+        label="CPO (₽/заказ)"
+    )
+    ax_cpo.set_ylabel("CPO (₽/заказ)")
+    _set_ylim(ax_cpo, scales["cpo"])
+
+    # общая легенда (и Затраты, и CPO)
+    ax_bottom.legend(
+        [bars_spend, bars_cpo],
+        ["Затраты (₽)", "CPO (₽/заказ)"],
+        loc="upper left",
+        fontsize=10
+    )
+    return ax_cpo
 
-            # --- Затраты (₽) — синие столбцы (левая ось) ---
-            bars_spend = ax_bottom.bar(dates, spend, alpha=0.30, label="Затраты (₽)", width=0.80)
-            ax_bottom.set_ylabel("Затраты (₽)")
-            ax_bottom.set_ylim(0, 15000)
-            ax_bottom.yaxis.set_major_locator(MultipleLocator(3000))
-            ax_bottom.set_axisbelow(True)
-            ax_bottom.grid(True, axis="y", alpha=0.15)
-            ax_bottom.grid(True, axis="x", alpha=0.08)
-            # подписи затрат (внутри/над столбцом)
-            for b, val in zip(bars_spend, spend):
-                x = b.get_x() + b.get_width() / 2
-                h = b.get_height()
-                label = f"{int(val):,}".replace(",", " ")
-                if h >= 1200:
-                    y = h - 350
-                    va = "top"
-                else:
-                    y = h + 150
-                    va = "bottom"
-                ax_bottom.text(
-                    x, y, label,
-                    ha="center",
-                    va=va,
-                    fontsize=8,
-                    fontweight="bold"
-                )
-
-            # --- CPO (₽/заказ) — жёлтые столбцы "внутри" (правая ось) ---
-            # CPO = spend / orders
-            cpo = [(s / o) if o else 0.0 for s, o in zip(spend, orders)]
-            ax_cpo = ax_bottom.twinx()
-            bars_cpo = ax_cpo.bar(
-                dates, cpo,
-                width=0.35,  # уже — выглядит "внутри" синего
-                alpha=0.95,
-                color="#F2C94C",
-                label="CPO (₽/заказ)"
-            )
-            ax_cpo.set_ylabel("CPO (₽/заказ)")
-            # правая шкала CPO: шаг 5 ₽
-            ax_cpo.set_ylim(5, 50)
-            ax_cpo.yaxis.set_major_locator(MultipleLocator(10))
-            # подписи CPO внутри каждого жёлтого столбца (каждый день)
-            for b, val in zip(bars_cpo, cpo):
-                x = b.get_x() + b.get_width() / 2
-                h = b.get_height()
-                label = f"{val:.1f}"
-                if h >= 2.0:
-                    y = h - 0.6  # чуть ниже верхушки
-                    va = "top"
-                else:
-                    y = h + 0.4
-                    va = "bottom"
-                ax_cpo.text(
-                    x, y, label,
-                    ha="center",
-                    va=va,
-                    fontsize=7,
-                    fontweight="bold",
-                    color="white"
-                )
-
-            # общая легенда (и Затраты, и CPO)
-            ax_bottom.legend(
-                [bars_spend, bars_cpo],
-                ["Затраты (₽)", "CPO (₽/заказ)"],
-                loc="upper left",
-                fontsize=10
-            )
 
+def _draw_hbar(fig, spec: ChartSpec) -> None:
+    ax_clicks, ax_orders = fig.subplots(ncols=2, sharey=True)
+    # сверху — первый в топе
+    labels = list(reversed(spec.labels))
+    for ax, values, color, title in (
+        (ax_clicks, list(reversed(spec.clicks)), CHART_STYLE["color_clicks"], "Переходы"),
+        (ax_orders, list(reversed(spec.orders)), CHART_STYLE["color_orders"], "Заказы"),
+    ):
+        bars = ax.barh(labels, values, color=color, alpha=0.85)
+        ax.set_title(title, fontsize=11)
+        ax.set_axisbelow(True)
+        ax.grid(True, axis="x", alpha=0.2)
+        ax.bar_label(bars, labels=[f"{v:,}".replace(",", " ") for v in values],
+                     padding=3, fontsize=8, fontweight="bold")
+        ax.margins(x=0.15)
+    ax_clicks.tick_params(axis="y", labelsize=9)
+
+
+def _renderer_for(spec: ChartSpec) -> str:
+    # Pillow умеет только линии и столбцы по дням; топ артикулов — всегда matplotlib
+    if CHART_RENDERER == "pil" and spec.layout in chart_pil.LAYOUTS:
+        return "pil"
+    return "matplotlib"
+
+
+def render_chart(spec: ChartSpec, out_path: str) -> str:
+    """
+    Нарисовать spec в out_path (абсолютный путь: у процессов пула своя рабочая папка).
+    """
+    if _renderer_for(spec) == "pil":
+        chart_pil.render(spec, out_path, CHART_STYLE)
+        return out_path
+
+    fig = plt.figure(figsize=CHART_STYLE["figsize"])
+    fig.patch.set_facecolor("white")
+    fig.suptitle(spec.title)
+
+    point_axes = bar_axes = None
+    if spec.layout in ("dual", "funnel"):
+        scales = chart_scales(spec.clicks, spec.orders, spec.spend)
+    if spec.layout == "hbar":
+        _draw_hbar(fig, spec)
+    elif spec.layout == "dual":
+        ax = fig.subplots()
+        point_axes = (ax, _draw_clicks_orders(ax, spec, scales))
+        _thin_x_labels(ax, spec.labels)
+    elif spec.layout == "funnel":
+        ax_top, ax_bottom = fig.subplots(nrows=2, gridspec_kw={"height_ratios": [3, 2]}, sharex=True)
+        point_axes = (ax_top, _draw_clicks_orders(ax_top, spec, scales))
+        ax_cpo = _draw_spend_cpo(ax_bottom, spec, scales)
+        if ax_cpo is not None:
+            bar_axes = (ax_bottom, ax_cpo)
         # Чуть повернём даты, чтобы смотрелось аккуратно
         ax_bottom.tick_params(axis="x", rotation=0)
-
-        fig.tight_layout(rect=[0, 0, 1, 0.96])
-        out_path = OUT_DIR / filename
-        fig.savefig(out_path, dpi=180)
+        _thin_x_labels(ax_bottom, spec.labels)
+    else:
         plt.close(fig)
-        return out_path
+        raise ValueError(f"Unknown chart layout: {spec.layout}")
 
-    wb_path = plot_marketplace("wb", "WB — 14 дней", "wb_14d.png")
+    fig.tight_layout(rect=[0, 0, 1, 0.96])
+    # подписи — после раскладки: им нужны пиксельные координаты осей
+    if point_axes is not None:
+        _place_point_labels(fig, *point_axes, spec)
+    if bar_axes is not None:
+        _place_bar_labels(fig, *bar_axes, spec)
+    fig.savefig(out_path, dpi=CHART_STYLE["dpi"])
+    plt.close(fig)
+    return out_path
 
-    # ВАЖНО: всегда возвращаем список
-    paths = []
-    if wb_path.exists():
-        paths.append(str(wb_path))
+
+# --- пул процессов ---
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _chart_workers() -> int:
+    if CHART_WORKERS > 0:
+        return CHART_WORKERS
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _executor() -> ProcessPoolExecutor:
+    """
+    Пул живёт до конца процесса (в демоне — между запусками). forkserver: процессы
+    порождаются от чистого сервера, где matplotlib уже импортирован, а не форком
+    многопоточного родителя; где forkserver нет — spawn.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                ctx = multiprocessing.get_context("forkserver")
+                ctx.set_forkserver_preload(["src.report"])
+            else:
+                ctx = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=_chart_workers(), mp_context=ctx)
+        return _pool
+
+
+def _reset_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def render_charts(specs: List[ChartSpec]) -> List[str]:
+    """
+    Пути к картинкам в том же порядке, что и specs. Уже нарисованные (тот же spec и стиль)
+    берём из OUT_DIR; остальные рисуем пулом процессов, один — прямо здесь
+    (на одну картинку пул не окупается). Сломался пул — дорисовываем здесь же.
+    """
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    out_dir = OUT_DIR.resolve()
+    paths: List[str] = []
+    todo: List[Tuple[ChartSpec, str]] = []
+    for spec in specs:
+        # те же данные + тот же стиль = та же картинка, не перерисовываем
+        out_path = out_dir / f"{spec.name}_{_render_key(spec)}.png"
+        if out_path.exists():
+            out_path.touch()
+            instrument.count("report.chart_cache_hits")
+        else:
+            todo.append((spec, str(out_path)))
+        paths.append(str(OUT_DIR / out_path.name))
+    instrument.count("report.chart_renders", len(todo))
+
+    if len(todo) == 1 or _chart_workers() == 1:
+        for spec, out_path in todo:
+            render_chart(spec, out_path)
+    elif todo:
+        try:
+            list(_executor().map(render_chart, *zip(*todo)))
+        except BrokenProcessPool:
+            _reset_pool()
+            for spec, out_path in todo:
+                if not os.path.exists(out_path):
+                    render_chart(spec, out_path)
+
+    _evict_old_renders()
     return paths
+
+
+# --- какие графики рисуем ---
+
+def _wb_days(n: int) -> List[Tuple[str, int, int, Optional[float]]]:
+    # (date, clicks, orders, spend) за последние n дней в БД, по возрастанию даты
+    return [(d, clk, ords, spend) for d, _imp, clk, ords, spend in storage.get_last_n_days_for_marketplace("wb", n)]
+
+
+def wb_funnel_spec(n_days: int) -> Optional[ChartSpec]:
+    days = _wb_days(n_days)
+    if not days:
+        return None
+    return ChartSpec(
+        name=f"wb_{n_days}d",
+        title=f"WB — {n_days} дней{accounts.suffix()}",
+        layout="funnel",
+        labels=tuple(d[5:] for d, *_ in days),
+        clicks=tuple(c for _, c, _, _ in days),
+        orders=tuple(o for _, _, o, _ in days),
+        spend=tuple(None if s is None else float(s) for *_, s in days),
+    )
+
+
+def _group_specs(field: str, caption: str, date_from: str, date_to: str) -> List[ChartSpec]:
+    labels = []
+    d, last = date.fromisoformat(date_from), date.fromisoformat(date_to)
+    while d <= last:
+        labels.append(d.isoformat())
+        d += timedelta(days=1)
+
+    series: Dict[str, Dict[str, Tuple[int, int]]] = {}
+    for group, dt, clicks, orders in storage.get_group_daily(field, date_from, date_to, CHART_TOP_GROUPS):
+        series.setdefault(group, {})[dt] = (clicks, orders)
+
+    specs = []
+    for group, by_day in series.items():
+        specs.append(ChartSpec(
+            name=f"{field}_{hashlib.sha1(group.encode('utf-8')).hexdigest()[:8]}",
+            title=f"{caption}: {group} — {len(labels)} дней{accounts.suffix()}",
+            layout="dual",
+            labels=tuple(dt[5:] for dt in labels),
+            clicks=tuple(by_day.get(dt, (0, 0))[0] for dt in labels),
+            orders=tuple(by_day.get(dt, (0, 0))[1] for dt in labels),
+        ))
+    return specs
+
+
+def build_chart_specs() -> List[ChartSpec]:
+    """
+    Полный набор графиков (вариант "charts"): WB за 14 / 30 / 90 дней, топ брендов
+    и предметов за 14 дней, топ артикулов по заказам. Окна — по последним дням в БД.
+    """
+    specs = [s for s in (wb_funnel_spec(DAYS), wb_funnel_spec(30), wb_funnel_spec(90)) if s]
+    days = _wb_days(DAYS)
+    if not days:
+        return specs
+    date_from, date_to = days[0][0], days[-1][0]
+    specs += _group_specs("brand", "Бренд", date_from, date_to)
+    specs += _group_specs("subject_name", "Предмет", date_from, date_to)
+    top = storage.get_top_nm(date_from, date_to, CHART_TOP_NM)
+    if top:
+        specs.append(ChartSpec(
+            name="top_nm",
+            title=f"Топ-{len(top)} артикулов по заказам, {date_from[5:]} — {date_to[5:]}{accounts.suffix()}",
+            layout="hbar",
+            labels=tuple(f"{vendor} ({nm_id})" if vendor else str(nm_id) for nm_id, vendor, _, _ in top),
+            clicks=tuple(c for _, _, c, _ in top),
+            orders=tuple(o for _, _, _, o in top),
+        ))
+    return specs
+
+
+@instrument.span("report.charts")
+def make_charts_14d() -> List[str]:
+    spec = wb_funnel_spec(DAYS)
+    # ВАЖНО: всегда возвращаем список
+    return render_charts([spec]) if spec else []
+
+
+@instrument.span("report.charts", set="all")
+def make_charts_all() -> List[str]:
+    return render_charts(build_chart_specs())
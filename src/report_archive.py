@@ -0,0 +1,276 @@
+"""
+Архив сырых отчётов WB (DETAIL_HISTORY_REPORT) — вместо ZIP/CSV на каждое окно в data/.
+
+    <data_dir>/archive/ab/ab12…ef.csv.gz   — срез: заголовок + строки отчёта за один день
+    report_archive (SQLite)                — какой срез сейчас актуален для (кабинет, день)
+
+Срезы пишутся в utf-8 с ';' и адресуются sha256 содержимого (до сжатия). Окна sync
+перекрываются на 13 дней: устоявшиеся дни приходят байт в байт такими же — файл с тем же
+хэшем второй раз не пишется. День, который WB пересчитал, даёт новую версию; прошлая
+помечается superseded и удаляется через ARCHIVE_SUPERSEDED_KEEP_DAYS, дни старше
+ARCHIVE_RETENTION_DAYS — совсем (gc). Любой диапазон дат можно заново прогнать через
+парсер без сети: open_replay() отдаёт срезы подряд одним потоком.
+"""
+import csv
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src import accounts, storage
+from src.config import ARCHIVE_RETENTION_DAYS, ARCHIVE_SUPERSEDED_KEEP_DAYS
+
+FLUSH_ROWS = 200_000       # столько строк держим в памяти, потом дописываем в gzip-файлы дней
+GZIP_LEVEL = 6
+STAGING_MAX_AGE_SEC = 24 * 3600  # недописанные срезы упавшего процесса
+
+
+def _root() -> str:
+    return os.path.join(accounts.data_dir(), "archive")
+
+
+def object_path(sha256: str) -> str:
+    return os.path.join(_root(), sha256[:2], f"{sha256}.csv.gz")
+
+
+def _days(start: str, end: str) -> List[str]:
+    d, last = date.fromisoformat(start), date.fromisoformat(end)
+    out = []
+    while d <= last:
+        out.append(d.isoformat())
+        d += timedelta(days=1)
+    return out
+
+
+class _Lines:
+    # цель для csv.writer: строки копятся в список, а не в файл
+    def __init__(self):
+        self.lines: List[str] = []
+        self.write = self.lines.append
+
+
+@dataclass
+class ArchiveResult:
+    days: int = 0
+    new: int = 0        # новых версий дня
+    same: int = 0       # совпали с уже известными (дедупликация)
+    rows: int = 0
+    raw_bytes: int = 0
+    stored_bytes: int = 0  # сколько реально дописали на диск
+
+
+class SliceWriter:
+    """
+    Раскладывает строки отчётов за окно [start, end] по дням:
+
+        w = SliceWriter(start, end)
+        w.add(header, date_col, rows)   # по каждому CSV окна (куски по nmID — в одном порядке)
+        w.commit()                      # хэши, перенос в архив, индекс в SQLite
+
+    Срез каждого дня окна пишется даже без строк (только заголовок) — так видно,
+    что день был в отчёте и пустой, а не не запрашивался.
+    """
+
+    def __init__(self, start: str, end: str):
+        self.start, self.end = start, end
+        self.header: Optional[List[str]] = None
+        os.makedirs(_root(), exist_ok=True)
+        self._tmp = tempfile.mkdtemp(prefix="staging_", dir=_root())
+        self._sink = _Lines()
+        self._writer = csv.writer(self._sink, delimiter=";", lineterminator="\n")
+        self._buf: Dict[str, List[str]] = {}
+        self._buffered = 0
+        # по дням: sha256 содержимого, строк, байт до сжатия
+        self._hash: Dict[str, object] = {}
+        self._rows: Dict[str, int] = {}
+        self._raw: Dict[str, int] = {}
+
+    def add(self, header: List[str], date_col: int, rows: Iterable[List[str]]) -> None:
+        header = [h.strip().lstrip("\ufeff") for h in header]
+        if self.header is None:
+            self.header = header
+        # у кусков одного окна заголовок один и тот же; если нет — приводим к первому
+        remap = None
+        if header != self.header:
+            pos = {h: i for i, h in enumerate(header)}
+            remap = [pos.get(h) for h in self.header]
+
+        sink, writerow, buf = self._sink.lines, self._writer.writerow, self._buf
+        for row in rows:
+            if len(row) <= date_col:
+                continue
+            day = row[date_col].strip()[:10]
+            if not day:
+                continue
+            if remap is not None:
+                row = [row[i] if i is not None and i < len(row) else "" for i in remap]
+            writerow(row)
+            lines = buf.get(day)
+            if lines is None:
+                lines = buf[day] = []
+            lines.append(sink.pop())
+            self._buffered += 1
+            if self._buffered >= FLUSH_ROWS:
+                self._flush()
+
+    def _flush(self, day: Optional[str] = None) -> None:
+        for d in ([day] if day else list(self._buf)):
+            lines = self._buf.pop(d, [])
+            head = ""
+            h = self._hash.get(d)
+            if h is None:
+                h = self._hash[d] = hashlib.sha256()
+                self._rows[d] = self._raw[d] = 0
+                head = self._header_line()
+            elif not lines:
+                continue
+            data = (head + "".join(lines)).encode("utf-8")
+            h.update(data)
+            self._rows[d] += len(lines)
+            self._raw[d] += len(data)
+            # дописываем новым gzip-членом: gzip.open читает такие файлы целиком
+            with gzip.GzipFile(os.path.join(self._tmp, d), "ab", compresslevel=GZIP_LEVEL, mtime=0) as f:
+                f.write(data)
+        if day is None:
+            self._buffered = 0
+
+    def _header_line(self) -> str:
+        if not self.header:
+            return ""
+        self._writer.writerow(self.header)
+        return self._sink.lines.pop()
+
+    def commit(self, fetched_at: Optional[float] = None) -> ArchiveResult:
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        res = ArchiveResult()
+        try:
+            self._flush()
+            slices = []
+            for day in sorted(set(_days(self.start, self.end)) | set(self._hash)):
+                if day not in self._hash:
+                    self._buf[day] = []
+                    self._flush(day)
+                sha = self._hash[day].hexdigest()
+                rows = self._rows[day]
+                tmp = os.path.join(self._tmp, day)
+                size = os.path.getsize(tmp)
+                dest = object_path(sha)
+                if os.path.exists(dest):
+                    size = os.path.getsize(dest)
+                else:
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    os.replace(tmp, dest)
+                    res.stored_bytes += size
+                slices.append((day, sha, rows, self._raw[day], size))
+                res.rows += rows
+                res.raw_bytes += self._raw[day]
+            res.days = len(slices)
+            res.new, res.same = storage.archive_put_slices(slices, self.end, fetched_at)
+        finally:
+            self.discard()
+        return res
+
+    def discard(self) -> None:
+        shutil.rmtree(self._tmp, ignore_errors=True)
+
+
+def current_slices(start: str, end: str) -> Dict[str, Tuple[str, str]]:
+    """
+    day -> (путь к срезу, window_end) за [start, end]; дней, которых нет в архиве, нет и в ответе.
+    """
+    return {day: (object_path(sha), window_end) for day, sha, window_end, _ in storage.archive_get_current(start, end)}
+
+
+class _SliceStream(io.RawIOBase):
+    """
+    Несколько срезов подряд как один CSV: заголовок — только у первого.
+    """
+
+    def __init__(self, paths: List[str]):
+        super().__init__()
+        self._paths = list(paths)
+        self._cur = None
+        self._first = True
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while True:
+            if self._cur is None:
+                if not self._paths:
+                    return 0
+                self._cur = gzip.open(self._paths.pop(0), "rb")
+                if not self._first:
+                    self._cur.readline()
+                self._first = False
+            n = self._cur.readinto(b)
+            if n:
+                return n
+            self._cur.close()
+            self._cur = None
+
+    def close(self) -> None:
+        if self._cur is not None:
+            self._cur.close()
+            self._cur = None
+        super().close()
+
+
+def _read_header(path: str) -> str:
+    with gzip.open(path, "rb") as f:
+        return f.readline().decode("utf-8").rstrip("\r\n")
+
+
+def open_replay(paths: List[str]) -> Iterator[Tuple[str, io.BufferedReader]]:
+    """
+    Срезы по порядку -> (первая строка, бинарный поток utf-8) на каждую группу подряд идущих
+    срезов с одинаковым заголовком (WB иногда меняет колонки — такие дни парсятся отдельно).
+    """
+    group: List[str] = []
+    header = None
+    for path in paths:
+        h = _read_header(path)
+        if group and h != header:
+            yield header, io.BufferedReader(_SliceStream(group), 1 << 16)
+            group = []
+        header = h
+        group.append(path)
+    if group:
+        yield header, io.BufferedReader(_SliceStream(group), 1 << 16)
+
+
+def gc(now: Optional[float] = None) -> Tuple[int, int]:
+    """
+    Retention + удаление файлов, на которые больше нет ссылок. (записей удалено, файлов удалено).
+    """
+    now = time.time() if now is None else now
+    min_day = None
+    if ARCHIVE_RETENTION_DAYS > 0:
+        min_day = (date.fromtimestamp(now) - timedelta(days=ARCHIVE_RETENTION_DAYS)).isoformat()
+    expired = storage.archive_expire(min_day, now - ARCHIVE_SUPERSEDED_KEEP_DAYS * 86400)
+
+    root = _root()
+    if not os.path.isdir(root):
+        return expired, 0
+    keep = storage.archive_get_hashes()
+    removed = 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.startswith("staging_"):
+            if os.path.getmtime(path) < now - STAGING_MAX_AGE_SEC:
+                shutil.rmtree(path, ignore_errors=True)
+            continue
+        if not os.path.isdir(path):
+            continue
+        for f in os.listdir(path):
+            if f.endswith(".csv.gz") and f[:-len(".csv.gz")] not in keep:
+                os.remove(os.path.join(path, f))
+                removed += 1
+    return expired, removed
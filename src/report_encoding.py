@@ -0,0 +1,134 @@
+"""
+Кодировка CSV-отчётов WB: определяем один раз по BOM и префиксу, декодируем за один проход.
+
+WB отдаёт отчёты в utf-8 (с BOM и без), иногда в cp1251 и utf-16 (в том числе без BOM).
+Весь файл целиком ни разу не декодируется "на пробу":
+  * BOM — сразу ответ;
+  * utf-16 без BOM — по нулевым байтам в префиксе (в 8-битных кодировках CSV их не бывает);
+  * префикс — валидный utf-8 с не-ASCII символами — utf-8;
+  * префикс с байтами, невозможными в utf-8, — cp1251;
+  * префикс чисто ASCII (заголовок и цифры) — решить нельзя: кодек UTF8_OR_CP1251
+    читает как utf-8 и, если дальше встретится байт не из utf-8 при том, что до него
+    был только ASCII, без перечитывания переключается на cp1251 (ASCII у них общий).
+"""
+import codecs
+from typing import Optional, Tuple
+
+UTF8_OR_CP1251 = "wb-utf8-or-cp1251"
+
+# доля "старших" байт utf-16, похожих на латиницу/цифры (0x00) или кириллицу (0x04)
+UTF16_MIN_HI_SHARE = 0.9
+UTF16_MAX_LO_ZERO_SHARE = 0.1
+
+
+def _utf16_without_bom(prefix: bytes) -> Optional[str]:
+    sample = prefix[: len(prefix) & ~1]
+    if len(sample) < 4 or b"\x00" not in sample:
+        return None
+    even, odd = sample[0::2], sample[1::2]
+    for hi, lo, enc in ((odd, even, "utf-16-le"), (even, odd, "utf-16-be")):
+        hi_share = (hi.count(0) + hi.count(4)) / len(hi)
+        lo_zero_share = lo.count(0) / len(lo)
+        if hi_share >= UTF16_MIN_HI_SHARE and lo_zero_share <= UTF16_MAX_LO_ZERO_SHARE:
+            return enc
+    return None
+
+
+def detect_encoding(prefix: bytes) -> str:
+    """
+    Кодировка по началу файла (см. docstring модуля).
+    Префикс мог оборваться посреди символа — поэтому декодер инкрементальный (final=False).
+    """
+    if prefix.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if prefix.startswith(codecs.BOM_UTF16_LE) or prefix.startswith(codecs.BOM_UTF16_BE):
+        return "utf-16"
+    enc = _utf16_without_bom(prefix)
+    if enc:
+        return enc
+    if prefix.isascii():
+        return UTF8_OR_CP1251
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(prefix, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "cp1251"
+
+
+class Utf8OrCp1251Decoder(codecs.IncrementalDecoder):
+    """
+    utf-8, пока не встретится невозможный в utf-8 байт. Если до этого байта (в прошлых кусках
+    и в этом же) был только ASCII — остаток (с недочитанным хвостом) декодируется как cp1251.
+    Если не-ASCII уже был (значит, это всё-таки utf-8, просто битый) — как обычно, по errors.
+    """
+
+    def __init__(self, errors: str = "strict"):
+        super().__init__(errors)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")("strict")
+        self._fallback = None
+        self._non_ascii_seen = False
+
+    def decode(self, data: bytes, final: bool = False) -> str:
+        if self._fallback is not None:
+            return self._fallback.decode(data, final)
+        pending, _ = self._utf8.getstate()
+        try:
+            out = self._utf8.decode(data, final)
+        except UnicodeDecodeError as exc:
+            # utf-8 падает на весь кусок: не-ASCII до ошибки в этом же куске — тоже настоящий utf-8
+            head = (pending + data)[:exc.start]
+            if not head.isascii():
+                self._non_ascii_seen = True
+            enc = "utf-8" if self._non_ascii_seen else "cp1251"
+            self._fallback = codecs.getincrementaldecoder(enc)(self.errors)
+            return self._fallback.decode(pending + data, final)
+        if not self._non_ascii_seen and not out.isascii():
+            self._non_ascii_seen = True
+        return out
+
+    def reset(self) -> None:
+        self._utf8.reset()
+        self._fallback = None
+        self._non_ascii_seen = False
+
+    def getstate(self) -> Tuple[bytes, int]:
+        # флаг: 0 — ещё utf-8 (только ASCII), 2 — utf-8 и не-ASCII уже был,
+        # 1 — переключились на cp1251, 3 — битый utf-8, дальше по errors
+        if self._fallback is not None:
+            buf, _ = self._fallback.getstate()
+            return buf, 3 if self._non_ascii_seen else 1
+        buf, _ = self._utf8.getstate()
+        return buf, 2 if self._non_ascii_seen else 0
+
+    def setstate(self, state: Tuple[bytes, int]) -> None:
+        buf, flag = state
+        self.reset()
+        self._non_ascii_seen = flag in (2, 3)
+        if flag in (1, 3):
+            self._fallback = codecs.getincrementaldecoder("cp1251" if flag == 1 else "utf-8")(self.errors)
+            self._fallback.setstate((buf, 0))
+        else:
+            self._utf8.setstate((buf, 0))
+
+
+def _decode(data: bytes, errors: str = "strict") -> Tuple[str, int]:
+    return Utf8OrCp1251Decoder(errors).decode(bytes(data), final=True), len(data)
+
+
+def _search(name: str) -> Optional[codecs.CodecInfo]:
+    if name != UTF8_OR_CP1251.replace("-", "_"):
+        return None
+    utf8 = codecs.lookup("utf-8")
+    return codecs.CodecInfo(
+        name=UTF8_OR_CP1251,
+        encode=utf8.encode,
+        decode=_decode,
+        incrementalencoder=utf8.incrementalencoder,
+        incrementaldecoder=Utf8OrCp1251Decoder,
+        streamreader=utf8.streamreader,
+        streamwriter=utf8.streamwriter,
+    )
+
+
+# кодек нужен по имени: его открывают io.TextIOWrapper и pandas.read_csv
+codecs.register(_search)
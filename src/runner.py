@@ -0,0 +1,63 @@
+"""
+Прогон одной задачи (sync / send) по всем кабинетам.
+
+Кабинеты обрабатываются параллельно ограниченным пулом (ACCOUNTS_WORKERS):
+почти всё время уходит на ожидание генерации отчётов WB, а лимиты WB считаются
+по токену, так что кабинеты друг друга не тормозят. Ошибка одного кабинета
+не останавливает остальные — она попадает в результат.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from src import accounts
+from src.config import ACCOUNTS_WORKERS
+
+
+@dataclass
+class AccountResult:
+    account_id: str
+    ok: bool
+    value: Any = None
+    error: Optional[str] = None
+    elapsed_sec: float = 0.0
+
+
+def _run_one(fn: Callable[[], Any], account: accounts.Account) -> AccountResult:
+    t0 = time.monotonic()
+    with accounts.use(account):
+        try:
+            value = fn()
+        except Exception as e:
+            return AccountResult(account.account_id, False, error=f"{type(e).__name__}: {e}",
+                                 elapsed_sec=time.monotonic() - t0)
+    return AccountResult(account.account_id, True, value=value, elapsed_sec=time.monotonic() - t0)
+
+
+def run_accounts(
+    fn: Callable[[], Any],
+    account_list: Optional[List[accounts.Account]] = None,
+    max_workers: int = ACCOUNTS_WORKERS,
+    pool: Optional[ThreadPoolExecutor] = None
+) -> Dict[str, AccountResult]:
+    """
+    fn() вызывается для каждого кабинета внутри accounts.use(...).
+    pool — готовый пул (демон держит его между запусками вместе с соединениями потоков).
+    Возвращает {account_id: AccountResult} в порядке account_list.
+    """
+    if account_list is None:
+        account_list = accounts.all_active()
+    if not account_list:
+        return {}
+
+    if pool is None:
+        workers = max(1, min(max_workers, len(account_list)))
+        if workers == 1:
+            # один кабинет — без лишних потоков
+            return {a.account_id: _run_one(fn, a) for a in account_list}
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="account") as own:
+            return run_accounts(fn, account_list, pool=own)
+
+    futures = [(a.account_id, pool.submit(_run_one, fn, a)) for a in account_list]
+    return {account_id: fut.result() for account_id, fut in futures}
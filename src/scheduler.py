@@ -0,0 +1,194 @@
+"""
+Резидентный режим: python -m src.main daemon.
+
+Вместо cron с холодным стартом на каждый запуск процесс живёт постоянно и держит
+прогретыми HTTP-сессии (WB, Telegram), соединения SQLite у потоков пула, индекс
+карточек и кэш шрифтов matplotlib.
+
+Расписание по дням (время — в TZ):
+  REPORT_TIME - SCHEDULER_PREFETCH_MIN  — sync: заказываем и докачиваем отчёт WB за вчера;
+  REPORT_TIME                            — send: рассылка из БД (только после успешного sync);
+  каждые SCHEDULER_REFRESH_MIN минут     — sync(refresh=True) в течение дня: досчитывающиеся
+                                           дни — новым отчётом WB, а не из архива.
+
+Что уже сделано за день, хранится в sync_state (по кабинетам), поэтому после
+перезапуска отчёт не уходит второй раз, а недоделанное доделывается.
+Упавший кабинет повторяется через SCHEDULER_RETRY_MIN и не мешает остальным.
+SIGTERM/SIGINT: текущий шаг доводится до конца, новые не начинаются.
+"""
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src import accounts, instrument, storage
+from src.config import (
+    REPORT_TIME, ACCOUNTS_WORKERS,
+    SCHEDULER_PREFETCH_MIN, SCHEDULER_REFRESH_MIN, SCHEDULER_RETRY_MIN,
+)
+from src.runner import run_accounts
+
+TICK_SEC = 30.0
+
+STATE_SYNCED = "scheduler.synced"        # за какой день (вчера) данные уже в БД
+STATE_SENT = "scheduler.sent"            # за какой день отчёт уже разослан
+STATE_REFRESHED = "scheduler.refreshed"  # unix time последнего sync
+
+
+def _state_key(key: str, account_id: str) -> str:
+    return f"{key}@{account_id}"
+
+
+def _parse_report_time(value: str = REPORT_TIME) -> Tuple[int, int]:
+    hh, mm = value.split(":", 1)
+    return int(hh), int(mm)
+
+
+class Scheduler:
+    def __init__(self, now_fn: Callable[[], datetime], sync_fn: Callable[..., None],
+                 send_fn: Callable[[date], None]):
+        """
+        now_fn — текущее время в TZ; sync_fn/send_fn — main.sync / main.send
+        (вызываются внутри accounts.use для каждого кабинета); sync_fn(day, refresh=True) —
+        обновление в течение дня.
+        """
+        self.now_fn = now_fn
+        self.sync_fn = sync_fn
+        self.send_fn = send_fn
+        self.stop_event = threading.Event()
+        self.pool = ThreadPoolExecutor(max_workers=max(1, ACCOUNTS_WORKERS), thread_name_prefix="account")
+        self._retry_at: Dict[str, float] = {}  # "<kind>@<account>" -> unix time
+
+    # --- прогрев ---
+
+    def warm_up(self) -> None:
+        """
+        Всё, что дорого поднимать с нуля: импорт matplotlib + кэш шрифтов, HTTP-сессии, бот.
+        Ошибки прогрева не фатальны — то же самое поднимется при первом использовании.
+        """
+        from src import report, wb_http
+
+        wb_http.session()
+        try:
+            import matplotlib.font_manager as fm
+            fm.findfont("DejaVu Sans")
+        except Exception:
+            pass
+        try:
+            from src import tg_sender
+            tg_sender.bot()
+        except Exception:
+            pass
+        report.OUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    # --- состояние ---
+
+    def _get(self, key: str, account_id: str) -> Optional[str]:
+        return storage.get_sync_state(_state_key(key, account_id))
+
+    def _set(self, key: str, account_id: str, value: str) -> None:
+        storage.set_sync_state(_state_key(key, account_id), value)
+
+    def _can_retry(self, kind: str, account_id: str, now_ts: float) -> bool:
+        return self._retry_at.get(f"{kind}@{account_id}", 0.0) <= now_ts
+
+    def _run(self, kind: str, fn: Callable[[], None], account_list: List[accounts.Account],
+             now_ts: float, sequential: bool = False) -> List[accounts.Account]:
+        """
+        Запуск по кабинетам; упавшим ставим время повтора. Возвращает успешные.
+        """
+        if not account_list:
+            return []
+        with instrument.run(kind):
+            if sequential:
+                results = run_accounts(fn, account_list, max_workers=1)
+            else:
+                results = run_accounts(fn, account_list, pool=self.pool)
+        done = []
+        for a in account_list:
+            r = results[a.account_id]
+            if r.ok:
+                self._retry_at.pop(f"{kind}@{a.account_id}", None)
+                done.append(a)
+            else:
+                self._retry_at[f"{kind}@{a.account_id}"] = now_ts + SCHEDULER_RETRY_MIN * 60
+                print(f"[scheduler] {kind} [{a.account_id}] FAILED: {r.error}", flush=True)
+        return done
+
+    # --- один шаг расписания ---
+
+    def tick(self) -> None:
+        now = self.now_fn()
+        now_ts = time.time()
+        yesterday = (now - timedelta(days=1)).date()
+        day = yesterday.isoformat()
+
+        hh, mm = _parse_report_time()
+        report_at = now.replace(hour=hh, minute=mm, second=0, microsecond=0)
+        prefetch_at = report_at - timedelta(minutes=SCHEDULER_PREFETCH_MIN)
+
+        account_list = accounts.all_active()
+
+        # 1) prefetch: данные за вчера — до REPORT_TIME
+        if now >= prefetch_at:
+            todo = [
+                a for a in account_list
+                if self._get(STATE_SYNCED, a.account_id) != day and self._can_retry("sync", a.account_id, now_ts)
+            ]
+            for a in self._run("sync", lambda: self.sync_fn(yesterday), todo, now_ts):
+                self._set(STATE_SYNCED, a.account_id, day)
+                self._set(STATE_REFRESHED, a.account_id, str(now_ts))
+
+        if self.stop_event.is_set():
+            return
+
+        # 2) рассылка: Telegram и outbox общие — по кабинетам по очереди
+        if now >= report_at:
+            todo = [
+                a for a in account_list
+                if self._get(STATE_SYNCED, a.account_id) == day
+                and self._get(STATE_SENT, a.account_id) != day
+                and self._can_retry("send", a.account_id, now_ts)
+            ]
+            for a in self._run("send", lambda: self.send_fn(yesterday), todo, now_ts, sequential=True):
+                self._set(STATE_SENT, a.account_id, day)
+
+        if self.stop_event.is_set() or SCHEDULER_REFRESH_MIN <= 0:
+            return
+
+        # 3) обновление в течение дня — только для кабинетов, где отчёт за вчера уже отработан
+        todo = [
+            a for a in account_list
+            if self._get(STATE_SENT, a.account_id) == day
+            and now_ts - float(self._get(STATE_REFRESHED, a.account_id) or 0) >= SCHEDULER_REFRESH_MIN * 60
+            and self._can_retry("refresh", a.account_id, now_ts)
+        ]
+        # за тот же день prefetch уже всё положил в архив — без refresh sync отдал бы его же
+        for a in self._run("refresh", lambda: self.sync_fn(yesterday, refresh=True), todo, now_ts):
+            self._set(STATE_REFRESHED, a.account_id, str(now_ts))
+
+    # --- цикл ---
+
+    def stop(self, *_args) -> None:
+        self.stop_event.set()
+
+    def run_forever(self) -> None:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self.stop)
+
+        self.warm_up()
+        print(f"[scheduler] started, REPORT_TIME={REPORT_TIME}", flush=True)
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self.tick()
+                except Exception as e:
+                    # сбой шага (например, БД заблокирована) не должен ронять демон
+                    print(f"[scheduler] tick failed: {type(e).__name__}: {e}", flush=True)
+                self.stop_event.wait(TICK_SEC)
+        finally:
+            self.pool.shutdown(wait=True)
+            storage.close()
+            print("[scheduler] stopped", flush=True)
@@ -1,81 +1,1694 @@
+import json
 import sqlite3
+import threading
 from pathlib import Path
-from typing import Optional, Dict, Any, List, Tuple
+from typing import Optional, Dict, Any, List, Tuple, Iterable
+
+from src import accounts, instrument
 
 DB_PATH = Path("data/mp.db")
 
+# одно соединение на поток: mkdir, connect и PRAGMA — только при первом обращении,
+# дальше переиспользуем. `with _connect() as conn:` по-прежнему = одна транзакция
+# (commit/rollback на выходе), соединение при этом не закрывается.
+_local = threading.local()
+
 def _connect() -> sqlite3.Connection:
+    path = DB_PATH.as_posix()
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        if _local.path == path:
+            return conn
+        # DB_PATH поменяли (тесты/бенчмарки) — переоткрываемся
+        conn.close()
+
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH.as_posix())
+    conn = sqlite3.connect(path, timeout=30)
     conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA synchronous=NORMAL;")
+    _local.conn = conn
+    _local.path = path
     return conn
 
+def close() -> None:
+    """
+    Закрыть соединение текущего потока (следующий _connect() откроет заново).
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+def _acc(account: Optional[str]) -> str:
+    # по умолчанию — текущий аккаунт из контекста (см. src/accounts.py)
+    return account or accounts.current_id()
+
+def _create_partitioned(conn: sqlite3.Connection, table: str, create_sql: str) -> None:
+    """
+    CREATE TABLE для таблиц с колонкой account в первичном ключе.
+    Таблица из однокабинетной версии (без account) пересобирается: старые строки
+    переезжают в аккаунт 'default' (первичный ключ в SQLite через ALTER не поменять).
+    """
+    cols = [r[1] for r in conn.execute(f"PRAGMA table_info({table});")]
+    if not cols:
+        conn.execute(create_sql)
+        return
+    if "account" in cols:
+        return
+    conn.execute(f"ALTER TABLE {table} RENAME TO {table}__old;")
+    conn.execute(create_sql)
+    col_list = ", ".join(cols)
+    conn.execute(
+        f"INSERT INTO {table} (account, {col_list}) SELECT ?, {col_list} FROM {table}__old;",
+        (accounts.DEFAULT_ACCOUNT_ID,)
+    )
+    conn.execute(f"DROP TABLE {table}__old;")
+
+# --- агрегаты daily_metrics, которые ведут триггеры (в той же транзакции, что и upsert) ---
+# metrics_rollup: суммы по неделям (grain='W', period = понедельник) и месяцам (grain='M', period = YYYY-MM);
+# metrics_cumulative: нарастающие суммы по дням — сумма за любое окно [a, b] = cum(b) - cum(< a),
+# два поиска по первичному ключу независимо от длины истории.
+# ad_spend NULL ("нет данных") в суммы идёт как 0, а spend_days считает дни, где он был.
+
+_ROLLUP_GRAINS = {
+    "W": "date({d}, 'weekday 0', '-6 days')",
+    "M": "substr({d}, 1, 7)",
+}
+
+def _rollup_trigger_sql(sign: str, row: str) -> str:
+    """
+    Операторы для тела триггера: прибавить (sign='+') или вычесть ('-') строку row (NEW/OLD).
+    """
+    sql = []
+    for grain, period in _ROLLUP_GRAINS.items():
+        sql.append(
+            f"""
+            INSERT INTO metrics_rollup (account, marketplace, grain, period,
+                                        impressions, clicks, orders, ad_spend, spend_days, days)
+            VALUES ({row}.account, {row}.marketplace, '{grain}', {period.format(d=row + '.date')},
+                    {sign}{row}.impressions, {sign}{row}.clicks, {sign}{row}.orders,
+                    {sign}COALESCE({row}.ad_spend, 0), {sign}({row}.ad_spend IS NOT NULL), {sign}1)
+            ON CONFLICT(account, marketplace, grain, period) DO UPDATE SET
+                impressions = impressions + excluded.impressions,
+                clicks = clicks + excluded.clicks,
+                orders = orders + excluded.orders,
+                ad_spend = ad_spend + excluded.ad_spend,
+                spend_days = spend_days + excluded.spend_days,
+                days = days + excluded.days;
+            """
+        )
+    sql.append("DELETE FROM metrics_rollup WHERE days <= 0;")
+    # нарастающие суммы: все дни после row сдвигаются на row
+    sql.append(
+        f"""
+        UPDATE metrics_cumulative
+        SET impressions = impressions {sign} {row}.impressions,
+            clicks = clicks {sign} {row}.clicks,
+            orders = orders {sign} {row}.orders,
+            ad_spend = ad_spend {sign} COALESCE({row}.ad_spend, 0),
+            spend_days = spend_days {sign} ({row}.ad_spend IS NOT NULL),
+            days = days {sign} 1
+        WHERE account = {row}.account AND marketplace = {row}.marketplace AND date > {row}.date;
+        """
+    )
+    return "\n".join(sql)
+
+def _init_rollups(conn: sqlite3.Connection) -> None:
+    fresh = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'metrics_cumulative';"
+    ).fetchone() is None
+
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS metrics_rollup (
+            account TEXT NOT NULL,
+            marketplace TEXT NOT NULL,
+            grain TEXT NOT NULL, -- 'W' / 'M'
+            period TEXT NOT NULL, -- понедельник недели (YYYY-MM-DD) / месяц (YYYY-MM)
+            impressions INTEGER NOT NULL DEFAULT 0,
+            clicks INTEGER NOT NULL DEFAULT 0,
+            orders INTEGER NOT NULL DEFAULT 0,
+            ad_spend REAL NOT NULL DEFAULT 0,
+            spend_days INTEGER NOT NULL DEFAULT 0,
+            days INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (account, marketplace, grain, period)
+        ) WITHOUT ROWID;
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS metrics_cumulative (
+            account TEXT NOT NULL,
+            marketplace TEXT NOT NULL,
+            date TEXT NOT NULL,
+            impressions INTEGER NOT NULL DEFAULT 0,
+            clicks INTEGER NOT NULL DEFAULT 0,
+            orders INTEGER NOT NULL DEFAULT 0,
+            ad_spend REAL NOT NULL DEFAULT 0,
+            spend_days INTEGER NOT NULL DEFAULT 0,
+            days INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (account, marketplace, date)
+        ) WITHOUT ROWID;
+        """
+    )
+
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_daily_metrics_rollup_ins
+        AFTER INSERT ON daily_metrics
+        BEGIN
+            {_rollup_trigger_sql("+", "NEW")}
+            INSERT INTO metrics_cumulative (account, marketplace, date,
+                                            impressions, clicks, orders, ad_spend, spend_days, days)
+            SELECT NEW.account, NEW.marketplace, NEW.date,
+                   COALESCE(p.impressions, 0) + NEW.impressions,
+                   COALESCE(p.clicks, 0) + NEW.clicks,
+                   COALESCE(p.orders, 0) + NEW.orders,
+                   COALESCE(p.ad_spend, 0) + COALESCE(NEW.ad_spend, 0),
+                   COALESCE(p.spend_days, 0) + (NEW.ad_spend IS NOT NULL),
+                   COALESCE(p.days, 0) + 1
+            FROM (SELECT 1) LEFT JOIN (
+                SELECT * FROM metrics_cumulative
+                WHERE account = NEW.account AND marketplace = NEW.marketplace AND date < NEW.date
+                ORDER BY date DESC
+                LIMIT 1
+            ) p ON 1;
+        END;
+        """
+    )
+    # обновление = вычесть старую строку и прибавить новую;
+    # сама строка metrics_cumulative за этот день при этом сдвигается на (NEW - OLD)
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_daily_metrics_rollup_upd
+        AFTER UPDATE OF impressions, clicks, orders, ad_spend ON daily_metrics
+        BEGIN
+            {_rollup_trigger_sql("-", "OLD")}
+            {_rollup_trigger_sql("+", "NEW")}
+            UPDATE metrics_cumulative
+            SET impressions = impressions + NEW.impressions - OLD.impressions,
+                clicks = clicks + NEW.clicks - OLD.clicks,
+                orders = orders + NEW.orders - OLD.orders,
+                ad_spend = ad_spend + COALESCE(NEW.ad_spend, 0) - COALESCE(OLD.ad_spend, 0),
+                spend_days = spend_days + (NEW.ad_spend IS NOT NULL) - (OLD.ad_spend IS NOT NULL)
+            WHERE account = NEW.account AND marketplace = NEW.marketplace AND date = NEW.date;
+        END;
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_daily_metrics_rollup_del
+        AFTER DELETE ON daily_metrics
+        BEGIN
+            {_rollup_trigger_sql("-", "OLD")}
+            DELETE FROM metrics_cumulative
+            WHERE account = OLD.account AND marketplace = OLD.marketplace AND date = OLD.date;
+        END;
+        """
+    )
+    # ключ строки (кабинет/дата/площадка) никто не меняет — и триггеры выше на это не рассчитаны
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_daily_metrics_key_immutable
+        BEFORE UPDATE OF account, date, marketplace ON daily_metrics
+        WHEN NEW.account IS NOT OLD.account OR NEW.date IS NOT OLD.date OR NEW.marketplace IS NOT OLD.marketplace
+        BEGIN
+            SELECT RAISE(ABORT, 'daily_metrics key is immutable: delete and insert instead');
+        END;
+        """
+    )
+
+    if fresh:
+        _rebuild_rollups(conn)
+
+def _rebuild_rollups(conn: sqlite3.Connection) -> None:
+    """
+    Пересчитать агрегаты с нуля по daily_metrics (первый запуск на старой БД / починка).
+    """
+    conn.execute("DELETE FROM metrics_rollup;")
+    conn.execute("DELETE FROM metrics_cumulative;")
+    for grain, period in _ROLLUP_GRAINS.items():
+        conn.execute(
+            f"""
+            INSERT INTO metrics_rollup (account, marketplace, grain, period,
+                                        impressions, clicks, orders, ad_spend, spend_days, days)
+            SELECT account, marketplace, '{grain}', {period.format(d='date')},
+                   SUM(impressions), SUM(clicks), SUM(orders),
+                   SUM(COALESCE(ad_spend, 0)), SUM(ad_spend IS NOT NULL), COUNT(*)
+            FROM daily_metrics
+            GROUP BY 1, 2, 4;
+            """
+        )
+    conn.execute(
+        """
+        INSERT INTO metrics_cumulative (account, marketplace, date,
+                                        impressions, clicks, orders, ad_spend, spend_days, days)
+        SELECT account, marketplace, date,
+               SUM(impressions) OVER w, SUM(clicks) OVER w, SUM(orders) OVER w,
+               SUM(COALESCE(ad_spend, 0)) OVER w, SUM(ad_spend IS NOT NULL) OVER w, COUNT(*) OVER w
+        FROM daily_metrics
+        WINDOW w AS (PARTITION BY account, marketplace ORDER BY date);
+        """
+    )
+
+def rebuild_rollups() -> None:
+    with _connect() as conn:
+        _rebuild_rollups(conn)
+
 def init_db() -> None:
     with _connect() as conn:
+        # реестр кабинетов (default из .env сюда можно не заносить)
         conn.execute(
             """
-            CREATE TABLE IF NOT EXISTS daily_metrics (
+            CREATE TABLE IF NOT EXISTS accounts (
+                account_id TEXT PRIMARY KEY,
+                name TEXT,
+                wb_token TEXT NOT NULL,
+                active INTEGER NOT NULL DEFAULT 1
+            );
+            """
+        )
+        _create_partitioned(
+            conn,
+            "daily_metrics",
+            """
+            CREATE TABLE daily_metrics (
+                account TEXT NOT NULL DEFAULT 'default',
                 date TEXT NOT NULL,
                 marketplace TEXT NOT NULL, -- 'wb' or 'ozon'
                 impressions INTEGER NOT NULL DEFAULT 0,
                 clicks INTEGER NOT NULL DEFAULT 0,
                 orders INTEGER NOT NULL DEFAULT 0,
                 ad_spend REAL, -- can be NULL if not available
-                PRIMARY KEY (date, marketplace)
+                PRIMARY KEY (account, date, marketplace)
+            );
+            """
+        )
+        _init_rollups(conn)
+        # метрики WB в разрезе nmID (артикула) по дням.
+        # day — целое YYYYMMDD: компактнее TEXT-даты, сортируется так же.
+        # PRIMARY KEY (account, day, nm_id) в WITHOUT ROWID-таблице = кластерный индекс по дню,
+        # второй индекс — покрывающий для истории одного артикула.
+        _create_partitioned(
+            conn,
+            "daily_nm_metrics",
+            """
+            CREATE TABLE daily_nm_metrics (
+                account TEXT NOT NULL DEFAULT 'default',
+                day INTEGER NOT NULL,
+                nm_id INTEGER NOT NULL,
+                clicks INTEGER NOT NULL DEFAULT 0,
+                orders INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (account, day, nm_id)
+            ) WITHOUT ROWID;
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_daily_nm_metrics_acc_nm_day
+            ON daily_nm_metrics (account, nm_id, day, clicks, orders);
+            """
+        )
+        # заказанные у WB отчёты (downloadId): чтобы после таймаута/перезапуска
+        # докачать уже готовый отчёт, а не заказывать новый, и чтобы знать,
+        # сколько обычно длится генерация
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS wb_report_jobs (
+                download_id TEXT PRIMARY KEY,
+                report_key TEXT NOT NULL,
+                status TEXT NOT NULL, -- PENDING / SUCCESS / FAILED / DONE / EXPIRED
+                created_at REAL NOT NULL, -- unix time
+                ready_at REAL, -- когда впервые увидели SUCCESS
+                path TEXT,
+                account TEXT NOT NULL DEFAULT 'default'
+            );
+            """
+        )
+        if "account" not in [r[1] for r in conn.execute("PRAGMA table_info(wb_report_jobs);")]:
+            conn.execute("ALTER TABLE wb_report_jobs ADD COLUMN account TEXT NOT NULL DEFAULT 'default';")
+        conn.execute("DROP INDEX IF EXISTS idx_wb_report_jobs_key;")
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_wb_report_jobs_acc_key
+            ON wb_report_jobs (account, report_key, status, created_at);
+            """
+        )
+        # архив сырых отчётов (src/report_archive.py): какой срез (sha256 файла в data/archive)
+        # лежит за день. Текущая версия дня — superseded_at IS NULL, прошлые доживают до retention.
+        # window_end — до какой даты был отчёт, из которого взят срез (устоялся ли день).
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS report_archive (
+                account TEXT NOT NULL DEFAULT 'default',
+                day TEXT NOT NULL, -- YYYY-MM-DD
+                sha256 TEXT NOT NULL,
+                rows INTEGER NOT NULL,
+                raw_bytes INTEGER NOT NULL, -- размер среза до сжатия
+                stored_bytes INTEGER NOT NULL, -- размер .csv.gz
+                window_end TEXT NOT NULL,
+                fetched_at REAL NOT NULL, -- unix time
+                superseded_at REAL,
+                PRIMARY KEY (account, day, sha256)
+            ) WITHOUT ROWID;
+            """
+        )
+        # бэкфилл истории (src/backfill.py): прогресс по окнам дат, чтобы после падения
+        # продолжить с недоделанных окон, а не начинать заново
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS backfill_windows (
+                account TEXT NOT NULL DEFAULT 'default',
+                start TEXT NOT NULL,
+                end TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'PENDING', -- PENDING / DONE / FAILED
+                attempts INTEGER NOT NULL DEFAULT 0,
+                days INTEGER, -- сколько дней загружено
+                rows INTEGER, -- строк (день x nmID)
+                source TEXT, -- 'wb' / 'archive'
+                error TEXT,
+                updated_at REAL,
+                PRIMARY KEY (account, start, end)
+            ) WITHOUT ROWID;
+            """
+        )
+        # затраты на рекламу (src/ads.py): списания /adv/v1/upd по кампаниям за день.
+        # ads_days — какие дни загружены: день в ads_days без строк в ads_spend — реальный ноль,
+        # дня нет в ads_days — данных нет. closed=1 — день закрыт, у WB больше не спрашиваем.
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ads_spend (
+                account TEXT NOT NULL DEFAULT 'default',
+                day INTEGER NOT NULL, -- YYYYMMDD, как в daily_nm_metrics
+                advert_id INTEGER NOT NULL,
+                spend REAL NOT NULL,
+                updates INTEGER NOT NULL, -- сколько списаний сложено
+                PRIMARY KEY (account, day, advert_id)
+            ) WITHOUT ROWID;
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ads_days (
+                account TEXT NOT NULL DEFAULT 'default',
+                day INTEGER NOT NULL,
+                closed INTEGER NOT NULL DEFAULT 0,
+                fetched_at REAL NOT NULL, -- unix time
+                PRIMARY KEY (account, day)
+            ) WITHOUT ROWID;
+            """
+        )
+        # кампании и их артикулы (/adv/v1/promotion/adverts) — для CPO по кампании и по nmID
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ads_campaigns (
+                account TEXT NOT NULL DEFAULT 'default',
+                advert_id INTEGER NOT NULL,
+                name TEXT,
+                type INTEGER,
+                status INTEGER,
+                updated_at REAL, -- когда последний раз читали из promotion/adverts (NULL — не читали)
+                PRIMARY KEY (account, advert_id)
+            ) WITHOUT ROWID;
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ads_campaign_nms (
+                account TEXT NOT NULL DEFAULT 'default',
+                advert_id INTEGER NOT NULL,
+                nm_id INTEGER NOT NULL,
+                PRIMARY KEY (account, advert_id, nm_id)
+            ) WITHOUT ROWID;
+            """
+        )
+        # локальный индекс карточек WB (Content API): синхронизируется инкрементально
+        # по курсору updatedAt, удалённые не стираем, а помечаем deleted=1
+        _create_partitioned(
+            conn,
+            "wb_cards",
+            """
+            CREATE TABLE wb_cards (
+                account TEXT NOT NULL DEFAULT 'default',
+                nm_id INTEGER NOT NULL,
+                imt_id INTEGER,
+                vendor_code TEXT,
+                subject_id INTEGER,
+                subject_name TEXT,
+                brand TEXT,
+                title TEXT,
+                updated_at TEXT, -- updatedAt из Content API
+                deleted INTEGER NOT NULL DEFAULT 0,
+                seen_at REAL, -- когда карточка последний раз пришла при синхронизации
+                PRIMARY KEY (account, nm_id)
+            );
+            """
+        )
+        # неотправленные в Telegram сообщения: ретраим с backoff, а не перезапрашиваем WB
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tg_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id TEXT NOT NULL,
+                text TEXT NOT NULL DEFAULT '',
+                photos TEXT NOT NULL DEFAULT '[]', -- JSON-список путей к картинкам
+                status TEXT NOT NULL DEFAULT 'PENDING', -- PENDING / SENT / DEAD
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                next_attempt_at REAL NOT NULL,
+                sent_at REAL,
+                last_error TEXT
+            );
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_tg_outbox_due
+            ON tg_outbox (status, next_attempt_at);
+            """
+        )
+        # кто какой отчёт получает: variant = full | summary | brand:<бренд>
+        _create_partitioned(
+            conn,
+            "tg_subscriptions",
+            """
+            CREATE TABLE tg_subscriptions (
+                account TEXT NOT NULL DEFAULT 'default',
+                chat_id TEXT NOT NULL,
+                variant TEXT NOT NULL DEFAULT 'full',
+                active INTEGER NOT NULL DEFAULT 1,
+                PRIMARY KEY (account, chat_id, variant)
+            );
+            """
+        )
+        # замеры запусков (src/instrument.py): этапы агрегатами и счётчики
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                command TEXT NOT NULL,
+                started_at REAL NOT NULL,
+                finished_at REAL NOT NULL,
+                ok INTEGER NOT NULL,
+                error TEXT
+            );
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_started ON runs (started_at);")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS run_spans (
+                run_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                labels TEXT NOT NULL DEFAULT '{}', -- JSON
+                calls INTEGER NOT NULL,
+                total_sec REAL NOT NULL,
+                max_sec REAL NOT NULL,
+                PRIMARY KEY (run_id, name, labels)
+            ) WITHOUT ROWID;
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS run_counters (
+                run_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                labels TEXT NOT NULL DEFAULT '{}', -- JSON
+                value REAL NOT NULL,
+                PRIMARY KEY (run_id, name, labels)
+            ) WITHOUT ROWID;
+            """
+        )
+        # служебные ключ-значение (курсоры синхронизаций и т.п.)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sync_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
             );
             """
         )
 
-def upsert_metrics(
-    date: str,
-    marketplace: str,
-    impressions: int,
-    clicks: int,
-    orders: int,
-    ad_spend: Optional[float] = None
-) -> None:
+def get_accounts() -> List[Tuple[str, Optional[str], str]]:
+    """
+    Активные кабинеты из реестра: (account_id, name, wb_token).
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            "SELECT account_id, name, wb_token FROM accounts WHERE active = 1 ORDER BY account_id;"
+        )
+        return cur.fetchall()
+
+def get_disabled_account_ids() -> List[str]:
+    with _connect() as conn:
+        return [r[0] for r in conn.execute("SELECT account_id FROM accounts WHERE active = 0;")]
+
+def add_account(account_id: str, wb_token: str, name: str = "") -> None:
     with _connect() as conn:
         conn.execute(
             """
-            INSERT INTO daily_metrics (date, marketplace, impressions, clicks, orders, ad_spend)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ON CONFLICT(date, marketplace) DO UPDATE SET
+            INSERT INTO accounts (account_id, name, wb_token, active) VALUES (?, ?, ?, 1)
+            ON CONFLICT(account_id) DO UPDATE SET
+                name=excluded.name,
+                wb_token=excluded.wb_token,
+                active=1;
+            """,
+            (account_id, name, wb_token)
+        )
+
+def disable_account(account_id: str) -> None:
+    """
+    Данные не трогаем — просто перестаём обрабатывать кабинет.
+    Для default (токен из .env) заводим запись-заглушку с active=0.
+    """
+    with _connect() as conn:
+        conn.execute(
+            """
+            INSERT INTO accounts (account_id, name, wb_token, active) VALUES (?, '', '', 0)
+            ON CONFLICT(account_id) DO UPDATE SET active=0;
+            """,
+            (account_id,)
+        )
+
+MetricsRow = Tuple[str, str, int, int, int, Optional[float]]
+
+def upsert_metrics_many(rows: Iterable[MetricsRow], account: Optional[str] = None) -> int:
+    """
+    rows: (date, marketplace, impressions, clicks, orders, ad_spend).
+    ad_spend=None — затраты не загрузились (ошибка advert-api): уже записанные не затираем.
+    Весь набор — одной транзакцией через executemany (бэкфилл года = один commit, а не 365).
+    account=None — текущий аккаунт. Возвращает число строк.
+    """
+    acc = _acc(account)
+    data = [(acc,) + tuple(r) for r in rows]
+    if not data:
+        return 0
+    instrument.count("storage.rows", len(data), table="daily_metrics")
+    with instrument.span("storage.write", table="daily_metrics"), _connect() as conn:
+        conn.executemany(
+            """
+            INSERT INTO daily_metrics (account, date, marketplace, impressions, clicks, orders, ad_spend)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(account, date, marketplace) DO UPDATE SET
                 impressions=excluded.impressions,
                 clicks=excluded.clicks,
                 orders=excluded.orders,
-                ad_spend=excluded.ad_spend;
+                ad_spend=COALESCE(excluded.ad_spend, ad_spend);
             """,
-            (date, marketplace, impressions, clicks, orders, ad_spend)
+            data
         )
+    return len(data)
+
+def upsert_metrics(
+    date: str,
+    marketplace: str,
+    impressions: int,
+    clicks: int,
+    orders: int,
+    ad_spend: Optional[float] = None,
+    account: Optional[str] = None
+) -> None:
+    upsert_metrics_many([(date, marketplace, impressions, clicks, orders, ad_spend)], account)
 
-def get_last_n_days(n_days: int) -> List[Tuple[str, str, int, int, int, Optional[float]]]:
+def get_last_n_days(n_days: int, account: Optional[str] = None) -> List[Tuple[str, str, int, int, int, Optional[float]]]:
     with _connect() as conn:
         cur = conn.execute(
             """
             SELECT date, marketplace, impressions, clicks, orders, ad_spend
             FROM daily_metrics
+            WHERE account = ?
             ORDER BY date DESC
             LIMIT ?;
             """,
-            (n_days * 2,)  # wb+ozon
+            (_acc(account), n_days * 2)  # wb+ozon
         )
         return cur.fetchall()
 
-from typing import List, Tuple, Optional
-
-def get_last_n_days_for_marketplace(mp: str, n_days: int) -> List[Tuple[str, int, int, int, Optional[float]]]:
+def get_last_n_days_for_marketplace(
+    mp: str,
+    n_days: int,
+    account: Optional[str] = None
+) -> List[Tuple[str, int, int, int, Optional[float]]]:
     with _connect() as conn:
         cur = conn.execute(
             """
             SELECT date, impressions, clicks, orders, ad_spend
             FROM daily_metrics
-            WHERE marketplace = ?
+            WHERE account = ? AND marketplace = ?
             ORDER BY date DESC
             LIMIT ?;
             """,
-            (mp, n_days)
+            (_acc(account), mp, n_days)
         )
         rows = cur.fetchall()
         # вернем по возрастанию даты, чтобы график шел слева направо
         return list(reversed(rows))
+
+def get_daily_series(
+    mp: str,
+    date_to: str,
+    account: Optional[str] = None
+) -> List[Tuple[str, int, int, Optional[float]]]:
+    """
+    Вся история площадки до date_to включительно: (date, clicks, orders, ad_spend) по возрастанию даты.
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT date, clicks, orders, ad_spend
+            FROM daily_metrics
+            WHERE account = ? AND marketplace = ? AND date <= ?
+            ORDER BY date;
+            """,
+            (_acc(account), mp, date_to)
+        )
+        return cur.fetchall()
+
+def get_dates_for_marketplace(mp: str, date_from: str, date_to: str, account: Optional[str] = None) -> List[str]:
+    """
+    Даты (YYYY-MM-DD), по которым уже есть строка в daily_metrics за [date_from, date_to].
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT date
+            FROM daily_metrics
+            WHERE account = ? AND marketplace = ? AND date BETWEEN ? AND ?
+            ORDER BY date;
+            """,
+            (_acc(account), mp, date_from, date_to)
+        )
+        return [r[0] for r in cur.fetchall()]
+
+def get_metrics_for_date(
+    mp: str,
+    date: str,
+    account: Optional[str] = None
+) -> Optional[Tuple[str, int, int, int, Optional[float]]]:
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT date, impressions, clicks, orders, ad_spend
+            FROM daily_metrics
+            WHERE account = ? AND marketplace = ? AND date = ?;
+            """,
+            (_acc(account), mp, date)
+        )
+        return cur.fetchone()
+
+WindowTotals = Tuple[int, int, int, Optional[float], int]
+
+def get_window_totals(
+    mp: str,
+    date_from: str,
+    date_to: str,
+    account: Optional[str] = None
+) -> WindowTotals:
+    """
+    Суммы за окно [date_from, date_to]: (impressions, clicks, orders, ad_spend, days).
+    ad_spend=None — ни за один день окна затрат нет. Два поиска по metrics_cumulative, без скана дней.
+    """
+    acc = _acc(account)
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT COALESCE(b.impressions, 0) - COALESCE(a.impressions, 0),
+                   COALESCE(b.clicks, 0) - COALESCE(a.clicks, 0),
+                   COALESCE(b.orders, 0) - COALESCE(a.orders, 0),
+                   COALESCE(b.ad_spend, 0) - COALESCE(a.ad_spend, 0),
+                   COALESCE(b.spend_days, 0) - COALESCE(a.spend_days, 0),
+                   COALESCE(b.days, 0) - COALESCE(a.days, 0)
+            FROM (SELECT 1)
+            LEFT JOIN (
+                SELECT * FROM metrics_cumulative
+                WHERE account = :acc AND marketplace = :mp AND date <= :to
+                ORDER BY date DESC LIMIT 1
+            ) b ON 1
+            LEFT JOIN (
+                SELECT * FROM metrics_cumulative
+                WHERE account = :acc AND marketplace = :mp AND date < :from
+                ORDER BY date DESC LIMIT 1
+            ) a ON 1;
+            """,
+            {"acc": acc, "mp": mp, "from": date_from, "to": date_to}
+        )
+        imp, clk, ords, spend, spend_days, days = cur.fetchone()
+        return imp, clk, ords, (spend if spend_days else None), days
+
+def get_rollups(
+    mp: str,
+    grain: str,
+    n: int,
+    account: Optional[str] = None
+) -> List[Tuple[str, int, int, int, Optional[float], int]]:
+    """
+    Последние n недель (grain='W') или месяцев ('M') по возрастанию:
+    (period, impressions, clicks, orders, ad_spend, days). days < 7 — неполная неделя.
+    """
+    if grain not in _ROLLUP_GRAINS:
+        raise ValueError(f"Unknown rollup grain: {grain}")
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT period, impressions, clicks, orders,
+                   CASE WHEN spend_days > 0 THEN ad_spend END, days
+            FROM metrics_rollup
+            WHERE account = ? AND marketplace = ? AND grain = ?
+            ORDER BY period DESC
+            LIMIT ?;
+            """,
+            (_acc(account), mp, grain, n)
+        )
+        return list(reversed(cur.fetchall()))
+
+def _day_key(date: str) -> int:
+    # "2026-10-16" -> 20261016
+    return int(date.replace("-", ""))
+
+def _day_str(day: int) -> str:
+    s = str(day)
+    return f"{s[:4]}-{s[4:6]}-{s[6:]}"
+
+NM_METRICS = ("clicks", "orders")
+
+def upsert_nm_metrics(rows: Iterable[Tuple[str, int, int, int]], account: Optional[str] = None) -> int:
+    """
+    rows: (date, nm_id, clicks, orders).
+    Дни, которые есть в rows, перезаписываются целиком (артикул мог пропасть из отчёта).
+    Всё одной транзакцией через executemany. Возвращает число записанных строк.
+    """
+    acc = _acc(account)
+    data = [(acc, _day_key(date), int(nm_id), int(clicks), int(orders)) for date, nm_id, clicks, orders in rows]
+    if not data:
+        return 0
+    days = sorted({r[1] for r in data})
+    instrument.count("storage.rows", len(data), table="daily_nm_metrics")
+    with instrument.span("storage.write", table="daily_nm_metrics"), _connect() as conn:
+        conn.executemany(
+            "DELETE FROM daily_nm_metrics WHERE account = ? AND day = ?;",
+            [(acc, d) for d in days]
+        )
+        conn.executemany(
+            """
+            INSERT INTO daily_nm_metrics (account, day, nm_id, clicks, orders)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(account, day, nm_id) DO UPDATE SET
+                clicks=excluded.clicks,
+                orders=excluded.orders;
+            """,
+            data
+        )
+    return len(data)
+
+def get_top_nm_deltas(
+    date_cur: str,
+    date_prev: str,
+    metric: str = "orders",
+    n: int = 10,
+    drops: bool = True,
+    account: Optional[str] = None
+) -> List[Tuple[int, int, int, int]]:
+    """
+    Топ-N артикулов по изменению metric между двумя днями: (nm_id, cur, prev, delta).
+    drops=True — сначала самые большие падения, иначе — самые большие росты.
+    Читаются только два дня (диапазоны по первичному ключу), не вся таблица.
+    """
+    if metric not in NM_METRICS:
+        raise ValueError(f"Unknown nm metric: {metric}")
+    order = "ASC" if drops else "DESC"
+    with _connect() as conn:
+        cur = conn.execute(
+            f"""
+            SELECT nm_id, cur, prev, cur - prev AS delta
+            FROM (
+                SELECT nm_id,
+                       SUM(CASE WHEN day = :cur THEN {metric} ELSE 0 END) AS cur,
+                       SUM(CASE WHEN day = :prev THEN {metric} ELSE 0 END) AS prev
+                FROM daily_nm_metrics
+                WHERE account = :acc AND day IN (:cur, :prev)
+                GROUP BY nm_id
+            )
+            WHERE delta != 0
+            ORDER BY delta {order}, nm_id
+            LIMIT :n;
+            """,
+            {"acc": _acc(account), "cur": _day_key(date_cur), "prev": _day_key(date_prev), "n": n}
+        )
+        return cur.fetchall()
+
+NM_GROUP_FIELDS = ("brand", "subject_name")
+
+def get_group_daily(
+    field: str,
+    date_from: str,
+    date_to: str,
+    top_n: int,
+    account: Optional[str] = None
+) -> List[Tuple[str, str, int, int]]:
+    """
+    По дням для top_n значений field (brand / subject_name) с наибольшими переходами за окно:
+    (group, date, clicks, orders), по группе и дате. Артикулы без карточки в wb_cards не попадают.
+    """
+    if field not in NM_GROUP_FIELDS:
+        raise ValueError(f"Unknown group field: {field}")
+    with _connect() as conn:
+        cur = conn.execute(
+            f"""
+            WITH m AS (
+                SELECT c.{field} AS g, m.day, m.clicks, m.orders
+                FROM daily_nm_metrics m
+                JOIN wb_cards c ON c.account = m.account AND c.nm_id = m.nm_id
+                WHERE m.account = :acc AND m.day BETWEEN :from AND :to
+                  AND c.{field} IS NOT NULL AND c.{field} != ''
+            ),
+            top AS (
+                SELECT g FROM m GROUP BY g ORDER BY SUM(clicks) DESC, g LIMIT :n
+            )
+            SELECT g, day, SUM(clicks), SUM(orders)
+            FROM m
+            WHERE g IN (SELECT g FROM top)
+            GROUP BY g, day
+            ORDER BY g, day;
+            """,
+            {"acc": _acc(account), "from": _day_key(date_from), "to": _day_key(date_to), "n": top_n}
+        )
+        return [(g, _day_str(d), c, o) for g, d, c, o in cur.fetchall()]
+
+def get_top_nm(
+    date_from: str,
+    date_to: str,
+    n: int = 15,
+    account: Optional[str] = None
+) -> List[Tuple[int, Optional[str], int, int]]:
+    """
+    Топ-N артикулов по заказам за окно: (nm_id, vendor_code, clicks, orders).
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT m.nm_id, c.vendor_code, SUM(m.clicks), SUM(m.orders)
+            FROM daily_nm_metrics m
+            LEFT JOIN wb_cards c ON c.account = m.account AND c.nm_id = m.nm_id
+            WHERE m.account = ? AND m.day BETWEEN ? AND ?
+            GROUP BY m.nm_id
+            ORDER BY SUM(m.orders) DESC, SUM(m.clicks) DESC, m.nm_id
+            LIMIT ?;
+            """,
+            (_acc(account), _day_key(date_from), _day_key(date_to), n)
+        )
+        return cur.fetchall()
+
+def get_nm_days(days: Iterable[str], account: Optional[str] = None) -> List[Tuple[int, int, int, int]]:
+    """
+    Все артикулы за перечисленные дни: (day, nm_id, clicks, orders), day — целое YYYYMMDD
+    (как в таблице: строки сразу идут в numpy, без разбора дат). Читаются только эти дни.
+    """
+    keys = sorted({_day_key(d) for d in days})
+    if not keys:
+        return []
+    with _connect() as conn:
+        cur = conn.execute(
+            f"""
+            SELECT day, nm_id, clicks, orders
+            FROM daily_nm_metrics
+            WHERE account = ? AND day IN ({", ".join("?" * len(keys))});
+            """,
+            (_acc(account), *keys)
+        )
+        return cur.fetchall()
+
+def get_vendor_codes(nm_ids: Iterable[int], account: Optional[str] = None) -> Dict[int, str]:
+    ids = [int(nm) for nm in nm_ids]
+    if not ids:
+        return {}
+    with _connect() as conn:
+        cur = conn.execute(
+            f"""
+            SELECT nm_id, vendor_code FROM wb_cards
+            WHERE account = ? AND nm_id IN ({", ".join("?" * len(ids))}) AND vendor_code IS NOT NULL;
+            """,
+            (_acc(account), *ids)
+        )
+        return dict(cur.fetchall())
+
+def get_nm_history(
+    nm_id: int,
+    date_from: str,
+    date_to: str,
+    account: Optional[str] = None
+) -> List[Tuple[str, int, int]]:
+    """
+    (date, clicks, orders) одного артикула по возрастанию даты — только по покрывающему индексу.
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT day, clicks, orders
+            FROM daily_nm_metrics
+            WHERE account = ? AND nm_id = ? AND day BETWEEN ? AND ?
+            ORDER BY day;
+            """,
+            (_acc(account), nm_id, _day_key(date_from), _day_key(date_to))
+        )
+        return [(_day_str(d), c, o) for d, c, o in cur.fetchall()]
+
+def add_report_job(download_id: str, report_key: str, created_at: float, account: Optional[str] = None) -> None:
+    with _connect() as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO wb_report_jobs (download_id, report_key, status, created_at, account)
+            VALUES (?, ?, 'PENDING', ?, ?);
+            """,
+            (download_id, report_key, created_at, _acc(account))
+        )
+
+def find_pending_report_job(
+    report_key: str,
+    min_created_at: float,
+    account: Optional[str] = None
+) -> Optional[Tuple[str, str, float]]:
+    """
+    Последний незавершённый (PENDING/SUCCESS, но не скачанный) отчёт с таким ключом,
+    заказанный не раньше min_created_at: (download_id, status, created_at).
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT download_id, status, created_at
+            FROM wb_report_jobs
+            WHERE account = ? AND report_key = ? AND status IN ('PENDING', 'SUCCESS') AND created_at >= ?
+            ORDER BY created_at DESC
+            LIMIT 1;
+            """,
+            (_acc(account), report_key, min_created_at)
+        )
+        return cur.fetchone()
+
+def set_report_job_status(
+    download_id: str,
+    status: str,
+    ready_at: Optional[float] = None,
+    path: Optional[str] = None
+) -> None:
+    with _connect() as conn:
+        conn.execute(
+            """
+            UPDATE wb_report_jobs
+            SET status = ?,
+                ready_at = COALESCE(ready_at, ?),
+                path = COALESCE(?, path)
+            WHERE download_id = ?;
+            """,
+            (status, ready_at, path, download_id)
+        )
+
+def get_report_generation_times(limit: int = 20) -> List[float]:
+    """
+    Сколько секунд генерировались последние limit отчётов (created -> первый увиденный SUCCESS).
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT ready_at - created_at
+            FROM wb_report_jobs
+            WHERE ready_at IS NOT NULL
+            ORDER BY created_at DESC
+            LIMIT ?;
+            """,
+            (limit,)
+        )
+        return [r[0] for r in cur.fetchall()]
+
+ArchiveSlice = Tuple[str, str, int, int, int]
+
+def archive_put_slices(
+    slices: Iterable[ArchiveSlice],
+    window_end: str,
+    fetched_at: float,
+    account: Optional[str] = None
+) -> Tuple[int, int]:
+    """
+    slices: (day, sha256, rows, raw_bytes, stored_bytes) из одного отчёта за окно до window_end.
+    Срез становится текущей версией дня, прошлая версия помечается superseded_at.
+    Срез из более старого отчёта, чем текущая версия, не записывается (импорт старых файлов).
+    Возвращает (новых версий, совпавших с уже известными).
+    """
+    acc = _acc(account)
+    new = same = 0
+    with _connect() as conn:
+        for day, sha, rows, raw_bytes, stored_bytes in slices:
+            cur = conn.execute(
+                "SELECT sha256, window_end FROM report_archive WHERE account = ? AND day = ? AND superseded_at IS NULL;",
+                (acc, day)
+            ).fetchone()
+            if cur and cur[0] != sha and cur[1] > window_end:
+                continue
+            known = conn.execute(
+                "SELECT 1 FROM report_archive WHERE account = ? AND day = ? AND sha256 = ?;",
+                (acc, day, sha)
+            ).fetchone()
+            if known:
+                same += 1
+            else:
+                new += 1
+            conn.execute(
+                """
+                UPDATE report_archive SET superseded_at = ?
+                WHERE account = ? AND day = ? AND sha256 != ? AND superseded_at IS NULL;
+                """,
+                (fetched_at, acc, day, sha)
+            )
+            conn.execute(
+                """
+                INSERT INTO report_archive (account, day, sha256, rows, raw_bytes, stored_bytes,
+                                            window_end, fetched_at, superseded_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL)
+                ON CONFLICT(account, day, sha256) DO UPDATE SET
+                    window_end = max(window_end, excluded.window_end),
+                    fetched_at = excluded.fetched_at,
+                    superseded_at = NULL;
+                """,
+                (acc, day, sha, rows, raw_bytes, stored_bytes, window_end, fetched_at)
+            )
+    return new, same
+
+def archive_get_current(
+    date_from: str,
+    date_to: str,
+    account: Optional[str] = None
+) -> List[Tuple[str, str, str, int]]:
+    """
+    Текущие срезы за [date_from, date_to]: (day, sha256, window_end, rows) по возрастанию дня.
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT day, sha256, window_end, rows
+            FROM report_archive
+            WHERE account = ? AND day BETWEEN ? AND ? AND superseded_at IS NULL
+            ORDER BY day;
+            """,
+            (_acc(account), date_from, date_to)
+        )
+        return cur.fetchall()
+
+def archive_expire(min_day: Optional[str], superseded_before: float, account: Optional[str] = None) -> int:
+    """
+    Retention: удалить записи о днях раньше min_day (None — хранить все дни)
+    и о версиях, вытесненных раньше superseded_before. Возвращает число удалённых записей.
+    """
+    acc = _acc(account)
+    with _connect() as conn:
+        n = conn.execute(
+            "DELETE FROM report_archive WHERE account = ? AND superseded_at < ?;",
+            (acc, superseded_before)
+        ).rowcount
+        if min_day:
+            n += conn.execute(
+                "DELETE FROM report_archive WHERE account = ? AND day < ?;",
+                (acc, min_day)
+            ).rowcount
+        return n
+
+def archive_get_hashes(account: Optional[str] = None) -> set:
+    with _connect() as conn:
+        cur = conn.execute("SELECT DISTINCT sha256 FROM report_archive WHERE account = ?;", (_acc(account),))
+        return {r[0] for r in cur.fetchall()}
+
+def archive_get_stats(account: Optional[str] = None) -> Tuple[int, int, int, int, int, Optional[str], Optional[str]]:
+    """
+    (дней, версий, файлов, байт до сжатия, байт на диске, первый день, последний день).
+    Одинаковые срезы (например, пустые дни) лежат одним файлом — байты считаем по файлам.
+    """
+    acc = _acc(account)
+    with _connect() as conn:
+        days, versions, first, last = conn.execute(
+            """
+            SELECT COUNT(DISTINCT day), COUNT(*), MIN(day), MAX(day)
+            FROM report_archive WHERE account = ?;
+            """,
+            (acc,)
+        ).fetchone()
+        objects, raw_bytes, stored_bytes = conn.execute(
+            """
+            SELECT COUNT(*), COALESCE(SUM(raw_bytes), 0), COALESCE(SUM(stored_bytes), 0)
+            FROM (SELECT sha256, MAX(raw_bytes) AS raw_bytes, MAX(stored_bytes) AS stored_bytes
+                  FROM report_archive WHERE account = ? GROUP BY sha256);
+            """,
+            (acc,)
+        ).fetchone()
+        return days, versions, objects, raw_bytes, stored_bytes, first, last
+
+def backfill_add_windows(windows: Iterable[Tuple[str, str]], account: Optional[str] = None) -> None:
+    acc = _acc(account)
+    with _connect() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO backfill_windows (account, start, end) VALUES (?, ?, ?);",
+            [(acc, s, e) for s, e in windows]
+        )
+
+def backfill_get_windows(
+    date_from: str,
+    date_to: str,
+    account: Optional[str] = None
+) -> List[Tuple[str, str, str, int, Optional[int], Optional[str]]]:
+    """
+    Окна бэкфилла, пересекающиеся с [date_from, date_to]: (start, end, status, attempts, days, error).
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT start, end, status, attempts, days, error
+            FROM backfill_windows
+            WHERE account = ? AND start <= ? AND end >= ?
+            ORDER BY start, end;
+            """,
+            (_acc(account), date_to, date_from)
+        )
+        return cur.fetchall()
+
+def backfill_set_status(
+    start: str,
+    end: str,
+    status: str,
+    now: float,
+    days: Optional[int] = None,
+    rows: Optional[int] = None,
+    source: Optional[str] = None,
+    error: Optional[str] = None,
+    account: Optional[str] = None
+) -> None:
+    with _connect() as conn:
+        conn.execute(
+            """
+            UPDATE backfill_windows
+            SET status = ?,
+                attempts = attempts + 1,
+                days = COALESCE(?, days),
+                rows = COALESCE(?, rows),
+                source = COALESCE(?, source),
+                error = ?,
+                updated_at = ?
+            WHERE account = ? AND start = ? AND end = ?;
+            """,
+            (status, days, rows, source, error, now, _acc(account), start, end)
+        )
+
+def update_ad_spend(spend: Dict[str, float], marketplace: str = "wb", account: Optional[str] = None) -> int:
+    """
+    Проставить затраты уже записанным дням daily_metrics (дни, которых в spend нет, не трогаем).
+    Пишем только изменившиеся — триггеры агрегатов срабатывают на каждый UPDATE.
+    """
+    acc = _acc(account)
+    with _connect() as conn:
+        cur = conn.executemany(
+            """
+            UPDATE daily_metrics SET ad_spend = ?
+            WHERE account = ? AND date = ? AND marketplace = ? AND ad_spend IS NOT ?;
+            """,
+            [(s, acc, dt, marketplace, s) for dt, s in spend.items()]
+        )
+        return cur.rowcount
+
+AdsSpendRow = Tuple[str, int, float, int]
+
+def ads_put_days(
+    days: Iterable[str],
+    rows: Iterable[AdsSpendRow],
+    closed: Iterable[str],
+    now: float,
+    account: Optional[str] = None
+) -> int:
+    """
+    Загруженные дни: rows — (date, advert_id, spend, updates). Дни из days перезаписываются
+    целиком (день без строк — реальный ноль), закрытые (closed) больше не перезапрашиваются.
+    """
+    acc = _acc(account)
+    closed = {_day_key(d) for d in closed}
+    day_keys = sorted({_day_key(d) for d in days})
+    data = [(acc, _day_key(d), int(a), float(s), int(n)) for d, a, s, n in rows]
+    instrument.count("storage.rows", len(data), table="ads_spend")
+    with instrument.span("storage.write", table="ads_spend"), _connect() as conn:
+        conn.executemany("DELETE FROM ads_spend WHERE account = ? AND day = ?;", [(acc, d) for d in day_keys])
+        conn.executemany(
+            "INSERT OR REPLACE INTO ads_spend (account, day, advert_id, spend, updates) VALUES (?, ?, ?, ?, ?);",
+            data
+        )
+        conn.executemany(
+            """
+            INSERT INTO ads_days (account, day, closed, fetched_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(account, day) DO UPDATE SET
+                closed=MAX(closed, excluded.closed),
+                fetched_at=excluded.fetched_at;
+            """,
+            [(acc, d, int(d in closed), now) for d in day_keys]
+        )
+    return len(data)
+
+def ads_get_fresh_days(date_from: str, date_to: str, fetched_after: float, account: Optional[str] = None) -> set:
+    """
+    Дни [date_from, date_to], которые не надо спрашивать у WB: закрытые или загруженные после fetched_after.
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT day FROM ads_days
+            WHERE account = ? AND day BETWEEN ? AND ? AND (closed = 1 OR fetched_at >= ?);
+            """,
+            (_acc(account), _day_key(date_from), _day_key(date_to), fetched_after)
+        )
+        return {_day_str(r[0]) for r in cur.fetchall()}
+
+def ads_get_spend_by_day(date_from: str, date_to: str, account: Optional[str] = None) -> List[Tuple[str, float]]:
+    """
+    (date, spend) по загруженным дням окна; день без списаний — 0.0, незагруженных дней нет.
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT d.day, COALESCE(SUM(s.spend), 0.0)
+            FROM ads_days d
+            LEFT JOIN ads_spend s ON s.account = d.account AND s.day = d.day
+            WHERE d.account = ? AND d.day BETWEEN ? AND ?
+            GROUP BY d.day
+            ORDER BY d.day;
+            """,
+            (_acc(account), _day_key(date_from), _day_key(date_to))
+        )
+        return [(_day_str(d), s) for d, s in cur.fetchall()]
+
+def ads_note_campaigns(rows: Iterable[Tuple[int, Optional[str], Optional[int]]], account: Optional[str] = None) -> None:
+    """
+    Кампании, встреченные в списаниях: (advert_id, name, type). Новые заводим (updated_at NULL —
+    ещё не читали promotion/adverts), у известных только освежаем имя и тип.
+    """
+    acc = _acc(account)
+    with _connect() as conn:
+        conn.executemany(
+            """
+            INSERT INTO ads_campaigns (account, advert_id, name, type) VALUES (?, ?, ?, ?)
+            ON CONFLICT(account, advert_id) DO UPDATE SET
+                name=COALESCE(excluded.name, name),
+                type=COALESCE(excluded.type, type);
+            """,
+            [(acc, int(a), name, t) for a, name, t in rows]
+        )
+
+def ads_get_stale_campaigns(
+    date_from: str,
+    date_to: str,
+    updated_before: float,
+    account: Optional[str] = None
+) -> List[int]:
+    """
+    Кампании со списаниями в окне, которые не читали из promotion/adverts с updated_before.
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT DISTINCT s.advert_id
+            FROM ads_spend s
+            LEFT JOIN ads_campaigns c ON c.account = s.account AND c.advert_id = s.advert_id
+            WHERE s.account = ? AND s.day BETWEEN ? AND ?
+              AND (c.updated_at IS NULL OR c.updated_at < ?)
+            ORDER BY s.advert_id;
+            """,
+            (_acc(account), _day_key(date_from), _day_key(date_to), updated_before)
+        )
+        return [r[0] for r in cur.fetchall()]
+
+def ads_upsert_campaigns(
+    rows: Iterable[Tuple[int, Optional[str], Optional[int], Optional[int]]],
+    nms: Dict[int, List[int]],
+    now: float,
+    account: Optional[str] = None
+) -> int:
+    """
+    rows: (advert_id, name, type, status) из promotion/adverts; nms — артикулы кампаний,
+    список артикулов кампании перезаписывается целиком.
+    """
+    acc = _acc(account)
+    data = [(acc, int(a), name, t, st, now) for a, name, t, st in rows]
+    with _connect() as conn:
+        conn.executemany(
+            """
+            INSERT INTO ads_campaigns (account, advert_id, name, type, status, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(account, advert_id) DO UPDATE SET
+                name=COALESCE(excluded.name, name),
+                type=COALESCE(excluded.type, type),
+                status=excluded.status,
+                updated_at=excluded.updated_at;
+            """,
+            data
+        )
+        conn.executemany(
+            "DELETE FROM ads_campaign_nms WHERE account = ? AND advert_id = ?;",
+            [(acc, int(a)) for a in nms]
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO ads_campaign_nms (account, advert_id, nm_id) VALUES (?, ?, ?);",
+            [(acc, int(a), int(nm)) for a, ids in nms.items() for nm in ids]
+        )
+    return len(data)
+
+def ads_get_campaign_cpo(
+    date_from: str,
+    date_to: str,
+    account: Optional[str] = None
+) -> List[Tuple[int, Optional[str], float, int, Optional[int], Optional[int]]]:
+    """
+    Кампании за окно по убыванию затрат: (advert_id, name, spend, days, clicks, orders).
+    clicks / orders — все переходы и заказы артикулов кампании (daily_nm_metrics);
+    None — артикулы кампании неизвестны.
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            WITH sp AS (
+                SELECT advert_id, SUM(spend) AS spend, COUNT(*) AS days
+                FROM ads_spend
+                WHERE account = :acc AND day BETWEEN :from AND :to
+                GROUP BY advert_id
+            ),
+            m AS (
+                SELECT cn.advert_id, SUM(COALESCE(m.clicks, 0)) AS clicks, SUM(COALESCE(m.orders, 0)) AS orders
+                FROM ads_campaign_nms cn
+                LEFT JOIN daily_nm_metrics m
+                       ON m.account = cn.account AND m.nm_id = cn.nm_id AND m.day BETWEEN :from AND :to
+                WHERE cn.account = :acc AND cn.advert_id IN (SELECT advert_id FROM sp)
+                GROUP BY cn.advert_id
+            )
+            SELECT sp.advert_id, c.name, sp.spend, sp.days, m.clicks, m.orders
+            FROM sp
+            LEFT JOIN ads_campaigns c ON c.account = :acc AND c.advert_id = sp.advert_id
+            LEFT JOIN m ON m.advert_id = sp.advert_id
+            ORDER BY sp.spend DESC, sp.advert_id;
+            """,
+            {"acc": _acc(account), "from": _day_key(date_from), "to": _day_key(date_to)}
+        )
+        return cur.fetchall()
+
+def ads_get_nm_cpo(
+    date_from: str,
+    date_to: str,
+    n: int = 15,
+    account: Optional[str] = None
+) -> List[Tuple[int, Optional[str], float, int, int]]:
+    """
+    Топ-N артикулов по затратам за окно: (nm_id, vendor_code, spend, clicks, orders).
+    Списание кампании за день делится между её артикулами пропорционально их переходам
+    в этот день (нет переходов — поровну). Кампании с неизвестными артикулами не попадают.
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            WITH w AS (
+                SELECT s.day, s.advert_id, s.spend, cn.nm_id, COALESCE(m.clicks, 0) AS clicks
+                FROM ads_spend s
+                JOIN ads_campaign_nms cn ON cn.account = s.account AND cn.advert_id = s.advert_id
+                LEFT JOIN daily_nm_metrics m ON m.account = s.account AND m.day = s.day AND m.nm_id = cn.nm_id
+                WHERE s.account = :acc AND s.day BETWEEN :from AND :to
+            ),
+            a AS (
+                SELECT nm_id,
+                       CASE WHEN SUM(clicks) OVER p > 0 THEN spend * clicks / SUM(clicks) OVER p
+                            ELSE spend / COUNT(*) OVER p END AS spend
+                FROM w
+                WINDOW p AS (PARTITION BY day, advert_id)
+            ),
+            sp AS (
+                SELECT nm_id, SUM(spend) AS spend FROM a GROUP BY nm_id ORDER BY SUM(spend) DESC, nm_id LIMIT :n
+            )
+            SELECT sp.nm_id, c.vendor_code, sp.spend,
+                   (SELECT COALESCE(SUM(clicks), 0) FROM daily_nm_metrics m
+                    WHERE m.account = :acc AND m.nm_id = sp.nm_id AND m.day BETWEEN :from AND :to),
+                   (SELECT COALESCE(SUM(orders), 0) FROM daily_nm_metrics m
+                    WHERE m.account = :acc AND m.nm_id = sp.nm_id AND m.day BETWEEN :from AND :to)
+            FROM sp
+            LEFT JOIN wb_cards c ON c.account = :acc AND c.nm_id = sp.nm_id
+            ORDER BY sp.spend DESC, sp.nm_id;
+            """,
+            {"acc": _acc(account), "from": _day_key(date_from), "to": _day_key(date_to), "n": n}
+        )
+        return cur.fetchall()
+
+def get_sync_state(key: str) -> Optional[str]:
+    with _connect() as conn:
+        row = conn.execute("SELECT value FROM sync_state WHERE key = ?;", (key,)).fetchone()
+        return row[0] if row else None
+
+def set_sync_state(key: str, value: Optional[str]) -> None:
+    with _connect() as conn:
+        conn.execute(
+            """
+            INSERT INTO sync_state (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value=excluded.value;
+            """,
+            (key, value)
+        )
+
+CardRow = Tuple[int, Optional[int], Optional[str], Optional[int], Optional[str], Optional[str], Optional[str], Optional[str]]
+
+def upsert_cards(rows: Iterable[CardRow], seen_at: float, account: Optional[str] = None) -> int:
+    """
+    rows: (nm_id, imt_id, vendor_code, subject_id, subject_name, brand, title, updated_at).
+    Пришедшая карточка считается живой (deleted=0).
+    """
+    acc = _acc(account)
+    data = [(acc,) + tuple(r) + (seen_at,) for r in rows]
+    if not data:
+        return 0
+    with _connect() as conn:
+        conn.executemany(
+            """
+            INSERT INTO wb_cards (account, nm_id, imt_id, vendor_code, subject_id, subject_name, brand, title, updated_at, deleted, seen_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?)
+            ON CONFLICT(account, nm_id) DO UPDATE SET
+                imt_id=excluded.imt_id,
+                vendor_code=excluded.vendor_code,
+                subject_id=excluded.subject_id,
+                subject_name=excluded.subject_name,
+                brand=excluded.brand,
+                title=excluded.title,
+                updated_at=excluded.updated_at,
+                deleted=0,
+                seen_at=excluded.seen_at;
+            """,
+            data
+        )
+    return len(data)
+
+def mark_cards_deleted(nm_ids: Iterable[int], account: Optional[str] = None) -> None:
+    acc = _acc(account)
+    with _connect() as conn:
+        conn.executemany(
+            """
+            INSERT INTO wb_cards (account, nm_id, deleted) VALUES (?, ?, 1)
+            ON CONFLICT(account, nm_id) DO UPDATE SET deleted=1;
+            """,
+            [(acc, int(nm)) for nm in nm_ids]
+        )
+
+def mark_unseen_cards_deleted(seen_before: float, account: Optional[str] = None) -> int:
+    """
+    После полной синхронизации: всё, что не пришло (seen_at < seen_before), — удалено.
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            UPDATE wb_cards SET deleted = 1
+            WHERE account = ? AND deleted = 0 AND (seen_at IS NULL OR seen_at < ?);
+            """,
+            (_acc(account), seen_before)
+        )
+        return cur.rowcount
+
+def get_active_nm_ids(account: Optional[str] = None) -> List[int]:
+    with _connect() as conn:
+        cur = conn.execute(
+            "SELECT nm_id FROM wb_cards WHERE account = ? AND deleted = 0 ORDER BY nm_id;",
+            (_acc(account),)
+        )
+        return [r[0] for r in cur.fetchall()]
+
+OutboxRow = Tuple[int, str, str, List[str], int]
+
+def outbox_add(chat_id: str, text: str, photos: List[str], error: str, next_attempt_at: float, now: float) -> int:
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            INSERT INTO tg_outbox (chat_id, text, photos, attempts, created_at, next_attempt_at, last_error)
+            VALUES (?, ?, ?, 1, ?, ?, ?);
+            """,
+            (str(chat_id), text, json.dumps(photos, ensure_ascii=False), now, next_attempt_at, error)
+        )
+        return cur.lastrowid
+
+def outbox_due(now: float, limit: int = 50) -> List[OutboxRow]:
+    """
+    (id, chat_id, text, photos, attempts) — что пора переотправить, старые первыми.
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT id, chat_id, text, photos, attempts
+            FROM tg_outbox
+            WHERE status = 'PENDING' AND next_attempt_at <= ?
+            ORDER BY id
+            LIMIT ?;
+            """,
+            (now, limit)
+        )
+        return [(i, c, t, json.loads(p), a) for i, c, t, p, a in cur.fetchall()]
+
+def outbox_mark_sent(outbox_id: int, now: float) -> None:
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE tg_outbox SET status = 'SENT', sent_at = ? WHERE id = ?;",
+            (now, outbox_id)
+        )
+
+def outbox_mark_failed(outbox_id: int, error: str, next_attempt_at: Optional[float]) -> None:
+    """
+    next_attempt_at=None — попытки кончились, больше не трогаем (status=DEAD).
+    """
+    with _connect() as conn:
+        conn.execute(
+            """
+            UPDATE tg_outbox
+            SET attempts = attempts + 1,
+                last_error = ?,
+                status = CASE WHEN ? IS NULL THEN 'DEAD' ELSE status END,
+                next_attempt_at = COALESCE(?, next_attempt_at)
+            WHERE id = ?;
+            """,
+            (error, next_attempt_at, next_attempt_at, outbox_id)
+        )
+
+def add_subscription(chat_id: str, variant: str = "full", account: Optional[str] = None) -> None:
+    with _connect() as conn:
+        conn.execute(
+            """
+            INSERT INTO tg_subscriptions (account, chat_id, variant, active) VALUES (?, ?, ?, 1)
+            ON CONFLICT(account, chat_id, variant) DO UPDATE SET active=1;
+            """,
+            (_acc(account), str(chat_id), variant)
+        )
+
+def remove_subscription(chat_id: str, variant: Optional[str] = None, account: Optional[str] = None) -> int:
+    acc = _acc(account)
+    with _connect() as conn:
+        if variant is None:
+            cur = conn.execute(
+                "UPDATE tg_subscriptions SET active = 0 WHERE account = ? AND chat_id = ?;",
+                (acc, str(chat_id))
+            )
+        else:
+            cur = conn.execute(
+                "UPDATE tg_subscriptions SET active = 0 WHERE account = ? AND chat_id = ? AND variant = ?;",
+                (acc, str(chat_id), variant)
+            )
+        return cur.rowcount
+
+def get_subscriptions(account: Optional[str] = None) -> List[Tuple[str, str]]:
+    """
+    Активные подписки аккаунта: (chat_id, variant).
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT chat_id, variant FROM tg_subscriptions
+            WHERE account = ? AND active = 1
+            ORDER BY variant, chat_id;
+            """,
+            (_acc(account),)
+        )
+        return cur.fetchall()
+
+def get_brand_totals(date: str, brand: str, account: Optional[str] = None) -> Tuple[int, int]:
+    """
+    (clicks, orders) по артикулам бренда за день — из daily_nm_metrics + индекса карточек.
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT COALESCE(SUM(m.clicks), 0), COALESCE(SUM(m.orders), 0)
+            FROM daily_nm_metrics m
+            JOIN wb_cards c ON c.account = m.account AND c.nm_id = m.nm_id
+            WHERE m.account = ? AND m.day = ? AND c.brand = ?;
+            """,
+            (_acc(account), _day_key(date), brand)
+        )
+        return cur.fetchone()
+
+RUNS_KEEP = 2000  # столько последних запусков храним с замерами
+
+def save_run(
+    run_id: str,
+    command: str,
+    started_at: float,
+    finished_at: float,
+    ok: bool,
+    error: Optional[str],
+    spans: Iterable[Tuple[str, Dict[str, str], int, float, float]],
+    counters: Iterable[Tuple[str, Dict[str, str], float]]
+) -> None:
+    """
+    spans: (name, labels, calls, total_sec, max_sec); counters: (name, labels, value).
+    Старые запуски сверх RUNS_KEEP удаляются тут же.
+    """
+    lbl = lambda d: json.dumps(d, ensure_ascii=False, sort_keys=True)
+    with _connect() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO runs (run_id, command, started_at, finished_at, ok, error) VALUES (?, ?, ?, ?, ?, ?);",
+            (run_id, command, started_at, finished_at, int(ok), error)
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO run_spans (run_id, name, labels, calls, total_sec, max_sec) VALUES (?, ?, ?, ?, ?, ?);",
+            [(run_id, n, lbl(l), c, t, m) for n, l, c, t, m in spans]
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO run_counters (run_id, name, labels, value) VALUES (?, ?, ?, ?);",
+            [(run_id, n, lbl(l), v) for n, l, v in counters]
+        )
+        old = [r[0] for r in conn.execute(
+            "SELECT run_id FROM runs ORDER BY started_at DESC LIMIT -1 OFFSET ?;", (RUNS_KEEP,)
+        )]
+        if old:
+            conn.executemany("DELETE FROM run_spans WHERE run_id = ?;", [(r,) for r in old])
+            conn.executemany("DELETE FROM run_counters WHERE run_id = ?;", [(r,) for r in old])
+            conn.executemany("DELETE FROM runs WHERE run_id = ?;", [(r,) for r in old])
+
+def get_runs(n: int = 10) -> List[Tuple[str, str, float, float, int, Optional[str]]]:
+    """
+    Последние запуски: (run_id, command, started_at, finished_at, ok, error), новые первыми.
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            """
+            SELECT run_id, command, started_at, finished_at, ok, error
+            FROM runs ORDER BY started_at DESC LIMIT ?;
+            """,
+            (n,)
+        )
+        return cur.fetchall()
+
+def get_run_details(run_id: str) -> Tuple[List[Tuple[str, str, int, float, float]], List[Tuple[str, str, float]]]:
+    """
+    (spans, counters) запуска: spans — (name, labels, calls, total_sec, max_sec) по убыванию времени,
+    counters — (name, labels, value).
+    """
+    with _connect() as conn:
+        spans = conn.execute(
+            """
+            SELECT name, labels, calls, total_sec, max_sec FROM run_spans
+            WHERE run_id = ? ORDER BY total_sec DESC;
+            """,
+            (run_id,)
+        ).fetchall()
+        counters = conn.execute(
+            "SELECT name, labels, value FROM run_counters WHERE run_id = ? ORDER BY name, labels;",
+            (run_id,)
+        ).fetchall()
+        return spans, counters
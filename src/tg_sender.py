@@ -1,11 +1,146 @@
-from telegram import Bot
-from src.config import TG_BOT_TOKEN, TG_CHAT_ID
+import os
+import time
+import threading
+from contextlib import ExitStack
+from typing import Dict, List, Optional
 
-def send_message(text: str):
-    bot = Bot(token=TG_BOT_TOKEN)
-    bot.send_message(chat_id=TG_CHAT_ID, text=text, parse_mode="Markdown")
+from telegram import Bot, InputMediaPhoto
+from telegram.utils.request import Request
 
-def send_photo(photo_path: str, caption: str = ""):
-    bot = Bot(token=TG_BOT_TOKEN)
+from src import instrument, storage
+from src.config import TG_BOT_TOKEN, TG_CHAT_ID, require_bot_token
+from src.ratelimit import TokenBucket
+
+CAPTION_LIMIT = 1024       # лимит подписи к фото/альбому в Telegram
+MEDIA_GROUP_LIMIT = 10     # максимум фото в одном альбоме
+
+# outbox: 1 мин, 2, 4, ... но не реже раза в 2 часа; после OUTBOX_MAX_ATTEMPTS — сдаёмся
+OUTBOX_BACKOFF_BASE_SEC = 60
+OUTBOX_BACKOFF_MAX_SEC = 2 * 3600
+OUTBOX_MAX_ATTEMPTS = 12
+
+# лимиты Telegram Bot API: ~30 сообщений/с на бота, 1/с в личный чат, 20/мин в группу.
+# Фото альбома считаются отдельными сообщениями.
+GLOBAL_RATE = (30.0, 30)
+PRIVATE_CHAT_RATE = (1.0, 1)
+GROUP_CHAT_RATE = (20 / 60, 10)
+
+_lock = threading.Lock()
+_bot: Optional[Bot] = None
+_global_bucket = TokenBucket(*GLOBAL_RATE)
+_chat_buckets: Dict[str, TokenBucket] = {}
+
+
+def _throttle(chat_id: str, messages: int = 1) -> None:
+    chat_id = str(chat_id)
+    with _lock:
+        b = _chat_buckets.get(chat_id)
+        if b is None:
+            rate = GROUP_CHAT_RATE if chat_id.startswith("-") else PRIVATE_CHAT_RATE
+            b = _chat_buckets[chat_id] = TokenBucket(*rate)
+    b.acquire(min(messages, b.capacity))
+    _global_bucket.acquire(min(messages, _global_bucket.capacity))
+
+
+def bot() -> Bot:
+    """
+    Один Bot (и пул HTTP-соединений) на процесс.
+    """
+    global _bot
+    with _lock:
+        if _bot is None:
+            require_bot_token()
+            _bot = Bot(token=TG_BOT_TOKEN, request=Request(con_pool_size=8))
+        return _bot
+
+
+def send_message(text: str, chat_id: Optional[str] = None):
+    chat_id = chat_id or TG_CHAT_ID
+    _throttle(chat_id)
+    return bot().send_message(chat_id=chat_id, text=text, parse_mode="Markdown")
+
+
+def send_photo(photo_path: str, caption: str = "", chat_id: Optional[str] = None):
+    chat_id = chat_id or TG_CHAT_ID
+    _throttle(chat_id)
     with open(photo_path, "rb") as f:
-        bot.send_photo(chat_id=TG_CHAT_ID, photo=f, caption=caption)
+        return bot().send_photo(chat_id=chat_id, photo=f, caption=caption)
+
+
+@instrument.span("tg.deliver")
+def deliver(chat_id: str, text: str, photos: List[str], file_ids: Optional[List[str]] = None) -> List[str]:
+    """
+    Сводка + графики одним альбомом (сводка — подписью к первому фото).
+    Если подпись не влезает в лимит Telegram — сначала текст отдельным сообщением.
+    file_ids — уже загруженные в Telegram те же картинки (из прошлой отправки):
+    тогда файлы повторно не заливаем. Возвращает file_id отправленных фото.
+    Пропавшие файлы (вычищены из out/charts) пропускаем — текст важнее.
+    """
+    media_src = list(file_ids) if file_ids else [p for p in photos if os.path.exists(p)]
+    instrument.count("tg.messages", (1 if len(text) > CAPTION_LIMIT or not media_src else 0) + len(media_src))
+    if not file_ids:
+        instrument.count("tg.upload_bytes", sum(os.path.getsize(p) for p in media_src))
+    if not media_src:
+        if text:
+            send_message(text, chat_id=chat_id)
+        return []
+
+    caption = text
+    if len(text) > CAPTION_LIMIT:
+        send_message(text, chat_id=chat_id)
+        caption = ""
+    parse_mode = "Markdown" if caption else None
+
+    if len(media_src) == 1:
+        # альбом из одного фото Telegram не принимает
+        _throttle(chat_id)
+        with ExitStack() as stack:
+            photo = media_src[0] if file_ids else stack.enter_context(open(media_src[0], "rb"))
+            msg = bot().send_photo(chat_id=chat_id, photo=photo, caption=caption, parse_mode=parse_mode)
+        return [msg.photo[-1].file_id] if msg and msg.photo else []
+
+    out = []
+    for i in range(0, len(media_src), MEDIA_GROUP_LIMIT):
+        batch = media_src[i:i + MEDIA_GROUP_LIMIT]
+        _throttle(chat_id, len(batch))
+        with ExitStack() as stack:
+            media = [
+                InputMediaPhoto(
+                    media=m if file_ids else stack.enter_context(open(m, "rb")),
+                    caption=caption if (i == 0 and j == 0 and caption) else None,
+                    parse_mode=parse_mode if (i == 0 and j == 0) else None,
+                )
+                for j, m in enumerate(batch)
+            ]
+            msgs = bot().send_media_group(chat_id=chat_id, media=media)
+        out.extend(m.photo[-1].file_id for m in (msgs or []) if m.photo)
+    return out
+
+
+def enqueue(chat_id: str, text: str, photos: List[str], error: Exception) -> None:
+    now = time.time()
+    storage.outbox_add(chat_id, text, photos, repr(error), now + _backoff(1), now)
+    instrument.count("tg.outbox_enqueued")
+    print(f"Telegram delivery to {chat_id} failed, queued to outbox: {error!r}")
+
+
+def _backoff(attempts: int) -> float:
+    return min(OUTBOX_BACKOFF_BASE_SEC * (2 ** max(attempts - 1, 0)), OUTBOX_BACKOFF_MAX_SEC)
+
+
+def flush_outbox(limit: int = 50) -> int:
+    """
+    Переотправить то, что не ушло раньше и чьё время пришло. Возвращает число доставленных.
+    """
+    sent = 0
+    for outbox_id, chat_id, text, photos, attempts in storage.outbox_due(time.time(), limit):
+        instrument.count("tg.outbox_retries")
+        try:
+            deliver(chat_id, text, photos)
+        except Exception as e:
+            retry_at = None if attempts + 1 >= OUTBOX_MAX_ATTEMPTS else time.time() + _backoff(attempts + 1)
+            storage.outbox_mark_failed(outbox_id, repr(e), retry_at)
+            continue
+        storage.outbox_mark_sent(outbox_id, time.time())
+        sent += 1
+    return sent
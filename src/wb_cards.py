@@ -0,0 +1,128 @@
+"""
+Локальный индекс карточек WB (Content API) вместо data/wb_nm_ids.json.
+
+Content API отдаёт карточки курсором, отсортированными по updatedAt. Запоминаем
+последний курсор (updatedAt, nmID) и в следующий раз начинаем с него — приходят
+только изменённые с прошлой синхронизации карточки (обычно 1 запрос вместо сотен).
+Корзину (trash) читаем целиком — она маленькая; раз в CARDS_FULL_RESYNC_DAYS
+проходим каталог полностью, чтобы поймать карточки, удалённые совсем.
+"""
+import json
+import time
+from typing import List, Optional
+
+from src import accounts, instrument, storage, wb_http
+from src.config import WB_CONTENT_BASE
+
+CONTENT_BASE = WB_CONTENT_BASE
+
+PAGE_LIMIT = 100
+CARDS_SYNC_MIN_INTERVAL_SEC = 10 * 60   # чаще не ходим (например, при нескольких отчётах подряд)
+CARDS_FULL_RESYNC_DAYS = 7
+
+STATE_CURSOR = "wb_cards.cursor"
+STATE_LAST_SYNC = "wb_cards.last_sync"
+STATE_LAST_FULL_SYNC = "wb_cards.last_full_sync"
+
+
+def _state_key(key: str) -> str:
+    # курсоры у каждого кабинета свои; у default ключи прежние
+    acc = accounts.current_id()
+    return key if acc == accounts.DEFAULT_ACCOUNT_ID else f"{key}@{acc}"
+
+
+def _headers() -> dict:
+    return {
+        "Authorization": f"Bearer {accounts.current().wb_token}",
+        "Content-Type": "application/json"
+    }
+
+
+def _card_row(c: dict) -> tuple:
+    return (
+        int(c["nmID"]),
+        c.get("imtID"),
+        c.get("vendorCode"),
+        c.get("subjectID"),
+        c.get("subjectName"),
+        c.get("brand"),
+        c.get("title"),
+        c.get("updatedAt"),
+    )
+
+
+def _iter_pages(path: str, cursor: dict, ascending: Optional[bool] = None):
+    """
+    Страницы Content API по курсору: отдаёт (cards, cursor_из_ответа).
+    """
+    url = f"{CONTENT_BASE}{path}"
+    cursor = dict(cursor, limit=PAGE_LIMIT)
+    while True:
+        settings = {
+            "cursor": cursor,
+            "filter": {
+                "withPhoto": -1
+            }
+        }
+        if ascending is not None:
+            settings["sort"] = {"ascending": ascending}
+
+        r = wb_http.post("content", url, headers=_headers(), json={"settings": settings}, timeout=30)
+        r.raise_for_status()
+        data = r.json()
+
+        cards = data.get("cards") or []
+        resp_cursor = data.get("cursor") or {}
+        if not cards:
+            break
+        yield cards, resp_cursor
+
+        if resp_cursor.get("total", 0) < PAGE_LIMIT:
+            break
+        cursor = {k: v for k, v in resp_cursor.items() if k != "total"}
+        cursor["limit"] = PAGE_LIMIT
+
+
+@instrument.span("wb.cards_sync")
+def sync_cards(full: bool = False) -> int:
+    """
+    Синхронизация индекса карточек. Возвращает число обновлённых карточек.
+    """
+    now = time.time()
+    last_full = float(storage.get_sync_state(_state_key(STATE_LAST_FULL_SYNC)) or 0)
+    saved_cursor = storage.get_sync_state(_state_key(STATE_CURSOR))
+    full = full or not saved_cursor or now - last_full > CARDS_FULL_RESYNC_DAYS * 86400
+
+    cursor = {} if full else json.loads(saved_cursor)
+    updated = 0
+    last_cursor = cursor
+    for cards, resp_cursor in _iter_pages("/content/v2/get/cards/list", cursor, ascending=True):
+        updated += storage.upsert_cards((_card_row(c) for c in cards if "nmID" in c), seen_at=now)
+        if resp_cursor.get("updatedAt") and resp_cursor.get("nmID"):
+            last_cursor = {"updatedAt": resp_cursor["updatedAt"], "nmID": resp_cursor["nmID"]}
+
+    # корзина: карточки там формально есть, но в отчёты не нужны
+    trashed = []
+    for cards, _ in _iter_pages("/content/v2/get/cards/trash", {}):
+        trashed.extend(int(c["nmID"]) for c in cards if "nmID" in c)
+    if trashed:
+        storage.mark_cards_deleted(trashed)
+
+    if full:
+        storage.mark_unseen_cards_deleted(now)
+        storage.set_sync_state(_state_key(STATE_LAST_FULL_SYNC), str(now))
+    if last_cursor:
+        storage.set_sync_state(_state_key(STATE_CURSOR), json.dumps(last_cursor))
+    storage.set_sync_state(_state_key(STATE_LAST_SYNC), str(now))
+    instrument.count("wb.cards_updated", updated)
+    return updated
+
+
+def get_nm_ids(max_age_sec: float = CARDS_SYNC_MIN_INTERVAL_SEC) -> List[int]:
+    """
+    Актуальный список nmID продавца: досинхронизирует индекс, если он старше max_age_sec.
+    """
+    last = float(storage.get_sync_state(_state_key(STATE_LAST_SYNC)) or 0)
+    if time.time() - last >= max_age_sec:
+        sync_cards()
+    return storage.get_active_nm_ids()
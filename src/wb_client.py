@@ -1,88 +1,54 @@
-from dataclasses import dataclass
-from typing import Dict, Optional, List
+from dataclasses import dataclass, field
+from typing import Dict, Optional, List, Tuple, Iterator
+from contextlib import contextmanager
 import io
 import csv
 import time
+import codecs
 import zipfile
+import tempfile
+import itertools
 import uuid
 import os
-import requests
-import json
+import hashlib
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor
 
 
-from src.config import WB_TOKEN
+from src import accounts, ads, instrument, report_archive, storage, wb_cards, wb_http
+from src.config import (
+    WB_ANALYTICS_BASE, WB_PARSE_ENGINE, WB_REPORT_MAX_WAIT, WB_NM_CHUNK_SIZE, WB_SETTLE_DAYS,
+)
+from src.report_encoding import detect_encoding
 
-BASE = "https://seller-analytics-api.wildberries.ru"
-ADS_BASE = "https://advert-api.wildberries.ru"
+BASE = WB_ANALYTICS_BASE
 
-def fetch_ads_spend_by_day(date_from: str, date_to: str) -> Dict[str, float]:
-    token = WB_TOKEN   # ← ВОТ ЭТО КЛЮЧЕВО
-    if not token:
-        return {}
-
-    url = f"{ADS_BASE}/adv/v1/upd"
-    headers = {"Authorization": token}
-    params = {"from": date_from, "to": date_to}
-
-    try:
-        r = requests.get(url, headers=headers, params=params, timeout=30)
-        r.raise_for_status()
-        items = r.json() or []
-    except Exception:
-        return {}
+DOWNLOAD_CHUNK = 1 << 16          # 64 KB на кусок при скачивании отчёта
+ENCODING_SNIFF_BYTES = 1 << 16    # столько байт смотрим, чтобы угадать кодировку
+PANDAS_CHUNK_ROWS = 200_000       # строк CSV на одну пачку в pandas-парсере
 
-    out = {}
-    for it in items:
-        t = it.get("updTime")
-        s = it.get("updSum", 0) or 0
-        if not t:
-            continue
-        day = t[:10]
-        out[day] = out.get(day, 0.0) + float(s)
-    return out
+# опрос статуса отчёта
+POLL_MIN_SEC = 5.0
+POLL_MAX_SEC = 60.0
+REPORT_DEFAULT_GEN_SEC = 30.0        # пока нет своей истории
+REPORT_HISTORY_SIZE = 20             # по скольким последним отчётам считаем медиану
+REPORT_UNKNOWN_GRACE_SEC = 60.0      # сразу после создания WB может ещё не отдавать статус
+REPORT_RESUME_MAX_AGE_SEC = 24 * 3600  # отчёты старше не докачиваем — заказываем заново
 
 
-def fetch_all_nm_ids() -> list[int]:
+def fetch_ads_spend_by_day(date_from: str, date_to: str) -> Dict[str, float]:
     """
-    Получаем все nmID продавца через Content API WB
+    Затраты на рекламу по дням (по кампаниям и с кэшем закрытых дней — src/ads.py).
+    Дня нет в ответе — данных нет (ошибка API, нет токена); 0.0 — затрат действительно не было.
     """
-    url = "https://content-api.wildberries.ru/content/v2/get/cards/list"
-    headers = {
-        "Authorization": f"Bearer {WB_TOKEN}",
-        "Content-Type": "application/json"
-    }
-
-    nm_ids = []
-    cursor = {"limit": 100}
-
-    while True:
-        payload = {
-            "settings": {
-                "cursor": cursor,
-                "filter": {
-                    "withPhoto": -1
-                }
-            }
-        }
-
-        r = requests.post(url, headers=headers, json=payload, timeout=30)
-        r.raise_for_status()
-        data = r.json()
-
-        cards = data.get("cards", [])
-        if not cards:
-            break
-
-        for c in cards:
-            if "nmID" in c:
-                nm_ids.append(c["nmID"])
-
-        cursor = data["cursor"]
-        if cursor.get("total", 0) < cursor.get("limit", 100):
-            break
+    return ads.spend_by_day(date_from, date_to)
 
-    return sorted(set(nm_ids))
 
+@dataclass
+class WBNmDay:
+    open: int = 0
+    orders: int = 0
 
 
 @dataclass
@@ -91,12 +57,14 @@ class WBDay:
     open: int = 0         # переходы (открытия/переходы в карточку)
     orders: int = 0       # заказы
     ad_spend: Optional[float] = None  # затраты на рекламу (если будет в отчете)
+    by_nm: Dict[int, WBNmDay] = field(default_factory=dict)  # те же цифры в разрезе nmID
 
 
 def _headers() -> dict:
-    if not WB_TOKEN:
-        raise RuntimeError("WB_TOKEN is empty. Put it into .env")
-    return {"Authorization": WB_TOKEN}
+    token = accounts.current().wb_token
+    if not token:
+        raise RuntimeError(f"WB token is empty for account '{accounts.current_id()}'. Put WB_TOKEN into .env")
+    return {"Authorization": token}
 
 
 def _safe_int(x) -> int:
@@ -124,30 +92,7 @@ def _safe_float(x) -> Optional[float]:
 
 from datetime import datetime, timedelta
 
-NMIDS_PATH = os.path.join("data", "wb_nm_ids.json")
-
-def save_nm_ids(nm_ids: list[int]) -> None:
-    os.makedirs("data", exist_ok=True)
-    with open(NMIDS_PATH, "w", encoding="utf-8") as f:
-        json.dump(sorted(set(nm_ids)), f, ensure_ascii=False, indent=2)
-
-def refresh_nm_ids_cache(max_age_hours: int = 24) -> list[int]:
-    os.makedirs("data", exist_ok=True)
-
-    if os.path.exists(NMIDS_PATH):
-        mtime = datetime.fromtimestamp(os.path.getmtime(NMIDS_PATH))
-        if datetime.now() - mtime < timedelta(hours=max_age_hours):
-            return load_nm_ids()
-
-    nm_ids = fetch_all_nm_ids()
-    save_nm_ids(nm_ids)
-    return nm_ids
-
-def load_nm_ids() -> list[int]:
-    with open("data/wb_nm_ids.json", "r", encoding="utf-8") as f:
-        return json.load(f)
-
-def _create_detail_history_report(start: str, end: str, tz: str = "Europe/Moscow") -> str:
+def _create_detail_history_report(start: str, end: str, nm_ids: List[int], tz: str = "Europe/Moscow") -> str:
     """
     POST /api/v2/nm-report/downloads
     reportType=DETAIL_HISTORY_REPORT (Sales funnel report by WB articles)
@@ -162,7 +107,7 @@ def _create_detail_history_report(start: str, end: str, tz: str = "Europe/Moscow
         "params": {
             # В доке: nmIDs можно оставить пустым, чтобы получить отчет по всем товарам
             # (для некоторых типов он обязателен, но для DETAIL_HISTORY_REPORT допускают пустой для "все товары")
-            "nmIDs": refresh_nm_ids_cache(),
+            "nmIDs": nm_ids,
             "subjectIds": [],
             "brandNames": [],
             "tagIds": [],
@@ -174,143 +119,722 @@ def _create_detail_history_report(start: str, end: str, tz: str = "Europe/Moscow
         }
     }
 
-    r = requests.post(url, json=payload, headers=_headers(), timeout=45)
+    r = wb_http.post("nm-report", url, json=payload, headers=_headers(), timeout=45)
     r.raise_for_status()
     return download_id
 
 
-def _get_report_status(download_id: str) -> Optional[dict]:
+def _get_report_statuses(download_ids: List[str]) -> Dict[str, dict]:
     """
     GET /api/v2/nm-report/downloads?filter[downloadIds]=...
+    Статусы сразу нескольких отчётов одним запросом (лимит nm-report общий).
     """
     url = f"{BASE}/api/v2/nm-report/downloads"
-    params = {"filter[downloadIds]": download_id}
-    r = requests.get(url, params=params, headers=_headers(), timeout=45)
+    params = [("filter[downloadIds]", d) for d in download_ids]
+    r = wb_http.get("nm-report", url, params=params, headers=_headers(), timeout=45)
     r.raise_for_status()
     js = r.json()
-    data = js.get("data", [])
-    if not data:
-        return None
-    return data[0]
+    return {it.get("id"): it for it in (js.get("data") or []) if it.get("id")}
 
 
-def _download_report_zip(download_id: str) -> bytes:
+def _download_report_zip(download_id: str, dest_path: str) -> str:
     """
     GET /api/v2/nm-report/downloads/file/{downloadId}
-    ZIP -> CSV inside
+    ZIP -> CSV inside.
+    Качаем потоком сразу в файл (через временный рядом с dest_path), в память целиком не читаем.
     """
     url = f"{BASE}/api/v2/nm-report/downloads/file/{download_id}"
-    r = requests.get(url, headers=_headers(), timeout=90)
-    r.raise_for_status()
-    return r.content
+    d = os.path.dirname(dest_path) or "."
+    os.makedirs(d, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(prefix="wb_report_", suffix=".part", dir=d)
+    size = 0
+    try:
+        with instrument.span("wb.report_download"), os.fdopen(fd, "wb") as f:
+            with wb_http.get("nm-report", url, headers=_headers(), timeout=90, stream=True) as r:
+                r.raise_for_status()
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                    if chunk:
+                        f.write(chunk)
+                        size += len(chunk)
+        os.replace(tmp_path, dest_path)
+        instrument.count("wb.report_download_bytes", size)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return dest_path
+
+
+def _expected_generation_sec() -> float:
+    """
+    Типичное время генерации отчёта по истории (медиана последних), иначе — дефолт.
+    """
+    times = sorted(t for t in storage.get_report_generation_times(REPORT_HISTORY_SIZE) if t > 0)
+    if not times:
+        return REPORT_DEFAULT_GEN_SEC
+    return times[len(times) // 2]
+
+
+def _next_poll_delay(elapsed: float, expected: float, polls: int) -> float:
+    """
+    Когда проверять статус в следующий раз.
+    До ожидаемого времени готовности — спим почти до него (первая проверка чуть раньше медианы),
+    после — интервал растёт (1.5x), чтобы медленные дни не съедали лимит nm-report.
+    Частота всё равно ограничена token bucket'ом в wb_http.
+    """
+    if elapsed < expected * 0.9:
+        return max(POLL_MIN_SEC, expected * 0.9 - elapsed)
+    return min(POLL_MAX_SEC, max(POLL_MIN_SEC, expected * 0.25) * (1.5 ** min(polls, 8)))
 
 
-def _wait_and_download_csv(download_id: str, max_wait_sec: int = 180) -> str:
+@dataclass
+class ReportJob:
+    report_key: str
+    start: str
+    end: str
+    nm_ids: List[int]
+    dest_path: str
+    download_id: Optional[str] = None
+    created_at: float = 0.0
+    waiting_since: float = 0.0  # когда этот запуск начал ждать отчёт (от него считается max_wait_sec)
+    next_poll_at: float = 0.0
+    polls: int = 0
+    resume_after: float = 0.0  # заказанные раньше не докачиваем (refresh: нужны свежие цифры)
+
+
+def _chunk_report_key(start: str, end: str, nm_ids: List[int]) -> str:
+    h = hashlib.sha1(",".join(map(str, nm_ids)).encode()).hexdigest()[:12]
+    return f"DETAIL_HISTORY_REPORT:{start}:{end}:{h}"
+
+
+def _iter_report_zips(
+    jobs: List[ReportJob],
+    max_wait_sec: int,
+    max_pending: Optional[int] = None,
+    failed: Optional[List[Tuple[ReportJob, str]]] = None
+) -> Iterator[ReportJob]:
     """
-    Ждём SUCCESS, скачиваем ZIP, достаём CSV как текст (utf-8/utf-16)
-    Важно: методы nm-report лимитированы (3 запроса в минуту) — поэтому polling редкий.
+    Fan-out по кускам nmID (и окнам дат): заказываем отчёты по одному (в пределах лимита nm-report),
+    статусы всех ждущих проверяем одним запросом и отдаём задание, как только его ZIP
+    скачан (job.dest_path). Итоговая задержка ~ самый медленный кусок, а не сумма.
+    Уже заказанные прошлым запуском (PENDING в wb_report_jobs) — докачиваем, не заказывая заново.
+    По таймауту все незавершённые downloadId остаются в wb_report_jobs для следующего запуска.
+    max_pending — сколько отчётов одновременно генерируется у WB (None — без ограничения).
+    failed — если передан, FAILED/таймаут куска не прерывает остальные: (job, ошибка) кладётся туда.
     """
-    waited = 0
-    while waited <= max_wait_sec:
-        info = _get_report_status(download_id)
-        if info and info.get("status") == "SUCCESS":
-            zbytes = _download_report_zip(download_id)
-            with zipfile.ZipFile(io.BytesIO(zbytes)) as zf:
-                # берем первый CSV
-                name = next((n for n in zf.namelist() if n.lower().endswith(".csv")), None)
-                if not name:
-                    raise RuntimeError("WB report zip has no CSV inside")
-                raw = zf.read(name)
+    expected = _expected_generation_sec()
+    nm_bucket = wb_http.bucket("nm-report")
+    todo: List[ReportJob] = []
+    pending: List[ReportJob] = []
+
+    for job in jobs:
+        found = storage.find_pending_report_job(
+            job.report_key, max(time.time() - REPORT_RESUME_MAX_AGE_SEC, job.resume_after)
+        )
+        if found:
+            job.download_id, _, job.created_at = found
+            job.waiting_since = time.time()
+            job.next_poll_at = job.created_at + expected * 0.9
+            pending.append(job)
+        else:
+            todo.append(job)
+
+    while todo or pending:
+        now = time.time()
+        due = [j for j in pending if j.next_poll_at <= now]
+
+        # новый кусок заказываем, если опрашивать пока некого (или токен есть и на то, и на другое)
+        can_create = todo and (max_pending is None or len(pending) < max_pending)
+        if can_create and (not due or nm_bucket.expected_wait(2) == 0):
+            job = todo.pop(0)
+            with instrument.span("wb.report_create"):
+                job.download_id = _create_detail_history_report(job.start, job.end, job.nm_ids, tz="Europe/Moscow")
+            job.created_at = job.waiting_since = time.time()
+            job.next_poll_at = job.created_at + _next_poll_delay(0.0, expected, 0)
+            storage.add_report_job(job.download_id, job.report_key, job.created_at)
+            pending.append(job)
+            continue
 
-            # пробуем декодировки
-            for enc in ("utf-8-sig", "utf-16", "cp1251"):
-                try:
-                    return raw.decode(enc)
-                except Exception:
-                    pass
-            # если совсем странно — вернем как latin-1 (не упадет) и дальше будем парсить
-            return raw.decode("latin-1", errors="replace")
+        if not due:
+            # ожидание генерации отчёта на стороне WB
+            with instrument.span("wb.report_wait"):
+                time.sleep(max(min(j.next_poll_at for j in pending) - now, 0.0))
+            continue
 
-        if info and info.get("status") == "FAILED":
-            raise RuntimeError(f"WB report generation FAILED for {download_id}")
+        with instrument.span("wb.report_poll"):
+            infos = _get_report_statuses([j.download_id for j in due])
+        now = time.time()
+        for job in due:
+            info = infos.get(job.download_id)
+            status = info.get("status") if info else None
+
+            if status == "SUCCESS":
+                storage.set_report_job_status(job.download_id, "SUCCESS", ready_at=now)
+                path = _download_report_zip(job.download_id, job.dest_path)
+                storage.set_report_job_status(job.download_id, "DONE", path=path)
+                pending.remove(job)
+                yield job
+                continue
+
+            if status == "FAILED":
+                storage.set_report_job_status(job.download_id, "FAILED")
+                error = f"WB report generation FAILED for {job.download_id}"
+                if failed is None:
+                    raise RuntimeError(error)
+                failed.append((job, error))
+                pending.remove(job)
+                continue
+
+            # created_at — только для grace: отчёт, заказанный прошлым запуском, ждём max_wait_sec
+            # с начала этого запуска, а не «уже просрочен» на первом же опросе
+            if info is None and now - job.created_at > REPORT_UNKNOWN_GRACE_SEC:
+                # WB уже не знает такой отчёт (удалён/просрочен) — заказываем этот кусок заново
+                storage.set_report_job_status(job.download_id, "EXPIRED")
+                pending.remove(job)
+                job.download_id = None
+                job.polls = 0
+                todo.append(job)
+                continue
+
+            waited = now - job.waiting_since
+            if waited >= max_wait_sec:
+                error = (
+                    f"WB report not ready in {max_wait_sec}s (downloadId={job.download_id}); "
+                    f"it is kept as pending and will be resumed on the next run"
+                )
+                if failed is None:
+                    raise RuntimeError(error)
+                failed.append((job, error))
+                pending.remove(job)
+                continue
+
+            job.polls += 1
+            job.next_poll_at = now + min(_next_poll_delay(waited, expected, job.polls), max_wait_sec - waited)
+
+
+def _merge_days(total: Dict[str, WBDay], part: Dict[str, WBDay]) -> None:
+    # куски по непересекающимся nmID — просто складываем
+    for dt, d in part.items():
+        t = total.get(dt)
+        if t is None:
+            total[dt] = d
+            continue
+        t.visibility += d.visibility
+        t.open += d.open
+        t.orders += d.orders
+        t.by_nm.update(d.by_nm)
 
-        # ждем и не долбим лимиты
-        time.sleep(20)
-        waited += 20
 
-    raise RuntimeError(f"WB report not ready in {max_wait_sec}s (downloadId={download_id})")
+def _spool_dir() -> str:
+    # скачанные, но ещё не разложенные в архив ZIP-ы: переживают таймаут/перезапуск
+    return os.path.join(accounts.data_dir(), "spool")
 
 
-def _parse_detail_history_csv(csv_text: str) -> Dict[str, WBDay]:
+def _report_jobs(
+    start: str,
+    end: str,
+    nm_ids: List[int],
+    resume_after: Optional[float] = None
+) -> Tuple[List[ReportJob], List[str]]:
     """
-    Парсим CSV, агрегируем по dt (дата) в суммарные:
-    - показы
-    - переходы/открытия
-    - заказы
-    - затраты (если есть колонка)
-    Названия колонок могут немного отличаться — ищем по набору возможных имен.
+    Куски окна [start, end] по WB_NM_CHUNK_SIZE nmID: (что заказать у WB, пути ZIP всех кусков
+    в порядке nmID). Кусок, чей ZIP уже лежит в spool/, заказывать не нужно.
+    resume_after (refresh) — spool не смотрим, заказываем все куски; докачиваем только
+    отчёты, заказанные не раньше resume_after.
+    """
+    size = max(WB_NM_CHUNK_SIZE, 1)
+    chunks = [nm_ids[i:i + size] for i in range(0, len(nm_ids), size)] or [[]]
+    jobs = []
+    paths = []
+    for chunk in chunks:
+        key = _chunk_report_key(start, end, chunk)
+        dest = os.path.join(_spool_dir(), f"wb_detail_history_{start}_{end}_{key.rsplit(':', 1)[1]}.zip")
+        paths.append(dest)
+        if resume_after is not None or not os.path.exists(dest):
+            jobs.append(ReportJob(report_key=key, start=start, end=end, nm_ids=chunk, dest_path=dest,
+                                  resume_after=resume_after or 0.0))
+    return jobs, paths
+
+
+def _fetch_detail_history(start: str, end: str, max_wait_sec: int, refresh: bool = False) -> Dict[str, WBDay]:
+    """
+    DETAIL_HISTORY_REPORT за [start, end] по всем nmID (см. iter_window_reports).
+    refresh — свежий отчёт: spool не используем, из заказанных докачиваем только те,
+    что заказаны не раньше max_wait_sec назад (обновление в течение дня).
+    """
+    resume_after = time.time() - max_wait_sec if refresh else None
+    for _, days in iter_window_reports([(start, end)], max_wait_sec, resume_after=resume_after):
+        return days
+    return {}
+
+
+Window = Tuple[str, str]
+
+
+def archived(start: str, end: str) -> bool:
+    """
+    Всё окно [start, end] есть в архиве устоявшимся — его можно взять replay_detail_history без WB.
+    """
+    return _archive_fetch_from(start, end) is None
+
+
+def iter_window_reports(
+    windows: List[Window],
+    max_wait_sec: int,
+    max_pending: Optional[int] = None,
+    failed: Optional[Dict[Window, str]] = None,
+    resume_after: Optional[float] = None
+) -> Iterator[Tuple[Window, Dict[str, WBDay]]]:
+    """
+    DETAIL_HISTORY_REPORT за несколько окон дат по всем nmID: кусками по WB_NM_CHUNK_SIZE,
+    куски всех окон — через один fan-out (_iter_report_zips). Каждый кусок парсится сразу
+    после скачивания и вливается в своё окно; окно, у которого пришли все куски, уходит
+    в архив и отдаётся как (window, days). Скачанные ZIP-ы лежат в spool/ папки аккаунта,
+    пока не придут все куски окна (повторный запуск после таймаута их не качает заново).
+    failed — если передан, окно с упавшим куском не отдаётся, а попадает туда {window: ошибка};
+    иначе ошибка куска — исключение.
+    """
+    nm_ids = wb_cards.get_nm_ids() if windows else []
+    # окно -> [пути кусков в порядке nmID, сколько кусков ещё ждём, накопленные дни]
+    state: Dict[Window, list] = {}
+    jobs: List[ReportJob] = []
+    for window in windows:
+        window_jobs, paths = _report_jobs(window[0], window[1], nm_ids, resume_after)
+        ordered = {j.dest_path for j in window_jobs}
+        days: Dict[str, WBDay] = {}
+        for path in paths:
+            if path not in ordered:
+                instrument.count("wb.report_cache_hits")
+                _merge_days(days, _parse_detail_history_file(path))
+        state[window] = [paths, len(window_jobs), days]
+        jobs.extend(window_jobs)
+
+    def complete(window: Window) -> Tuple[Window, Dict[str, WBDay]]:
+        paths, _, days = state.pop(window)
+        # куски — в порядке nmID, а не в порядке готовности: тогда у одинаковых данных одинаковый хэш
+        finish_window(paths, *window)
+        return window, days
+
+    for window in [w for w, st in state.items() if st[1] == 0]:
+        yield complete(window)
+
+    errors: Optional[List[Tuple[ReportJob, str]]] = None if failed is None else []
+    for job in _iter_report_zips(jobs, max_wait_sec, max_pending=max_pending, failed=errors):
+        window = (job.start, job.end)
+        st = state[window]
+        _merge_days(st[2], _parse_detail_history_file(job.dest_path))
+        st[1] -= 1
+        # у окна с упавшим куском счётчик до нуля не дойдёт
+        if st[1] == 0:
+            yield complete(window)
+
+    for job, error in errors or []:
+        failed.setdefault((job.start, job.end), error)
+
+
+def finish_window(paths: List[str], start: str, end: str) -> None:
+    """
+    Все куски окна скачаны: в архив, ZIP-ы из spool/ убираем (при ошибке архива — оставляем).
+    """
+    if _archive_reports(paths, start, end):
+        for path in paths:
+            os.remove(path)
+
+
+def _archive_reports(paths: List[str], start: str, end: str, fetched_at: Optional[float] = None) -> bool:
+    """
+    Разложить CSV окна [start, end] по дням в архив (src/report_archive.py).
+    Архив не должен ронять sync: при ошибке печатаем и возвращаем False (файлы остаются).
+    """
+    writer = report_archive.SliceWriter(start, end)
+    try:
+        with instrument.span("wb.archive_write"):
+            for path in paths:
+                with _open_report_text(path) as text:
+                    rows = _iter_csv_rows(text)
+                    header = next(rows, None)
+                    if header is not None:
+                        writer.add(header, _pick_report_columns(header)[0], rows)
+            res = writer.commit(fetched_at)
+    except Exception as e:
+        writer.discard()
+        instrument.count("wb.archive_errors")
+        print(f"[archive] failed to archive {start}..{end}: {type(e).__name__}: {e}")
+        return False
+    instrument.count("wb.archive_slices_new", res.new)
+    instrument.count("wb.archive_slices_same", res.same)
+    instrument.count("wb.archive_stored_bytes", res.stored_bytes)
+    return True
+
+
+# ZIP/CSV из версий до архива: data/wb_detail_history_<start>_<end>[_<hash куска>].(zip|csv)
+_LEGACY_REPORT_RE = re.compile(r"^wb_detail_history_(\d{4}-\d{2}-\d{2})_(\d{4}-\d{2}-\d{2})(?:_[0-9a-f]{12})?\.(?:zip|csv)$")
+
+
+def import_legacy_reports() -> int:
+    """
+    Старые файлы отчётов из папки аккаунта — в архив (от старых окон к новым), сами файлы удаляем.
+    Битые переименовываем в *.bad, чтобы не спотыкаться о них каждый запуск. Возвращает число окон.
+    """
+    data_dir = accounts.data_dir()
+    if not os.path.isdir(data_dir):
+        return 0
+    windows: Dict[Tuple[str, str], List[str]] = {}
+    for name in sorted(os.listdir(data_dir)):
+        m = _LEGACY_REPORT_RE.match(name)
+        if m:
+            windows.setdefault((m.group(1), m.group(2)), []).append(os.path.join(data_dir, name))
+
+    for (start, end), paths in sorted(windows.items(), key=lambda kv: (kv[0][1], kv[0][0])):
+        if _archive_reports(paths, start, end, fetched_at=max(os.path.getmtime(p) for p in paths)):
+            for path in paths:
+                os.remove(path)
+        else:
+            for path in paths:
+                os.replace(path, path + ".bad")
+    return len(windows)
+
+
+def archive_gc() -> Tuple[int, int]:
+    """
+    Retention архива + чистка spool от кусков, которые уже не докачать (см. REPORT_RESUME_MAX_AGE_SEC).
+    """
+    spool = _spool_dir()
+    if os.path.isdir(spool):
+        cutoff = time.time() - REPORT_RESUME_MAX_AGE_SEC
+        for name in os.listdir(spool):
+            path = os.path.join(spool, name)
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+    return report_archive.gc()
+
+
+def _archive_fetch_from(start: str, end: str) -> Optional[str]:
     """
+    С какого дня [start, end] придётся идти в WB (None — всё окно есть в архиве).
+    День берём из архива, если он уже устоялся в том отчёте, из которого взят срез
+    (отчёт заканчивался не раньше чем через WB_SETTLE_DAYS после дня), или если тот отчёт
+    был до того же end. С первого неподходящего дня и до end — запрос в WB, как раньше.
+    """
+    current = report_archive.current_slices(start, end)
+    d = datetime.fromisoformat(start).date()
+    d_end = datetime.fromisoformat(end).date()
+    while d <= d_end:
+        day = d.isoformat()
+        slice_ = current.get(day)
+        settled = (d + timedelta(days=max(WB_SETTLE_DAYS, 1))).isoformat()
+        if slice_ is None or slice_[1] < min(end, settled):
+            return day
+        d += timedelta(days=1)
+    return None
+
+
+def replay_detail_history(start: str, end: str, engine: Optional[str] = None) -> Dict[str, WBDay]:
+    """
+    [start, end] из архива через тот же парсер, без сети. Дней, которых нет в архиве, нет и в ответе.
+    """
+    engine = engine or _parse_engine()
+    current = report_archive.current_slices(start, end)
+    days: Dict[str, WBDay] = {}
+    with instrument.span("wb.archive_replay", engine=engine):
+        for header_line, raw in report_archive.open_replay([p for _, (p, _) in sorted(current.items())]):
+            with raw:
+                _merge_days(days, _parse_report_stream(raw, "utf-8", header_line, engine))
+    instrument.count("wb.archive_replay_days", len(current))
+    return days
+
+
+@contextmanager
+def _open_report_binary(path: str):
+    """
+    Открывает отчёт как бинарный поток: ZIP (берём первый CSV внутри) или уже распакованный CSV.
+    Отдаёт (поток, кодировка, первая строка). Ничего не читаем целиком.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            # берем первый CSV
+            name = next((n for n in zf.namelist() if n.lower().endswith(".csv")), None)
+            if not name:
+                raise RuntimeError("WB report zip has no CSV inside")
+            with zf.open(name) as raw:
+                prefix = raw.read(ENCODING_SNIFF_BYTES)
+            enc = detect_encoding(prefix)
+            with zf.open(name) as raw:
+                yield raw, enc, _first_line(prefix, enc)
+    else:
+        with open(path, "rb") as raw:
+            prefix = raw.read(ENCODING_SNIFF_BYTES)
+            enc = detect_encoding(prefix)
+            raw.seek(0)
+            yield raw, enc, _first_line(prefix, enc)
+
+
+def _first_line(prefix: bytes, enc: str) -> str:
+    text = codecs.getincrementaldecoder(enc)(errors="replace").decode(prefix, final=False)
+    return text.split("\n", 1)[0]
+
+
+def _guess_delimiter(line: str) -> str:
     # delimiter у WB чаще ';'
-    sample = csv_text[:2000]
-    delim = ";" if sample.count(";") >= sample.count(",") else ","
+    return ";" if line.count(";") >= line.count(",") else ","
+
+
+@contextmanager
+def _open_report_text(path: str):
+    """
+    То же, но текстовым потоком — для построчного csv.reader.
+    """
+    with _open_report_binary(path) as (raw, enc, _):
+        with io.TextIOWrapper(raw, encoding=enc, errors="replace", newline="") as text:
+            yield text
+
+
+def _iter_csv_rows(text) -> Iterator[List[str]]:
+    """
+    csv.reader поверх текстового потока; разделитель угадываем по первой строке
+    (у WB чаще ';').
+    """
+    first = text.readline()
+    if not first:
+        return
+    yield from csv.reader(itertools.chain([first], text), delimiter=_guess_delimiter(first))
+
 
-    reader = csv.DictReader(io.StringIO(csv_text), delimiter=delim)
-    headers = [h.strip() for h in (reader.fieldnames or [])]
+def _pick_report_columns(header: List[str]) -> Tuple[int, Optional[int], Optional[int], Optional[int]]:
+    """
+    Индексы колонок (dt, nmID, переходы, заказы) по заголовку отчёта.
+    Названия колонок могут немного отличаться — ищем по набору возможных имен.
+    """
+    headers = [h.strip().lstrip("\ufeff") for h in header]
+    low = {h.lower(): i for i, h in enumerate(headers)}
 
-    def pick_col(candidates: List[str]) -> Optional[str]:
-        low = {h.lower(): h for h in headers}
+    def pick_col(candidates: List[str]) -> Optional[int]:
         for c in candidates:
             if c.lower() in low:
                 return low[c.lower()]
         return None
 
     # кандидаты под разные возможные заголовки
-    col_date = "dt"
-    col_vis = None
+    col_date = pick_col(["dt"])
+    col_nm = pick_col(["nmID", "nmId", "nm_id", "артикул wb", "артикул"])
     col_open = pick_col(["openCardCount", "open", "opens", "openCount", "clicks", "переходы", "открытия", "открытия карточки"])
     col_orders = pick_col(["ordersCount", "orders", "orderCount", "заказы", "заказали", "количество заказов"])
-    col_spend = None
 
-    if not col_date:
+    if col_date is None:
         # чтобы не гадать молча
         raise RuntimeError(f"WB CSV: cannot find date column. Headers: {headers[:40]}")
 
+    return col_date, col_nm, col_open, col_orders
+
+
+def _parse_detail_history_rows(rows: Iterator[List[str]]) -> Dict[str, WBDay]:
+    """
+    Агрегируем строки CSV (первая — заголовок) по dt (дата) в суммарные:
+    - переходы/открытия
+    - заказы
+    и то же самое по (dt, nmID) в WBDay.by_nm.
+    Строки обрабатываются по одной, память не зависит от размера отчёта.
+    """
+    header = next(rows, None)
+    if header is None:
+        return {}
+    col_date, col_nm, col_open, col_orders = _pick_report_columns(header)
+
     out: Dict[str, WBDay] = {}
 
-    for row in reader:
-        dt = (row.get(col_date) or "").strip()
+    for row in rows:
+        if len(row) <= col_date:
+            continue
+        dt = row[col_date].strip()
         if not dt:
             continue
 
-        day = out.get(dt, WBDay())
-        day.open += _safe_int(row.get(col_open) if col_open else row.get("openCardCount"))
-        day.orders += _safe_int(row.get(col_orders) if col_orders else row.get("ordersCount"))
-        out[dt] = day
+        day = out.get(dt)
+        if day is None:
+            day = out[dt] = WBDay()
+        opens = _safe_int(row[col_open]) if col_open is not None and col_open < len(row) else 0
+        orders = _safe_int(row[col_orders]) if col_orders is not None and col_orders < len(row) else 0
+        day.open += opens
+        day.orders += orders
+
+        if col_nm is not None and col_nm < len(row):
+            nm = _safe_int(row[col_nm])
+            if nm:
+                nm_day = day.by_nm.get(nm)
+                if nm_day is None:
+                    nm_day = day.by_nm[nm] = WBNmDay()
+                nm_day.open += opens
+                nm_day.orders += orders
 
     return out
 
 
-def fetch_wb_14d(start: str, end: str) -> Dict[str, WBDay]:
+def _to_int_column(col):
     """
-    Главная функция для main.py:
-    WB 14 дней по дням через Seller Analytics CSV (Jam) DETAIL_HISTORY_REPORT.
+    Векторный аналог _safe_int для колонки pandas:
+    "1 234", "1\\u00A0234", "3,5" -> 1234, 1234, 3; мусор и пустое -> 0.
+    Если C-парсер read_csv уже распознал числа — только обрезаем дробную часть.
+    Иначе нормализуем строки через numpy.char (без Python-цикла по значениям).
     """
-    # кэшируем CSV, чтобы не жечь лимиты и не создавать много отчётов
-    cache_path = os.path.join("data", f"wb_detail_history_{start}_{end}.csv")
-    os.makedirs("data", exist_ok=True)
-
-    if os.path.exists(cache_path):
-        with open(cache_path, "r", encoding="utf-8", errors="ignore") as f:
-            csv_text = f.read()
+    import numpy as np
+    import pandas as pd
+
+    if len(col) == 0:
+        # np.char.replace на пустом массиве падает (zero-size array ... maximum)
+        return np.zeros(0, dtype="int64")
+    if pd.api.types.is_numeric_dtype(col.dtype):
+        num = col.to_numpy(dtype="float64", na_value=0.0)
     else:
-        download_id = _create_detail_history_report(start, end, tz="Europe/Moscow")
-        csv_text = _wait_and_download_csv(download_id, max_wait_sec=240)
-        with open(cache_path, "w", encoding="utf-8") as f:
-            f.write(csv_text)
+        u = col.to_numpy(dtype="U32", na_value="")
+        for ch in (" ", "\u00A0"):
+            u = np.char.replace(u, ch, "")
+        u = np.char.replace(u, ",", ".")
+        u[u == ""] = "0"
+        try:
+            num = u.astype("float64")
+        except ValueError:
+            # совсем мусорные значения — по одному не падаем, считаем нулём
+            num = pd.to_numeric(pd.Series(u), errors="coerce").to_numpy()
+    # "nan"/"inf" в ячейке _safe_int тоже превращает в 0
+    num = np.nan_to_num(num, nan=0.0, posinf=0.0, neginf=0.0)
+    return np.trunc(num).astype("int64")
+
+
+def _parse_detail_history_pandas(raw, encoding: str, header_line: str, chunk_rows: int = PANDAS_CHUNK_ROWS) -> Dict[str, WBDay]:
+    """
+    Колоночный вариант _parse_detail_history_rows на pandas:
+    C-парсер read_csv читает байты сам и только нужные колонки, пачками по chunk_rows строк;
+    числа нормализуем векторно, суммы по (dt, nmID) считаем groupby. Результат тот же — Dict[str, WBDay].
+    """
+    import pandas as pd
+
+    if not header_line.strip():
+        return {}
+    delim = _guess_delimiter(header_line)
+    header = next(csv.reader([header_line.rstrip("\r")], delimiter=delim))
+    col_date, col_nm, col_open, col_orders = _pick_report_columns(header)
+
+    cols = {"dt": col_date}
+    for name, idx in (("nm", col_nm), ("open", col_open), ("orders", col_orders)):
+        if idx is not None:
+            cols[name] = idx
+    names = {idx: name for name, idx in cols.items()}
+
+    reader = pd.read_csv(
+        raw,
+        sep=delim,
+        header=0,
+        usecols=sorted(names),
+        encoding=encoding,
+        encoding_errors="replace",
+        decimal=",",
+        keep_default_na=False,
+        na_values=[""],
+        dtype={col_date: str},
+        chunksize=chunk_rows,
+    )
+
+    parts = []
+    for chunk in reader:
+        if chunk.empty:
+            # отчёт из одного заголовка (пустой кусок nmID, пустой день из архива) — как csv-движок
+            continue
+        chunk.columns = [names[i] for i in sorted(names)]
+        frame = pd.DataFrame({"dt": chunk["dt"]})
+        for name in ("nm", "open", "orders"):
+            frame[name] = _to_int_column(chunk[name]) if name in chunk else 0
+        frame = frame.dropna(subset=["dt"])
+        parts.append(frame.groupby(["dt", "nm"], sort=False)[["open", "orders"]].sum())
+
+    if not parts:
+        return {}
+    total = pd.concat(parts).reset_index()
+    # пробелы вокруг даты чистим уже на агрегатах — их в разы меньше, чем строк
+    total["dt"] = total["dt"].str.strip()
+    total = total[total["dt"] != ""].groupby(["dt", "nm"], sort=False)[["open", "orders"]].sum()
+
+    out: Dict[str, WBDay] = {}
+    for (dt, nm), o, n in zip(total.index, total["open"].tolist(), total["orders"].tolist()):
+        day = out.get(dt)
+        if day is None:
+            day = out[dt] = WBDay()
+        day.open += o
+        day.orders += n
+        if nm:
+            day.by_nm[int(nm)] = WBNmDay(open=o, orders=n)
+    return out
+
+
+def _parse_engine() -> str:
+    """
+    WB_PARSE_ENGINE: pandas | csv | auto (по умолчанию: pandas, если он установлен).
+    """
+    if WB_PARSE_ENGINE in ("pandas", "csv"):
+        return WB_PARSE_ENGINE
+    try:
+        import pandas  # noqa: F401
+        return "pandas"
+    except ImportError:
+        return "csv"
+
+
+def _parse_detail_history_csv(csv_text: str) -> Dict[str, WBDay]:
+    """
+    То же самое для CSV, который уже лежит в памяти строкой.
+    """
+    return _parse_detail_history_rows(_iter_csv_rows(io.StringIO(csv_text)))
+
 
-    days = _parse_detail_history_csv(csv_text)
+def _parse_report_stream(raw, enc: str, header_line: str, engine: str) -> Dict[str, WBDay]:
+    if engine == "pandas":
+        return _parse_detail_history_pandas(raw, enc, header_line)
+    with io.TextIOWrapper(raw, encoding=enc, errors="replace", newline="") as text:
+        return _parse_detail_history_rows(_iter_csv_rows(text))
+
+
+def _parse_detail_history_file(path: str, engine: Optional[str] = None) -> Dict[str, WBDay]:
+    engine = engine or _parse_engine()
+    with instrument.span("wb.parse", engine=engine):
+        with _open_report_binary(path) as (raw, enc, header_line):
+            days = _parse_report_stream(raw, enc, header_line, engine)
+    instrument.count("wb.parse_rows", sum(len(d.by_nm) or 1 for d in days.values()))
+    instrument.count("wb.parse_bytes", os.path.getsize(path))
+    return days
+
+
+def fetch_wb_14d(start: str, end: str, refresh: bool = False) -> Dict[str, WBDay]:
+    """
+    Главная функция для main.py:
+    WB 14 дней по дням через Seller Analytics CSV (Jam) DETAIL_HISTORY_REPORT.
+    Устоявшиеся дни берём из архива отчётов (src/report_archive.py), у WB спрашиваем
+    только хвост окна. Затраты на рекламу (другой API, свой лимит) запрашиваем параллельно,
+    пока отчёт генерируется.
+    refresh — обновление в течение дня: досчитывающийся хвост (последние WB_SETTLE_DAYS дней)
+    заказываем у WB заново, даже если он уже есть в архиве / spool за тот же end.
+    """
+    import_legacy_reports()
+
+    with instrument.span("wb.fetch"), ThreadPoolExecutor(max_workers=1, thread_name_prefix="wb-ads") as pool:
+        # copy_context: в потоке пула тот же аккаунт (токен, лимиты)
+        spend_future = pool.submit(contextvars.copy_context().run, fetch_ads_spend_by_day, start, end)
+
+        fetch_from = _archive_fetch_from(start, end)
+        if refresh:
+            tail = max(start, (datetime.fromisoformat(end).date() - timedelta(days=WB_SETTLE_DAYS)).isoformat())
+            if fetch_from is None or fetch_from > tail:
+                fetch_from = tail
+        days: Dict[str, WBDay] = {}
+        if fetch_from != start:
+            archived_to = end if fetch_from is None else \
+                (datetime.fromisoformat(fetch_from).date() - timedelta(days=1)).isoformat()
+            days = replay_detail_history(start, archived_to)
+        if fetch_from is not None:
+            _merge_days(days, _fetch_detail_history(fetch_from, end, max_wait_sec=WB_REPORT_MAX_WAIT, refresh=refresh))
+            archive_gc()
+
+        spend_map = spend_future.result()
 
-    spend_map = fetch_ads_spend_by_day(start, end)
     for dt, d in days.items():
         if dt in spend_map:
             d.ad_spend = spend_map[dt]
@@ -318,5 +842,54 @@ def fetch_wb_14d(start: str, end: str) -> Dict[str, WBDay]:
     return days
 
 
-    return _parse_detail_history_csv(csv_text)
+def plan_incremental_window(
+    start: str,
+    end: str,
+    known_dates: List[str],
+    settle_days: int = 3
+) -> Tuple[str, str]:
+    """
+    Какой кусок [start, end] реально надо запросить у WB.
+    Последние settle_days дней перезапрашиваем всегда (данные ещё досчитываются),
+    более старые — только если их нет в БД.
+    """
+    d_start = datetime.fromisoformat(start).date()
+    d_end = datetime.fromisoformat(end).date()
+    settle_from = d_end - timedelta(days=max(settle_days, 1) - 1)
+
+    known = set(known_dates)
+    fetch_from = max(settle_from, d_start)
+    d = d_start
+    while d < settle_from:
+        if d.isoformat() not in known:
+            fetch_from = d
+            break
+        d += timedelta(days=1)
+
+    return fetch_from.isoformat(), d_end.isoformat()
 
+
+def fetch_wb_incremental(
+    start: str,
+    end: str,
+    known_dates: List[str],
+    settle_days: int = 3,
+    refresh: bool = False
+) -> Dict[str, WBDay]:
+    """
+    Инкрементальная синхронизация: вместо всего окна [start, end]
+    запрашиваем отчёт только по недостающим дням + "хвосту", который ещё меняется.
+    Дни внутри запрошенного окна, которых нет в отчёте, возвращаем нулевыми —
+    иначе они так и остались бы "недостающими" и расширяли окно на каждом запуске.
+    refresh — хвост берём свежим отчётом WB, а не из архива (см. fetch_wb_14d).
+    """
+    fetch_from, fetch_to = plan_incremental_window(start, end, known_dates, settle_days)
+    days = fetch_wb_14d(fetch_from, fetch_to, refresh=refresh)
+
+    d = datetime.fromisoformat(fetch_from).date()
+    d_end = datetime.fromisoformat(fetch_to).date()
+    while d <= d_end:
+        days.setdefault(d.isoformat(), WBDay())
+        d += timedelta(days=1)
+
+    return days
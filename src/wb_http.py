@@ -0,0 +1,105 @@
+"""
+Общий HTTP-слой для WB API: одна requests.Session (keep-alive, пул соединений)
+и token bucket на каждое "семейство" эндпоинтов со своими лимитами.
+Лимиты WB считаются по токену, поэтому bucket'ы отдельные для каждого аккаунта.
+"""
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src import accounts, instrument
+from src.ratelimit import TokenBucket
+
+# лимиты из документации WB: (запросов в секунду, размер "пачки")
+LIMITS: Dict[str, tuple] = {
+    "nm-report": (3 / 60, 3),     # seller-analytics /api/v2/nm-report/*: 3 запроса в минуту
+    "content": (100 / 60, 5),     # content-api cards/list: 100 запросов в минуту
+    "adv": (1.0, 1),              # advert-api /adv/v1/upd: 1 запрос в секунду
+    "adv-info": (5.0, 5),         # advert-api /adv/v1/promotion/adverts: 5 запросов в секунду
+}
+DEFAULT_LIMIT = (1.0, 1)
+
+MAX_RETRIES = 3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+
+def session() -> requests.Session:
+    global _session
+    with _lock:
+        if _session is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _session = s
+        return _session
+
+
+def bucket(family: str, account_id: Optional[str] = None) -> TokenBucket:
+    """
+    Bucket семейства для аккаунта (по умолчанию — текущего).
+    """
+    key = (account_id or accounts.current_id(), family)
+    with _lock:
+        b = _buckets.get(key)
+        if b is None:
+            rate, capacity = LIMITS.get(family, DEFAULT_LIMIT)
+            b = _buckets[key] = TokenBucket(rate, capacity)
+        return b
+
+
+def _retry_after(r: requests.Response, attempt: int) -> float:
+    # WB отдаёт X-Ratelimit-Retry, стандартный — Retry-After (секунды)
+    for h in ("X-Ratelimit-Retry", "Retry-After"):
+        v = r.headers.get(h)
+        if v:
+            try:
+                return max(float(v), 0.0)
+            except ValueError:
+                pass
+    return min(2 ** attempt * 5.0, 60.0)
+
+
+def request(family: str, method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Запрос через общую сессию с учётом лимита family.
+    На 429/5xx ждём (Retry-After / экспоненциально) и повторяем до MAX_RETRIES раз.
+    raise_for_status — на вызывающем, как и раньше.
+    """
+    b = bucket(family)
+    attempt = 0
+    while True:
+        with instrument.span("wb.ratelimit_wait", family=family):
+            b.acquire()
+        with instrument.span("wb.http", family=family):
+            r = session().request(method, url, **kwargs)
+        instrument.count("wb.http_requests", family=family, status=r.status_code)
+        if not kwargs.get("stream"):
+            instrument.count("wb.http_bytes", len(r.content), family=family)
+        if r.status_code not in RETRY_STATUSES or attempt >= MAX_RETRIES:
+            return r
+
+        delay = _retry_after(r, attempt)
+        instrument.count("wb.http_retries", family=family)
+        r.close()
+        if r.status_code == 429:
+            # лимит общий на семейство (в рамках токена) — притормаживаем все потоки аккаунта
+            b.pause(delay)
+        else:
+            time.sleep(delay)
+        attempt += 1
+
+
+def get(family: str, url: str, **kwargs) -> requests.Response:
+    return request(family, "GET", url, **kwargs)
+
+
+def post(family: str, url: str, **kwargs) -> requests.Response:
+    return request(family, "POST", url, **kwargs)